@@ -0,0 +1,224 @@
+"""
+Admission Control for GPU work
+Priority classes, per-user fair ordering, bounded queue depth and load shedding (503 +
+Retry-After) shared by the LLM scheduler and the Whisper gate
+"""
+
+import asyncio
+import contextvars
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Lower value = served first
+PRIORITY_INTERACTIVE = 0  # live text turns (tutor, practice text chat, boss)
+PRIORITY_VOICE = 1        # voice turns: STT + reply + TTS
+PRIORITY_TRANSLATE = 2    # on-demand helpers
+PRIORITY_REPORT = 3       # long generations nobody is watching token by token
+PRIORITY_BACKGROUND = 4   # history summaries and other work no request waits on
+
+# Share of the queue depth a class may fill before its requests are shed, so a burst of
+# low-priority work always leaves room for live conversations
+SHED_FRACTIONS = {
+    PRIORITY_INTERACTIVE: 1.0,
+    PRIORITY_VOICE: 0.9,
+    PRIORITY_TRANSLATE: 0.75,
+    PRIORITY_REPORT: 0.5,
+    PRIORITY_BACKGROUND: 0.25,
+}
+
+
+@dataclass(frozen=True)
+class WorkContext:
+    """Priority class and fairness key of the request on whose behalf work is queued"""
+    priority: int = PRIORITY_INTERACTIVE
+    user: Optional[str] = None
+
+
+# Set per HTTP request by AdmissionMiddleware; read wherever GPU work is queued
+current_work: contextvars.ContextVar = contextvars.ContextVar("current_work", default=WorkContext())
+
+
+class QueueFullError(Exception):
+    """Raised instead of queueing when a class's share of the queue is full"""
+
+    def __init__(self, retry_after: float, detail: str = "Server is busy, please retry shortly"):
+        super().__init__(detail)
+        self.retry_after = retry_after
+        self.detail = detail
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def admission_limit(max_depth: int, priority: int) -> int:
+    """How many queued items a request of this priority may find and still be admitted"""
+    return max(1, int(max_depth * SHED_FRACTIONS.get(priority, 1.0)))
+
+
+def fair_order(items: Sequence[Any], aging_seconds: float = 10.0, now: Optional[float] = None) -> List[Any]:
+    """
+    Serving order for items with .priority, .user and .enqueued_at (monotonic).
+
+    Priority class first; a waiting item is promoted one class per `aging_seconds` so
+    nothing starves. Within a class, users take turns: a user's n-th queued item ranks
+    behind every other user's (n-1)-th, then arrival order.
+    """
+    now = time.monotonic() if now is None else now
+    ranks: Dict[Any, int] = {}
+    keyed = []
+    for item in sorted(items, key=lambda i: i.enqueued_at):
+        priority = item.priority
+        if aging_seconds:
+            priority = max(0, priority - int((now - item.enqueued_at) / aging_seconds))
+        rank = ranks.get((priority, item.user), 0)
+        ranks[(priority, item.user)] = rank + 1
+        keyed.append(((priority, rank, item.enqueued_at), item))
+    keyed.sort(key=lambda pair: pair[0])
+    return [item for _, item in keyed]
+
+
+@dataclass
+class _Waiter:
+    priority: int
+    user: Optional[str]
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class PriorityGate:
+    """
+    Async semaphore whose waiters are served in fair_order, with a bounded waiting line.
+    Used for work that does not batch (Whisper decodes): `async with gate.slot(): ...`
+    """
+
+    def __init__(self, concurrency: int = 1, max_depth: int = 32, aging_seconds: float = 10.0):
+        self.concurrency = max(1, concurrency)
+        self.max_depth = max_depth
+        self.aging_seconds = aging_seconds
+        self._waiters: List[_Waiter] = []
+        self._active = 0
+        # Smoothed time a slot is held, for Retry-After estimates
+        self._hold_seconds = 1.0
+
+        self.admitted = 0
+        self.shed = 0
+
+    def retry_after(self, priority: int) -> Optional[float]:
+        """Seconds to back off if a request of this priority would be shed now, else None"""
+        if len(self._waiters) < admission_limit(self.max_depth, priority):
+            return None
+        return self._hold_seconds * (len(self._waiters) + 1) / self.concurrency
+
+    @asynccontextmanager
+    async def slot(self):
+        work = current_work.get()
+        delay = self.retry_after(work.priority)
+        if delay is not None:
+            self.shed += 1
+            raise QueueFullError(delay)
+        self.admitted += 1
+
+        if self._active < self.concurrency and not self._waiters:
+            self._active += 1
+        else:
+            waiter = _Waiter(work.priority, work.user, asyncio.get_running_loop().create_future())
+            self._waiters.append(waiter)
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    # Granted just as we were cancelled: hand the slot on
+                    self._release()
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                raise
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * (time.monotonic() - started)
+            self._release()
+
+    def _release(self):
+        self._active -= 1
+        while self._active < self.concurrency and self._waiters:
+            waiter = fair_order(self._waiters, self.aging_seconds)[0]
+            self._waiters.remove(waiter)
+            if waiter.future.done():
+                continue
+            self._active += 1
+            waiter.future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self._active,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "avg_hold_seconds": round(self._hold_seconds, 2),
+        }
+
+
+class AdmissionMiddleware:
+    """
+    Tags each request with its priority class (longest matching path prefix in `routes`)
+    and user (the `X-User-Id` header, else the client address), and sheds it with 503 +
+    Retry-After before any work starts when `retry_after(priority)` says the queues for
+    that class are full. Paths not in `routes` pass through untouched.
+    """
+
+    def __init__(self, app, routes: Dict[str, int], retry_after: Callable[[int], Optional[float]], user_header: str = "x-user-id"):
+        self.app = app
+        self.routes = sorted(routes.items(), key=lambda item: len(item[0]), reverse=True)
+        self.retry_after = retry_after
+        self.user_header = user_header.lower().encode("latin-1")
+
+    def _priority(self, path: str) -> Optional[int]:
+        for prefix, priority in self.routes:
+            if path.startswith(prefix):
+                return priority
+        return None
+
+    def _user(self, scope) -> Optional[str]:
+        for name, value in scope.get("headers") or []:
+            if name == self.user_header:
+                return value.decode("latin-1")
+        client = scope.get("client")
+        return client[0] if client else None
+
+    async def __call__(self, scope, receive, send):
+        priority = self._priority(scope["path"]) if scope["type"] == "http" else None
+        if priority is None:
+            await self.app(scope, receive, send)
+            return
+
+        delay = self.retry_after(priority)
+        if delay is not None:
+            error = QueueFullError(delay)
+            logger.warning(f"[Admission] Shedding {scope['path']} (priority {priority}); retry after {error.retry_after_header}s")
+            body = b'{"detail": "Server is busy, please retry shortly"}'
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                    (b"retry-after", error.retry_after_header.encode("latin-1")),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        token = current_work.set(WorkContext(priority, self._user(scope)))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_work.reset(token)
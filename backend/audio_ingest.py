@@ -0,0 +1,175 @@
+"""
+Audio Ingestion for Whisper
+Reads uploads under size and duration limits and decodes them in memory to the 16 kHz mono
+float32 array Whisper takes directly, without temp files
+"""
+
+import io
+import logging
+import subprocess
+import wave
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    import av
+    PYAV_AVAILABLE = True
+except ImportError:
+    PYAV_AVAILABLE = False
+    logger.warning("PyAV not available; compressed audio is decoded through an ffmpeg pipe. Install with: pip install av")
+
+SAMPLE_RATE = 16000
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class AudioIngestError(Exception):
+    """Upload rejected before transcription; status_code is the HTTP status to answer with"""
+    status_code = 400
+
+    def __init__(self, detail: str):
+        super().__init__(detail)
+        self.detail = detail
+
+
+class AudioTooLargeError(AudioIngestError):
+    status_code = 413
+
+
+class AudioTooLongError(AudioIngestError):
+    status_code = 413
+
+
+async def read_upload(upload_file, max_bytes: int) -> bytes:
+    """Read an UploadFile in chunks, giving up as soon as it exceeds max_bytes"""
+    chunks, size = [], 0
+    while True:
+        chunk = await upload_file.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise AudioTooLargeError(f"Audio upload exceeds {round(max_bytes / (1024 * 1024), 1):g} MB")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+# Raw PCM accepted from streaming clients: numpy dtype per encoding name
+PCM_ENCODINGS = {"pcm_s16le": ("<i2", 32768.0), "pcm_f32le": ("<f4", 1.0)}
+
+
+def pcm_to_float(data: bytes, encoding: str = "pcm_s16le") -> np.ndarray:
+    """Little-endian mono PCM as float32 samples (a trailing partial sample is dropped)"""
+    dtype, scale = PCM_ENCODINGS[encoding]
+    width = np.dtype(dtype).itemsize
+    audio = np.frombuffer(data[:len(data) - len(data) % width], dtype=dtype).astype(np.float32)
+    return audio / scale if scale != 1.0 else audio
+
+
+def encode_wav(audio: np.ndarray, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """16-bit PCM WAV bytes for float32 samples, for backends that take files"""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes())
+    return buf.getvalue()
+
+
+def _check_duration(samples: int, sample_rate: int, max_seconds: Optional[float]):
+    if max_seconds is not None and samples > max_seconds * sample_rate:
+        raise AudioTooLongError(f"Audio is longer than {max_seconds:g} seconds")
+
+
+def resample(audio: np.ndarray, src_rate: int, dst_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Windowed-sinc low-pass (when downsampling) followed by linear interpolation"""
+    if src_rate == dst_rate or audio.size == 0:
+        return audio.astype(np.float32, copy=False)
+    if src_rate > dst_rate:
+        cutoff = 0.5 * dst_rate / src_rate
+        taps = np.arange(-32, 33)
+        kernel = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.hamming(taps.size)
+        audio = np.convolve(audio, kernel / kernel.sum(), mode="same")
+    duration = audio.size / src_rate
+    target = np.arange(int(round(duration * dst_rate))) / dst_rate
+    return np.interp(target, np.arange(audio.size) / src_rate, audio).astype(np.float32)
+
+
+def _decode_wav(data: bytes, max_seconds: Optional[float]) -> np.ndarray:
+    with wave.open(io.BytesIO(data)) as wav:
+        rate, channels, width, frames = wav.getframerate(), wav.getnchannels(), wav.getsampwidth(), wav.getnframes()
+        # The header gives the length up front: reject before decoding anything
+        _check_duration(frames, rate, max_seconds)
+        raw = wav.readframes(frames)
+    if width == 1:
+        audio = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        audio = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        audio = ((b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)) << 8 >> 8).astype(np.float32) / 8388608.0
+    else:
+        audio = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+    if channels > 1:
+        audio = audio.reshape(-1, channels).mean(axis=1)
+    return resample(audio, rate)
+
+
+def _decode_pyav(data: bytes, max_seconds: Optional[float]) -> np.ndarray:
+    with av.open(io.BytesIO(data)) as container:
+        stream = next((s for s in container.streams if s.type == "audio"), None)
+        if stream is None:
+            raise AudioIngestError("Upload contains no audio stream")
+        resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLE_RATE)
+        parts, samples = [], 0
+        for frame in container.decode(stream):
+            for out in resampler.resample(frame):
+                part = out.to_ndarray().reshape(-1)
+                samples += part.size
+                _check_duration(samples, SAMPLE_RATE, max_seconds)
+                parts.append(part)
+        for out in resampler.resample(None):
+            parts.append(out.to_ndarray().reshape(-1))
+    return np.concatenate(parts).astype(np.float32) if parts else np.zeros(0, dtype=np.float32)
+
+
+def _decode_ffmpeg(data: bytes, max_seconds: Optional[float]) -> np.ndarray:
+    cmd = ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", "pipe:0"]
+    if max_seconds is not None:
+        # Decode one sample past the limit so an over-long clip is still detected
+        cmd += ["-t", f"{max_seconds + 1.0 / SAMPLE_RATE:.6f}"]
+    cmd += ["-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"]
+    try:
+        out = subprocess.run(cmd, input=data, capture_output=True, check=True).stdout
+    except FileNotFoundError as e:
+        raise RuntimeError("Neither PyAV nor ffmpeg is available to decode compressed audio") from e
+    except subprocess.CalledProcessError as e:
+        raise AudioIngestError(f"Could not decode audio: {e.stderr.decode(errors='ignore').strip()[:200]}") from e
+    audio = np.frombuffer(out, dtype="<i2").astype(np.float32) / 32768.0
+    _check_duration(audio.size, SAMPLE_RATE, max_seconds)
+    return audio
+
+
+def decode_audio(data: bytes, max_seconds: Optional[float] = None) -> np.ndarray:
+    """
+    16 kHz mono float32 samples for a WAV, WebM/Opus, Ogg, MP3 or MP4 upload.
+    WAV (PCM) is parsed directly; other containers go through PyAV in-process, or an ffmpeg
+    pipe without PyAV. Blocking: run it in an executor.
+    """
+    if not data:
+        raise AudioIngestError("Empty audio upload")
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        try:
+            return _decode_wav(data, max_seconds)
+        except wave.Error:
+            # Not plain PCM (e.g. IEEE float or compressed WAV): let the general decoder handle it
+            pass
+    if PYAV_AVAILABLE:
+        try:
+            return _decode_pyav(data, max_seconds)
+        except av.error.FFmpegError as e:
+            raise AudioIngestError(f"Could not decode audio: {e}") from e
+    return _decode_ffmpeg(data, max_seconds)
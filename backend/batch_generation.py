@@ -0,0 +1,110 @@
+"""
+Mixed-Parameter Batching
+Per-row sampling and length controls so requests with different generation parameters
+(e.g. a 5-token greedy assessment and a 60-token sampled reply) can share one padded generate call
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+import torch
+from transformers import LogitsProcessor, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+
+# Generation parameters that may differ between rows of one batch
+PER_ROW_PARAMS = ("max_new_tokens", "do_sample", "temperature", "top_k", "top_p")
+
+
+@dataclass
+class RowSampling:
+    """Effective sampling settings for one row of a batch"""
+    max_new_tokens: int
+    do_sample: bool
+    temperature: float
+    top_k: int
+    top_p: float
+
+
+def resolve_row_sampling(generate_kwargs: Dict[str, Any], generation_config) -> RowSampling:
+    """Fill in the model's generation_config defaults for parameters a request did not set"""
+    def pick(name: str, default):
+        value = generate_kwargs.get(name)
+        if value is None:
+            value = getattr(generation_config, name, None)
+        return default if value is None else value
+
+    return RowSampling(
+        max_new_tokens=int(pick("max_new_tokens", 20)),
+        do_sample=bool(pick("do_sample", False)),
+        temperature=float(pick("temperature", 1.0)),
+        top_k=int(pick("top_k", 0)),
+        top_p=float(pick("top_p", 1.0)),
+    )
+
+
+def mixed_batch_kwargs(rows: List[RowSampling]) -> Dict[str, Any]:
+    """
+    generate() kwargs for a batch whose rows sample differently.
+    The global warpers are neutralised (sampling at temperature 1 with no top-k/top-p) and
+    RowSamplingLogitsProcessor applies each row's own settings; greedy rows are reduced to
+    their argmax so sampling them is deterministic.
+    """
+    return {
+        "do_sample": True,
+        "temperature": 1.0,
+        "top_k": 0,
+        "top_p": 1.0,
+        "max_new_tokens": max(row.max_new_tokens for row in rows),
+        "logits_processor": LogitsProcessorList([RowSamplingLogitsProcessor(rows)]),
+        "stopping_criteria": StoppingCriteriaList([RowMaxNewTokensCriteria([row.max_new_tokens for row in rows])]),
+    }
+
+
+class RowSamplingLogitsProcessor(LogitsProcessor):
+    """Applies greedy / temperature / top-k / top-p per batch row"""
+
+    def __init__(self, rows: List[RowSampling]):
+        self.rows = rows
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        filter_value = -float("inf")
+        scores = scores.clone()
+        for i, row in enumerate(self.rows):
+            row_scores = scores[i]
+            if not row.do_sample:
+                keep = row_scores.argmax()
+                best = row_scores[keep].clone()
+                row_scores.fill_(filter_value)
+                row_scores[keep] = best
+                continue
+
+            if row.temperature > 0 and row.temperature != 1.0:
+                row_scores.div_(row.temperature)
+
+            if 0 < row.top_k < row_scores.shape[-1]:
+                threshold = torch.topk(row_scores, row.top_k).values[-1]
+                row_scores.masked_fill_(row_scores < threshold, filter_value)
+
+            if 0.0 < row.top_p < 1.0:
+                sorted_scores, sorted_idx = torch.sort(row_scores, descending=True)
+                cumulative = sorted_scores.softmax(dim=-1).cumsum(dim=-1)
+                remove = cumulative > row.top_p
+                # Always keep the most likely token
+                remove[1:] = remove[:-1].clone()
+                remove[0] = False
+                row_scores[sorted_idx[remove]] = filter_value
+        return scores
+
+
+class RowMaxNewTokensCriteria(StoppingCriteria):
+    """Marks each row done once it has produced its own max_new_tokens (later tokens are padding)"""
+
+    def __init__(self, max_new_tokens: List[int]):
+        self.max_new_tokens = max_new_tokens
+        self._prompt_length = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if self._prompt_length is None:
+            # First call happens right after the first new token is appended
+            self._prompt_length = input_ids.shape[1] - 1
+        generated = input_ids.shape[1] - self._prompt_length
+        return torch.tensor([generated >= m for m in self.max_new_tokens], dtype=torch.bool, device=input_ids.device)
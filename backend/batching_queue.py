@@ -0,0 +1,148 @@
+"""
+Batching Queue
+The admission-controlled queue and worker shared by the LLM scheduler and the STT batcher:
+fair ordering, load shedding, cancellation and grouping compatible requests into batches
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, List, Optional
+
+from admission import QueueFullError, admission_limit, current_work, fair_order
+
+logger = logging.getLogger(__name__)
+
+
+class BatchingQueue:
+    """
+    Base class for a queue drained in batches by one worker task per event loop.
+
+    Queued items carry `future`, `priority`, `user`, `enqueued_at` and `batch_key()`.
+    `_enqueue()` stamps an item with the caller's WorkContext and sheds it with
+    QueueFullError once its class's share of `max_queue_depth` is full. The worker waits up
+    to `batch_wait_ms` for concurrent requests, takes the item due next in
+    admission.fair_order plus every queued item with the same batch key (up to
+    `max_batch_size`), and resolves each future with its entry of `_process_batch()`.
+    A cancelled future drops its item from the queue; `_on_cancelled()` lets subclasses
+    stop work already running for it.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = 8,
+        batch_wait_ms: float = 10.0,
+        max_queue_depth: int = 64,
+        aging_seconds: float = 10.0,
+    ):
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_wait = max(0.0, batch_wait_ms) / 1000.0
+        self.max_queue_depth = max(1, max_queue_depth)
+        self.aging_seconds = aging_seconds
+
+        self._pending: List[Any] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._running = 0
+
+        self.total_cancelled = 0
+        self.total_shed = 0
+        # Smoothed wall time of one batch, for Retry-After estimates
+        self._step_seconds = 1.0
+
+    def queued(self) -> int:
+        """Items waiting for a batch (not counting the one running)"""
+        return sum(1 for item in self._pending if not item.future.done())
+
+    def retry_after(self, priority: int) -> Optional[float]:
+        """Seconds to back off if an item of this priority would be shed now, else None"""
+        queued = self.queued()
+        if queued < admission_limit(self.max_queue_depth, priority):
+            return None
+        return self._step_seconds * (queued / self.max_batch_size + 1)
+
+    def _new_future(self) -> asyncio.Future:
+        """A future on the worker's loop, for an item about to be enqueued"""
+        self._ensure_worker()
+        return self._loop.create_future()
+
+    def _enqueue(self, item):
+        """Add an item to the queue, or raise QueueFullError if its class's share is full"""
+        work = current_work.get()
+        item.priority, item.user = work.priority, work.user
+        delay = self.retry_after(item.priority)
+        if delay is not None:
+            self.total_shed += 1
+            raise QueueFullError(delay)
+
+        def on_done(future: asyncio.Future):
+            if future.cancelled():
+                self.total_cancelled += 1
+                self._on_cancelled(item)
+
+        item.future.add_done_callback(on_done)
+        self._pending.append(item)
+        self._wakeup.set()
+
+    def _on_cancelled(self, item):
+        """Called when an item's future is cancelled, queued or running"""
+
+    async def _process_batch(self, batch: List[Any]) -> List[Any]:
+        """One result per item, in order"""
+        raise NotImplementedError
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            # New event loop (e.g. a fresh test client) or the worker died: start over on this loop
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._pending = [i for i in self._pending if not i.future.done() and i.future.get_loop() is loop]
+            self._worker = loop.create_task(self._run())
+
+    def _next_batch(self) -> List[Any]:
+        """Take the item due next plus every compatible one in serving order, up to max_batch_size"""
+        self._pending = [i for i in self._pending if not i.future.done()]
+        if not self._pending:
+            return []
+        ordered = fair_order(self._pending, self.aging_seconds)
+        key = ordered[0].batch_key()
+        batch = [i for i in ordered if i.batch_key() == key][:self.max_batch_size]
+        taken = set(id(i) for i in batch)
+        self._pending = [i for i in self._pending if id(i) not in taken]
+        return batch
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            # Give concurrent handlers a moment to join this batch
+            if self.batch_wait and len(self._pending) < self.max_batch_size:
+                await asyncio.sleep(self.batch_wait)
+
+            batch = self._next_batch()
+            if not batch:
+                continue
+
+            started = time.monotonic()
+            self._running = len(batch)
+            try:
+                results = await self._process_batch(batch)
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{len(results)} results for a batch of {len(batch)}")
+                self._step_seconds = 0.8 * self._step_seconds + 0.2 * (time.monotonic() - started)
+            except Exception as e:
+                logger.error(f"[{type(self).__name__}] Batch of {len(batch)} failed: {e}")
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                continue
+            finally:
+                self._running = 0
+
+            for item, result in zip(batch, results):
+                if not item.future.done():
+                    item.future.set_result(result)
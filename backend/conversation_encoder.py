@@ -0,0 +1,162 @@
+"""
+Incremental Conversation Encoder
+Renders and tokenizes chat prompts one message at a time, reusing the text and token ids of
+messages (system prompts, earlier turns) already seen in this or another conversation
+"""
+
+import logging
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _LRU(OrderedDict):
+    def __init__(self, max_entries: int):
+        super().__init__()
+        self.max_entries = max_entries
+
+    def lookup(self, key):
+        value = self.get(key)
+        if value is not None:
+            self.move_to_end(key)
+        return value
+
+    def store(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        while len(self) > self.max_entries:
+            self.popitem(last=False)
+
+
+class ConversationEncoder:
+    """
+    The Llama 3 chat template is a concatenation of per-message blocks that each end in
+    <|eot_id|>, and tokenization never merges across special tokens. So a prompt's ids are
+    the concatenation of its blocks' ids, and only blocks not seen before need tokenizing:
+    on a long practice session that is just the newest turn.
+
+    Both properties are checked against the tokenizer at construction; if the template is
+    not block-concatenative, render() and encode() fall back to the full template/tokenizer.
+
+    render() remembers which messages each prompt it returns is made of, so encode() on that
+    prompt concatenates per-message ids cached by (role, content) without splitting or
+    hashing the prompt's blocks again. Other prompts are split at the boundary tokens.
+    """
+
+    def __init__(self, tokenizer, max_entries: int = 8192):
+        self.tokenizer = tokenizer
+        self._rendered = _LRU(max_entries)
+        self._segments = _LRU(max_entries)
+        self._message_ids = _LRU(max_entries)
+        # Prompt text -> the message keys render() built it from
+        self._prompts = _LRU(256)
+
+        self._bos = tokenizer.bos_token or ""
+        boundaries = [t for t in ("<|eot_id|>", self._bos) if t and t in tokenizer.get_vocab()]
+        self._boundary = re.compile("(" + "|".join(re.escape(t) for t in boundaries) + ")") if boundaries else None
+        self._generation_prompt = ""
+
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+        self.incremental = False
+        try:
+            self.incremental = self._probe()
+        except Exception as e:
+            logger.warning(f"[ConversationEncoder] Template probe failed: {e}")
+        if not self.incremental:
+            logger.warning("[ConversationEncoder] Chat template is not block-concatenative; using full re-templating")
+
+    def _template(self, messages: List[Dict[str, str]], add_generation_prompt: bool) -> str:
+        return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=add_generation_prompt)
+
+    def _probe(self) -> bool:
+        probe = [
+            {"role": "system", "content": "You are a tutor."},
+            {"role": "user", "content": "Ciao! Mi chiamo Luca."},
+            {"role": "assistant", "content": "Piacere, Luca!"},
+        ]
+        single = self._template(probe[:1], False)
+        self._generation_prompt = self._template(probe[:1], True)[len(single):]
+        rendered = self._bos + "".join(self._render_message(m) for m in probe) + self._generation_prompt
+        full = self._template(probe, True)
+        if rendered != full or self._boundary is None:
+            return False
+        full_ids = self.tokenizer(full, add_special_tokens=False).input_ids
+        return self._encode_segments(full) == full_ids
+
+    def _render_message(self, message: Dict[str, str]) -> str:
+        return self._render_key((message["role"], message["content"]))
+
+    def _render_key(self, key: Tuple[str, str]) -> str:
+        block = self._rendered.lookup(key)
+        if block is None:
+            block = self._template([{"role": key[0], "content": key[1]}], False)
+            if self._bos and block.startswith(self._bos):
+                block = block[len(self._bos):]
+            self._rendered.store(key, block)
+        return block
+
+    def render(self, messages: List[Dict[str, str]]) -> str:
+        """Prompt text for messages plus the assistant generation header"""
+        if not self.incremental:
+            return self._template(messages, True)
+        keys = tuple((m["role"], m["content"]) for m in messages)
+        prompt = self._bos + "".join(self._render_key(key) for key in keys) + self._generation_prompt
+        self._prompts.store(prompt, keys)
+        return prompt
+
+    def _encode_segments(self, prompt: str) -> List[int]:
+        pieces = self._boundary.split(prompt)
+        # Re-attach each boundary token to the text before it: [text, tok, text, tok, tail]
+        segments = ["".join(pieces[i:i + 2]) for i in range(0, len(pieces), 2)]
+        ids: List[int] = []
+        for segment in segments:
+            if not segment:
+                continue
+            cached = self._segments.lookup(segment)
+            if cached is None:
+                self.misses += 1
+                cached = self.tokenizer(segment, add_special_tokens=False).input_ids
+                self._segments.store(segment, cached)
+            else:
+                self.hits += 1
+                self.reused_tokens += len(cached)
+            ids.extend(cached)
+        return ids
+
+    def encode(self, prompt: str) -> List[int]:
+        """Token ids for an already-rendered prompt, tokenizing only segments not seen before"""
+        if not self.incremental:
+            return self.tokenizer(prompt, add_special_tokens=False).input_ids
+        keys = self._prompts.lookup(prompt)
+        if keys is None:
+            return self._encode_segments(prompt)
+        ids = self._encode_segments(self._bos) if self._bos else []
+        for key in keys:
+            cached = self._message_ids.lookup(key)
+            if cached is None:
+                block = self._render_key(key)
+                if not block.endswith("<|eot_id|>"):
+                    # Its tail would tokenize together with the next block's head
+                    return self._encode_segments(prompt)
+                cached = self._encode_segments(block)
+                self._message_ids.store(key, cached)
+            else:
+                self.hits += 1
+                self.reused_tokens += len(cached)
+            ids.extend(cached)
+        ids.extend(self._encode_segments(self._generation_prompt))
+        return ids
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "incremental": self.incremental,
+            "cached_segments": len(self._segments),
+            "hits": self.hits,
+            "misses": self.misses,
+            "reused_tokens": self.reused_tokens,
+        }
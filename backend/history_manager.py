@@ -0,0 +1,203 @@
+"""
+Conversation History Manager
+Keeps chat prompts inside a per-endpoint token budget by replacing the oldest turns with a
+rolling summary, so prompt length stays flat however long a session runs
+"""
+
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Chat-template overhead per message (header and eot tokens) on top of its content
+MESSAGE_OVERHEAD_TOKENS = 5
+
+
+@dataclass
+class FittedHistory:
+    """What goes into the prompt: an optional summary of the older turns plus the recent turns verbatim"""
+    messages: List[Dict[str, str]]
+    summary: Optional[str] = None
+    summarized: int = 0
+    tokens: int = 0
+    pending: bool = False
+
+
+class HistoryManager:
+    """
+    fit() never waits on the model. The turns that no longer fit are covered by the cached
+    summary of exactly that prefix if there is one. Otherwise the newest cached summary of
+    a shorter prefix (or none) is used and every turn it does not cover stays verbatim, over
+    budget if need be, while a background task brings the summary up to date for the next
+    turn: no turn leaves the prompt before a summary covers it.
+
+    Summaries are keyed by a hash chain over the summarized messages, so a conversation
+    finds the summary of any earlier prefix of itself and extends it incrementally:
+    summarize(previous_summary, new_messages). The cut point moves in whole steps of
+    `summary_step` messages (rounded down, so at least `min_recent` turns always stay
+    verbatim) and a summary is reused for several turns.
+    """
+
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int],
+        summarize: Callable[[Optional[str], List[Dict[str, str]]], Awaitable[str]],
+        budgets: Dict[str, int],
+        default_budget: int = 1536,
+        min_recent: int = 4,
+        summary_step: int = 4,
+        summary_tokens: int = 160,
+        max_entries: int = 2048,
+    ):
+        self.count_tokens = count_tokens
+        self.summarize = summarize
+        self.budgets = budgets
+        self.default_budget = default_budget
+        self.min_recent = min_recent
+        self.summary_step = summary_step
+        self.summary_tokens = summary_tokens
+        self.max_entries = max_entries
+
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._token_counts: "OrderedDict[str, int]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._background: Set[asyncio.Task] = set()
+
+        self.fits = 0
+        self.trimmed = 0
+        self.summary_hits = 0
+        self.summary_stale = 0
+        self.summaries_generated = 0
+        self.summary_errors = 0
+
+    def _tokens(self, text: str) -> int:
+        count = self._token_counts.get(text)
+        if count is None:
+            try:
+                count = int(self.count_tokens(text))
+            except Exception:
+                # Rough fallback: ~4 characters per token
+                count = len(text) // 4
+            self._token_counts[text] = count
+            while len(self._token_counts) > self.max_entries:
+                self._token_counts.popitem(last=False)
+        return count
+
+    def _message_tokens(self, message: Dict[str, str]) -> int:
+        return self._tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    @staticmethod
+    def _prefix_keys(messages: List[Dict[str, str]]) -> List[str]:
+        """keys[i] identifies messages[:i + 1]"""
+        keys, digest = [], b""
+        for message in messages:
+            h = hashlib.sha256(digest)
+            h.update(f"{message['role']}\0{message['content']}\0".encode("utf-8"))
+            digest = h.digest()
+            keys.append(h.hexdigest())
+        return keys
+
+    def budget(self, endpoint: str) -> int:
+        return self.budgets.get(endpoint, self.default_budget)
+
+    def fit(self, endpoint: str, system_prompt: str, messages: List[Dict[str, str]]) -> FittedHistory:
+        """Messages (oldest first, newest user turn last) trimmed to the endpoint's budget"""
+        self.fits += 1
+        budget = self.budget(endpoint)
+        available = budget - self._tokens(system_prompt) - MESSAGE_OVERHEAD_TOKENS
+        costs = [self._message_tokens(m) for m in messages]
+        if sum(costs) <= available:
+            return FittedHistory(messages=list(messages), tokens=budget - available + sum(costs))
+
+        self.trimmed += 1
+        # Newest turns that fit next to a summary; at least min_recent (and the last) are kept
+        available -= self.summary_tokens + MESSAGE_OVERHEAD_TOKENS
+        keep, used = 0, 0
+        for cost in reversed(costs):
+            if keep >= max(1, self.min_recent) and used + cost > available:
+                break
+            keep += 1
+            used += cost
+        # Snap the cut down to a whole step so one summary serves several turns; rounding
+        # down only ever keeps more turns verbatim than the min_recent floor
+        cut = len(messages) - keep
+        cut -= cut % self.summary_step
+
+        summary, covered, pending = None, 0, False
+        if cut > 0:
+            keys = self._prefix_keys(messages[:cut])
+            summary = self._summaries.get(keys[-1])
+            if summary is not None:
+                self.summary_hits += 1
+                self._summaries.move_to_end(keys[-1])
+                covered = cut
+            else:
+                self.summary_stale += 1
+                pending = True
+                covered, summary = self._latest_summary(keys[:-1])
+                self._schedule(keys, messages[:cut], covered, summary)
+
+        recent = list(messages[covered:])
+        tokens = self._tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS + sum(costs[covered:])
+        if summary:
+            tokens += self._tokens(summary) + MESSAGE_OVERHEAD_TOKENS
+        return FittedHistory(
+            messages=recent,
+            summary=summary,
+            summarized=covered,
+            tokens=tokens,
+            pending=pending,
+        )
+
+    def _latest_summary(self, keys: List[str]):
+        """(number of messages covered, summary) for the longest prefix already summarized"""
+        for i in range(len(keys) - 1, -1, -1):
+            summary = self._summaries.get(keys[i])
+            if summary is not None:
+                return i + 1, summary
+        return 0, None
+
+    def _schedule(self, keys: List[str], prefix: List[Dict[str, str]], base_index: int, base_summary: Optional[str]):
+        key = keys[-1]
+        if key in self._inflight:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(self._update(key, prefix[base_index:], base_summary))
+        self._inflight[key] = task
+        self._background.add(task)
+        task.add_done_callback(lambda t: (self._background.discard(t), self._inflight.pop(key, None)))
+
+    async def _update(self, key: str, new_messages: List[Dict[str, str]], previous: Optional[str]):
+        try:
+            summary = (await self.summarize(previous, new_messages)).strip()
+        except Exception as e:
+            self.summary_errors += 1
+            logger.warning(f"[HistoryManager] Summary update failed: {e}")
+            return
+        if not summary:
+            return
+        self.summaries_generated += 1
+        self._summaries[key] = summary
+        self._summaries.move_to_end(key)
+        while len(self._summaries) > self.max_entries:
+            self._summaries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "budgets": dict(self.budgets),
+            "fits": self.fits,
+            "trimmed": self.trimmed,
+            "summary_hits": self.summary_hits,
+            "summary_stale": self.summary_stale,
+            "summaries_generated": self.summaries_generated,
+            "summary_errors": self.summary_errors,
+            "cached_summaries": len(self._summaries),
+            "pending_summaries": len(self._inflight),
+        }
@@ -0,0 +1,314 @@
+"""
+Inference Scheduler for the shared Llama 3 text-generation pipeline
+Collects pending prompts from every handler into one queue and runs them as batched generate steps
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import torch
+from transformers import LogitsProcessorList, StoppingCriteriaList
+
+from admission import PRIORITY_INTERACTIVE
+from batching_queue import BatchingQueue
+from batch_generation import PER_ROW_PARAMS, mixed_batch_kwargs, resolve_row_sampling
+from json_constraint import JSONCompleteCriteria, JSONSchemaConstraint, JSONSchemaLogitsProcessor
+from stopping_criteria import ROW_STOP_PARAMS, StopSequenceFilter, build_stopping_criteria, truncate_at_stop
+from llm_streaming import AsyncTextStreamer
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class GenerationRequest:
+    """A prompt waiting for generation, resolved through its future"""
+    prompt: str
+    generate_kwargs: Dict[str, Any]
+    future: asyncio.Future
+    streamer: Optional[AsyncTextStreamer] = None
+    # "generate" returns text; "classify" returns P(YES) from a single forward pass
+    kind: str = "generate"
+    enqueued_at: float = field(default_factory=time.monotonic)
+    # Set when the caller cancels (e.g. its client disconnected); read by the executor thread
+    cancelled: threading.Event = field(default_factory=threading.Event)
+    # Admission class and fairness key, taken from the caller's WorkContext
+    priority: int = PRIORITY_INTERACTIVE
+    user: Optional[str] = None
+
+    def batch_key(self) -> Tuple:
+        """
+        Requests can share a generate step if everything except the per-row sampling
+        and stopping parameters (max_new_tokens, temperature, stop_sequences, ...) matches
+        """
+        if self.kind == "classify":
+            return ("classify",)
+        if self.streamer is not None:
+            # Streamers only support a batch of one
+            return ("stream", id(self))
+        row_params = PER_ROW_PARAMS + ROW_STOP_PARAMS
+        return tuple(sorted((k, v) for k, v in self.generate_kwargs.items() if k not in row_params))
+
+
+def _extract_text(item: Any) -> str:
+    """Pull generated_text out of a pipeline result (single prompt -> list of dicts, batch -> list of lists)"""
+    if isinstance(item, list):
+        item = item[0]
+    return item["generated_text"]
+
+
+class InferenceScheduler(BatchingQueue):
+    """
+    Batches generation requests in front of the HF pipeline.
+
+    Handlers await `submit()` instead of calling the pipeline in the default executor.
+    A single worker task drains the queue: it groups compatible requests (sampling settings
+    may differ per row), runs up to `max_batch_size` of them in one padded `generate` call,
+    and admits everything that arrived in the meantime into the next step.
+
+    The queue (batching_queue.BatchingQueue) is served in admission.fair_order (priority
+    class, then users in turn) and holds at most `max_queue_depth` requests; lower classes
+    are shed earlier with QueueFullError so interactive turns still get in during a burst.
+    """
+
+    def __init__(
+        self,
+        get_pipeline: Callable[[], Any],
+        max_batch_size: int = 8,
+        batch_wait_ms: float = 10.0,
+        max_queue_depth: int = 64,
+        aging_seconds: float = 10.0,
+    ):
+        super().__init__(max_batch_size, batch_wait_ms, max_queue_depth, aging_seconds)
+        # Resolved on every step so the pipeline can be (re)loaded after the scheduler is built
+        self._get_pipeline = get_pipeline
+
+        # Optional PrefixKVCache; single-sequence steps go through it to skip shared prefill
+        self.prefix_cache = None
+        # Optional YesNoClassifier; classify() falls back to a short generation without it
+        self.classifier = None
+        # Optional ConversationEncoder; when set, prompts are tokenized incrementally and
+        # the ids go straight to model.generate instead of through the pipeline
+        self.encoder = None
+        # Optional SpeculativeDecoder; single-sequence steps are drafted by a small model
+        # (batches of two or more already keep the GPU busy and run as usual)
+        self.speculative = None
+        # Compiled json_schema constraints, keyed by the serialized schema
+        self._constraints: Dict[str, JSONSchemaConstraint] = {}
+
+        self.total_batches = 0
+        self.total_sequences = 0
+        self.max_observed_batch = 0
+        self.total_classifications = 0
+
+    async def submit(self, prompt: str, **generate_kwargs) -> str:
+        """
+        Queue a prompt and wait for its generated text (return_full_text is always False).
+        Pass `json_schema=` to constrain the output to a JSON object matching that schema,
+        `stop_sequences=` to end (and cut) the output at any of those strings, and
+        `max_sentences=` to end it after that many complete sentences.
+        """
+        generate_kwargs.pop("return_full_text", None)
+        request = GenerationRequest(
+            prompt=prompt,
+            generate_kwargs=generate_kwargs,
+            future=self._new_future(),
+        )
+        self._enqueue(request)
+        return await request.future
+
+    async def classify(self, prompt: str) -> float:
+        """Queue a YES/NO prompt and wait for P(YES), scored from one forward pass"""
+        if self.classifier is None:
+            answer = await self.submit(prompt, max_new_tokens=5, temperature=0.1)
+            return 1.0 if "YES" in answer.upper() else 0.0
+        request = GenerationRequest(
+            prompt=prompt,
+            generate_kwargs={},
+            future=self._new_future(),
+            kind="classify",
+        )
+        self._enqueue(request)
+        return await request.future
+
+    async def stream(self, prompt: str, **generate_kwargs) -> AsyncIterator[str]:
+        """
+        Queue a prompt and yield decoded text chunks as tokens are generated. With
+        `stop_sequences=` the stream ends before the first stop string, like submit(): text
+        that could be the start of one is held back until the next chunk rules it out.
+        """
+        generate_kwargs.pop("return_full_text", None)
+        pipe = self._get_pipeline()
+        if pipe is None:
+            raise RuntimeError("Text generation pipeline is not loaded")
+        request = GenerationRequest(
+            prompt=prompt,
+            generate_kwargs=generate_kwargs,
+            future=self._new_future(),
+            streamer=AsyncTextStreamer(pipe.tokenizer, self._loop),
+        )
+        self._enqueue(request)
+        stops = StopSequenceFilter(generate_kwargs.get("stop_sequences"))
+        try:
+            # After a stop sequence the row's stopping criteria end decoding within a step
+            async for chunk in request.streamer:
+                chunk = stops.push(chunk)
+                if chunk:
+                    yield chunk
+            tail = stops.flush()
+            if tail:
+                yield tail
+            # Surface generation errors that ended the stream early
+            await request.future
+        finally:
+            # The consumer stopped early (client disconnected): stop decoding for it
+            if not request.future.done():
+                request.future.cancel()
+
+    def _on_cancelled(self, request: GenerationRequest):
+        # Queued requests are dropped by the worker; a running row ends at its next decode step
+        request.cancelled.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """Batching counters for monitoring"""
+        stats = {
+            "queued": self.queued(),
+            "batches": self.total_batches,
+            "sequences": self.total_sequences,
+            "avg_batch_size": round(self.total_sequences / self.total_batches, 2) if self.total_batches else 0.0,
+            "max_batch_size_seen": self.max_observed_batch,
+            "classifications": self.total_classifications,
+            "cancelled": self.total_cancelled,
+            "shed": self.total_shed,
+            "avg_step_seconds": round(self._step_seconds, 3),
+        }
+        if self.prefix_cache is not None:
+            stats["prefix_cache"] = self.prefix_cache.stats()
+        if self.encoder is not None:
+            stats["encoder"] = self.encoder.stats()
+        if self.speculative is not None:
+            stats["speculative"] = self.speculative.stats()
+        return stats
+
+    async def _process_batch(self, batch: List[GenerationRequest]) -> List[Any]:
+        try:
+            return await self._loop.run_in_executor(None, self._generate, batch)
+        finally:
+            for request in batch:
+                if request.streamer is not None:
+                    request.streamer.close()
+
+    def _generate(self, batch: List[GenerationRequest]) -> List[Any]:
+        """Runs in the executor: one generate call (or classification forward pass) for the whole batch"""
+        if batch[0].kind == "classify":
+            probabilities = self.classifier.classify([r.prompt for r in batch])
+            self.total_classifications += len(batch)
+            return probabilities
+
+        pipe = self._get_pipeline()
+        if pipe is None:
+            raise RuntimeError("Text generation pipeline is not loaded")
+
+        kwargs = dict(batch[0].generate_kwargs)
+        started = time.monotonic()
+        ids = [self.encoder.encode(r.prompt) for r in batch] if self.encoder is not None else None
+
+        if len(batch) == 1:
+            # json_schema's logits processor tracks one token per step, so it is never drafted
+            speculate = self.speculative is not None and "json_schema" not in kwargs
+            if speculate and ids is None:
+                ids = [pipe.tokenizer(batch[0].prompt, add_special_tokens=False).input_ids]
+            kwargs = self._prepare(kwargs, pipe.tokenizer, batch, prompt_length=len(ids[0]) if ids else None)
+            if batch[0].streamer is not None:
+                kwargs["streamer"] = batch[0].streamer
+            if speculate:
+                outputs = self._generate_ids(pipe, ids, kwargs, generate=self.speculative.generate)
+            elif self.prefix_cache is not None:
+                text = self.prefix_cache.generate(batch[0].prompt, input_ids=ids[0] if ids else None, **kwargs)
+                outputs = [[{"generated_text": text}]]
+            elif ids is not None:
+                outputs = self._generate_ids(pipe, ids, kwargs)
+            else:
+                outputs = [pipe(batch[0].prompt, return_full_text=False, **kwargs)]
+        else:
+            sampling = [{k: r.generate_kwargs.get(k) for k in PER_ROW_PARAMS} for r in batch]
+            if any(row != sampling[0] for row in sampling):
+                rows = [resolve_row_sampling(r.generate_kwargs, pipe.model.generation_config) for r in batch]
+                kwargs = {k: v for k, v in kwargs.items() if k not in PER_ROW_PARAMS}
+                kwargs.update(mixed_batch_kwargs(rows))
+            kwargs = self._prepare(kwargs, pipe.tokenizer, batch, prompt_length=max(len(row) for row in ids) if ids else None)
+            try:
+                if ids is not None:
+                    outputs = self._generate_ids(pipe, ids, kwargs)
+                else:
+                    outputs = pipe([r.prompt for r in batch], batch_size=len(batch), return_full_text=False, **kwargs)
+                if len(outputs) != len(batch):
+                    raise RuntimeError(f"pipeline returned {len(outputs)} results for {len(batch)} prompts")
+            except Exception as e:
+                # A bad batch (e.g. tokenizer without a pad token) must not fail every caller
+                logger.warning(f"[Scheduler] Batched generate failed ({e}), running {len(batch)} prompts one by one")
+                outputs = [pipe(r.prompt, return_full_text=False, **self._prepare(dict(r.generate_kwargs), pipe.tokenizer, [r])) for r in batch]
+
+        self.total_batches += 1
+        self.total_sequences += len(batch)
+        self.max_observed_batch = max(self.max_observed_batch, len(batch))
+        logger.debug(f"[Scheduler] Generated batch of {len(batch)} in {time.monotonic() - started:.2f}s")
+
+        return [
+            truncate_at_stop(_extract_text(output), r.generate_kwargs.get("stop_sequences"))
+            for r, output in zip(batch, outputs)
+        ]
+
+    def _generate_ids(self, pipe, ids: List[List[int]], kwargs: Dict[str, Any], generate: Optional[Callable] = None) -> List[Any]:
+        """Left-pad pre-tokenized prompts and call model.generate (or `generate`) directly (pipeline-shaped results)"""
+        tokenizer, model = pipe.tokenizer, pipe.model
+        generate = generate or model.generate
+        width = max(len(row) for row in ids)
+        pad_id = tokenizer.pad_token_id
+        input_ids = torch.tensor([[pad_id] * (width - len(row)) + row for row in ids], dtype=torch.long, device=model.device)
+        attention_mask = torch.tensor([[0] * (width - len(row)) + [1] * len(row) for row in ids], dtype=torch.long, device=model.device)
+        kwargs.setdefault("pad_token_id", pad_id)
+        with torch.inference_mode():
+            sequences = generate(input_ids=input_ids, attention_mask=attention_mask, **kwargs)
+        texts = tokenizer.batch_decode(sequences[:, width:], skip_special_tokens=True)
+        return [[{"generated_text": text}] for text in texts]
+
+    def _prepare(
+        self,
+        kwargs: Dict[str, Any],
+        tokenizer,
+        batch: List[GenerationRequest],
+        prompt_length: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Turn the scheduler-level kwargs (per-row stop options, json_schema) into fresh
+        stopping criteria and logits processors for one generate call
+        """
+        criteria = build_stopping_criteria(
+            tokenizer,
+            stop_sequences=[r.generate_kwargs.get("stop_sequences") for r in batch],
+            max_sentences=[r.generate_kwargs.get("max_sentences") for r in batch],
+            cancel_events=[r.cancelled for r in batch],
+            prompt_length=prompt_length,
+        )
+        schema = kwargs.get("json_schema")
+        kwargs = {k: v for k, v in kwargs.items() if k not in ROW_STOP_PARAMS and k != "json_schema"}
+        kwargs["stopping_criteria"] = StoppingCriteriaList([*(kwargs.get("stopping_criteria") or []), *criteria])
+        if schema is None:
+            return kwargs
+
+        key = json.dumps(schema)
+        constraint = self._constraints.get(key)
+        if constraint is None:
+            constraint = JSONSchemaConstraint(schema, tokenizer)
+            self._constraints[key] = constraint
+
+        processor = JSONSchemaLogitsProcessor(constraint)
+        # Mask before any sampling warper so top-k/top-p only see valid tokens
+        kwargs["logits_processor"] = LogitsProcessorList([processor, *(kwargs.get("logits_processor") or [])])
+        kwargs["stopping_criteria"] = StoppingCriteriaList([*(kwargs.get("stopping_criteria") or []), JSONCompleteCriteria(processor)])
+        return kwargs
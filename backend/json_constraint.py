@@ -0,0 +1,243 @@
+"""
+JSON-Schema Constrained Decoding
+Masks next-token logits so generation can only produce a JSON object matching a flat schema,
+and stops the row as soon as the closing brace is emitted
+"""
+
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+
+logger = logging.getLogger(__name__)
+
+# Upper bound for free-text fields without a maxLength
+DEFAULT_MAX_STRING_LENGTH = 512
+
+
+@dataclass(frozen=True)
+class _Segment:
+    """One piece of the output: fixed text, one of several values, or a free string"""
+    kind: str  # "literal", "enum" or "string"
+    text: str = ""
+    options: Tuple[str, ...] = ()
+    max_length: int = DEFAULT_MAX_STRING_LENGTH
+
+
+def compile_schema(schema: Dict[str, Any]) -> List[_Segment]:
+    """
+    Turn a flat object schema into the exact sequence of segments to emit.
+
+    Supported: {"type": "object", "properties": {name: {"type": "string", "maxLength": n} | {"enum": [...]}}}.
+    Every property is emitted, in declaration order, in compact form: {"a": "...", "b": "..."}.
+    String and enum segments consume their own closing quote.
+    """
+    if schema.get("type") != "object" or not schema.get("properties"):
+        raise ValueError("Only object schemas with properties are supported")
+
+    segments: List[_Segment] = []
+    for i, (name, prop) in enumerate(schema["properties"].items()):
+        prefix = "{" if i == 0 else ", "
+        segments.append(_Segment("literal", text=f'{prefix}{json.dumps(name)}: "'))
+        if "enum" in prop:
+            values = [str(v) for v in prop["enum"]]
+            if any('"' in v or "\\" in v for v in values):
+                raise ValueError(f"Enum values of '{name}' must not contain quotes or backslashes")
+            segments.append(_Segment("enum", options=tuple(v + '"' for v in values)))
+        elif prop.get("type") == "string":
+            segments.append(_Segment("string", max_length=int(prop.get("maxLength", DEFAULT_MAX_STRING_LENGTH))))
+        else:
+            raise ValueError(f"Unsupported property schema for '{name}': {prop}")
+    segments.append(_Segment("literal", text="}"))
+    return segments
+
+
+def max_output_length(schema: Dict[str, Any]) -> int:
+    """
+    Characters in the longest output the schema admits. The automaton only allows tokens
+    with visible text, so this plus one end token bounds max_new_tokens for the schema
+    """
+    total = 0
+    for segment in compile_schema(schema):
+        if segment.kind == "literal":
+            total += len(segment.text)
+        elif segment.kind == "enum":
+            total += max(len(o) for o in segment.options)
+        else:
+            total += segment.max_length + 1  # plus the closing quote
+    return total
+
+
+# FSM state: (segment index, progress). Progress is the number of characters consumed for
+# literal/string segments and the text matched so far for enum segments.
+State = Tuple[int, Union[int, str]]
+
+
+class JSONSchemaConstraint:
+    """
+    Character-level automaton for one schema plus per-state token masks for one tokenizer.
+
+    Token texts are decoded once; free-string states allow every quote/backslash/control-free
+    token that fits the remaining length, and only tokens that can start the current literal
+    or enum value are simulated character by character.
+    """
+
+    def __init__(self, schema: Dict[str, Any], tokenizer):
+        self.segments = compile_schema(schema)
+        self.done_index = len(self.segments)
+
+        vocab_size = len(tokenizer)
+        special_ids = set(tokenizer.all_special_ids) | set(getattr(tokenizer, "added_tokens_decoder", {}).keys())
+        texts = tokenizer.batch_decode([[i] for i in range(vocab_size)], clean_up_tokenization_spaces=False)
+        self.texts = ["" if i in special_ids else t for i, t in enumerate(texts)]
+
+        self.vocab_size = vocab_size
+        self.lengths = torch.tensor([len(t) for t in self.texts], dtype=torch.long)
+        self.safe_string_mask = torch.tensor(
+            [bool(t) and '"' not in t and "\\" not in t and all(ord(c) >= 0x20 for c in t) for t in self.texts],
+            dtype=torch.bool,
+        )
+        self.quote_ids = [i for i, t in enumerate(self.texts) if '"' in t]
+        self.by_first_char: Dict[str, List[int]] = {}
+        for i, t in enumerate(self.texts):
+            if t:
+                self.by_first_char.setdefault(t[0], []).append(i)
+
+        eos = tokenizer.eos_token_id
+        eos_ids = eos if isinstance(eos, list) else [eos]
+        eot = tokenizer.convert_tokens_to_ids("<|eot_id|>") if "<|eot_id|>" in tokenizer.get_vocab() else None
+        self.end_ids = [i for i in set(eos_ids + [eot]) if i is not None]
+
+        self._mask_cache: Dict[State, torch.Tensor] = {}
+
+    def initial_state(self) -> State:
+        return self._enter(0)
+
+    def _enter(self, index: int) -> State:
+        if index < self.done_index and self.segments[index].kind == "enum":
+            return (index, "")
+        return (index, 0)
+
+    def is_done(self, state: Optional[State]) -> bool:
+        return state is not None and state[0] == self.done_index
+
+    def advance(self, state: Optional[State], text: str) -> Optional[State]:
+        """Feed text through the automaton; None means the text is not allowed here"""
+        for ch in text:
+            if state is None or state[0] == self.done_index:
+                return None
+            index, progress = state
+            segment = self.segments[index]
+            if segment.kind == "literal":
+                if segment.text[progress] != ch:
+                    return None
+                progress += 1
+                state = self._enter(index + 1) if progress == len(segment.text) else (index, progress)
+            elif segment.kind == "enum":
+                progress += ch
+                if progress in segment.options:
+                    state = self._enter(index + 1)
+                elif any(o.startswith(progress) for o in segment.options):
+                    state = (index, progress)
+                else:
+                    return None
+            else:
+                if ch == '"':
+                    state = self._enter(index + 1)
+                elif ch == "\\" or ord(ch) < 0x20 or progress >= segment.max_length:
+                    return None
+                else:
+                    state = (index, progress + 1)
+        return state
+
+    def allowed_mask(self, state: State) -> torch.Tensor:
+        """Boolean mask over the vocabulary of tokens that keep the output valid"""
+        cached = self._mask_cache.get(state)
+        if cached is not None:
+            return cached
+
+        index, progress = state
+        mask = torch.zeros(self.vocab_size, dtype=torch.bool)
+        if index == self.done_index:
+            mask[self.end_ids] = True
+            return mask
+
+        segment = self.segments[index]
+        if segment.kind == "string":
+            remaining = segment.max_length - progress
+            mask |= self.safe_string_mask & (self.lengths <= remaining)
+            candidates = self.quote_ids
+        elif segment.kind == "literal":
+            candidates = self.by_first_char.get(segment.text[progress], [])
+        else:
+            first_chars = {o[len(progress)] for o in segment.options if o.startswith(progress)}
+            candidates = [i for c in first_chars for i in self.by_first_char.get(c, [])]
+
+        allowed = [i for i in candidates if self.advance(state, self.texts[i]) is not None]
+        if allowed:
+            mask[allowed] = True
+
+        if segment.kind != "string":
+            # Literal and enum states recur for every generation with this schema
+            self._mask_cache[state] = mask
+        return mask
+
+
+class JSONSchemaLogitsProcessor(LogitsProcessor):
+    """Per-row automaton state for one generate call; disallowed tokens get -inf"""
+
+    def __init__(self, constraint: JSONSchemaConstraint):
+        self.constraint = constraint
+        self.states: List[Optional[State]] = []
+        self._processed = None
+
+    def sync(self, input_ids: torch.LongTensor):
+        """Advance every row's state over tokens appended since the last call (idempotent)"""
+        if self._processed is None:
+            # First call sees only the prompt
+            self._processed = input_ids.shape[1]
+            self.states = [self.constraint.initial_state() for _ in range(input_ids.shape[0])]
+            return
+        for row, state in enumerate(self.states):
+            if state is None or self.constraint.is_done(state):
+                # Finished rows are padded from here on; broken rows are left unconstrained
+                continue
+            for token_id in input_ids[row, self._processed:].tolist():
+                state = self.constraint.advance(state, self.constraint.texts[token_id])
+            self.states[row] = state
+        self._processed = input_ids.shape[1]
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        self.sync(input_ids)
+        scores = scores.clone()
+        for row, state in enumerate(self.states):
+            if state is None:
+                continue
+            mask = self.constraint.allowed_mask(state).to(scores.device)
+            width = min(mask.shape[0], scores.shape[-1])
+            if not mask[:width].any():
+                logger.warning("[JSONConstraint] No token can continue the output; leaving row unconstrained")
+                self.states[row] = None
+                continue
+            row_scores = scores[row]
+            row_scores[:width].masked_fill_(~mask[:width], -float("inf"))
+            row_scores[width:] = -float("inf")
+        return scores
+
+
+class JSONCompleteCriteria(StoppingCriteria):
+    """Stops each row right after its closing brace instead of waiting for an end-of-turn token"""
+
+    def __init__(self, processor: JSONSchemaLogitsProcessor):
+        self.processor = processor
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        self.processor.sync(input_ids)
+        return torch.tensor(
+            [self.processor.constraint.is_done(state) for state in self.processor.states],
+            dtype=torch.bool,
+            device=input_ids.device,
+        )
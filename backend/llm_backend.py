@@ -0,0 +1,302 @@
+"""
+LLM Backends
+One interface for every text-generation call site: the in-process HF model behind the
+InferenceScheduler, or an OpenAI-compatible completions server (vLLM, llama.cpp server, ...)
+"""
+
+import asyncio
+import json
+import logging
+import math
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import httpx
+
+from admission import QueueFullError, current_work
+from audio_ingest import AudioIngestError
+from stopping_criteria import sentence_end, truncate_at_stop
+
+logger = logging.getLogger(__name__)
+
+
+class LLMBackend:
+    """
+    Interface used by the handlers and practice_mode.
+
+    Prompts are already formatted with the Llama 3 chat template. Keyword arguments follow
+    the HF generate names (max_new_tokens, temperature, do_sample, top_k, top_p) plus the
+    scheduler options stop_sequences, max_sentences and json_schema.
+    """
+
+    name = "base"
+
+    @property
+    def ready(self) -> bool:
+        """Whether generate() can be called right now"""
+        raise NotImplementedError
+
+    async def generate(self, prompt: str, **generate_kwargs) -> str:
+        raise NotImplementedError
+
+    def stream(self, prompt: str, **generate_kwargs) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    async def classify(self, prompt: str) -> float:
+        """P(YES) for a prompt whose answer is YES or NO"""
+        raise NotImplementedError
+
+    def retry_after(self, priority: int) -> Optional[float]:
+        """Seconds a request of this priority class should back off, or None if it would be admitted"""
+        return None
+
+    def backlog(self) -> int:
+        """Requests waiting on this backend; the model router's saturation signal"""
+        return 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+    async def close(self):
+        pass
+
+
+class LocalHFBackend(LLMBackend):
+    """The model loaded in this process, batched through the InferenceScheduler"""
+
+    name = "local"
+
+    def __init__(self, scheduler, get_pipeline: Callable[[], Any]):
+        self.scheduler = scheduler
+        self._get_pipeline = get_pipeline
+
+    @property
+    def ready(self) -> bool:
+        return self._get_pipeline() is not None
+
+    async def generate(self, prompt: str, **generate_kwargs) -> str:
+        return await self.scheduler.submit(prompt, **generate_kwargs)
+
+    def stream(self, prompt: str, **generate_kwargs) -> AsyncIterator[str]:
+        return self.scheduler.stream(prompt, **generate_kwargs)
+
+    async def classify(self, prompt: str) -> float:
+        return await self.scheduler.classify(prompt)
+
+    def retry_after(self, priority: int) -> Optional[float]:
+        return self.scheduler.retry_after(priority)
+
+    def backlog(self) -> int:
+        return self.scheduler.queued()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, **self.scheduler.stats()}
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """
+    Sends completions to an OpenAI-compatible server over a pooled httpx.AsyncClient.
+
+    Uses /v1/completions (not chat) because prompts are already templated. Stop sequences
+    map to `stop`, json_schema to `guided_json` (vLLM) and `json_schema` (llama.cpp server).
+    max_sentences is enforced client-side on a streamed response, which is closed as soon as
+    the limit is reached so the server can abort the request.
+
+    `uds` connects over a Unix socket instead of TCP (the model host). With
+    `extended_params` the server is trusted to honour max_sentences and the caller's
+    admission priority itself. A 503 from the server surfaces as QueueFullError.
+    """
+
+    name = "openai"
+
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        api_key: Optional[str] = None,
+        timeout: float = 60.0,
+        max_connections: int = 32,
+        uds: Optional[str] = None,
+        extended_params: bool = False,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.uds = uds
+        self.extended_params = extended_params
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.requests = 0
+        self.errors = 0
+        self.completion_tokens = 0
+        self.in_flight = 0
+
+    @property
+    def ready(self) -> bool:
+        return True
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            # Connection pools are bound to the event loop that created them
+            headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+            limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=headers,
+                timeout=self.timeout,
+                transport=httpx.AsyncHTTPTransport(uds=self.uds, limits=limits),
+            )
+            self._loop = loop
+        return self._client
+
+    def _payload(self, prompt: str, generate_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {
+            "model": self.model,
+            "prompt": prompt,
+            "max_tokens": generate_kwargs.get("max_new_tokens", 64),
+        }
+        if generate_kwargs.get("do_sample") is False:
+            payload["temperature"] = 0.0
+        elif generate_kwargs.get("temperature") is not None:
+            payload["temperature"] = generate_kwargs["temperature"]
+        for key in ("top_k", "top_p"):
+            if generate_kwargs.get(key) is not None:
+                payload[key] = generate_kwargs[key]
+        if generate_kwargs.get("stop_sequences"):
+            payload["stop"] = list(generate_kwargs["stop_sequences"])
+        if generate_kwargs.get("json_schema") is not None:
+            payload["guided_json"] = generate_kwargs["json_schema"]
+            payload["json_schema"] = generate_kwargs["json_schema"]
+        if self.extended_params and generate_kwargs.get("max_sentences"):
+            payload["max_sentences"] = generate_kwargs["max_sentences"]
+        return self._with_work(payload)
+
+    def _with_work(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        work = current_work.get()
+        if work.user:
+            payload["user"] = work.user
+        if self.extended_params:
+            payload["priority"] = work.priority
+        return payload
+
+    def _raise_for_status(self, response: httpx.Response):
+        if response.status_code == 503:
+            raise QueueFullError(float(response.headers.get("Retry-After", "1")))
+        response.raise_for_status()
+
+    def backlog(self) -> int:
+        # The server's queue is not visible from here: completions in flight stand in for it
+        return self.in_flight
+
+    async def _post(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            response = await self._get_client().post("/v1/completions", json=payload)
+            self._raise_for_status(response)
+        except (httpx.HTTPError, QueueFullError):
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        data = response.json()
+        self.completion_tokens += data.get("usage", {}).get("completion_tokens", 0)
+        return data
+
+    async def generate(self, prompt: str, **generate_kwargs) -> str:
+        if generate_kwargs.get("max_sentences") and not self.extended_params:
+            return "".join([chunk async for chunk in self.stream(prompt, **generate_kwargs)])
+        data = await self._post(self._payload(prompt, generate_kwargs))
+        text = data["choices"][0]["text"]
+        return truncate_at_stop(text, generate_kwargs.get("stop_sequences"))
+
+    async def stream(self, prompt: str, **generate_kwargs) -> AsyncIterator[str]:
+        payload = self._payload(prompt, generate_kwargs)
+        payload["stream"] = True
+        max_sentences = None if self.extended_params else generate_kwargs.get("max_sentences")
+        text = ""
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            async with self._get_client().stream("POST", "/v1/completions", json=payload) as response:
+                self._raise_for_status(response)
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)["choices"][0].get("text", "")
+                    if not chunk:
+                        continue
+                    if max_sentences:
+                        end = sentence_end((text + chunk).strip(), max_sentences)
+                        if end != -1:
+                            # Leaving the context manager closes the connection and aborts the request
+                            offset = len(text + chunk) - len((text + chunk).lstrip())
+                            yield (text + chunk)[:offset + end][len(text):]
+                            return
+                    text += chunk
+                    yield chunk
+        except (httpx.HTTPError, QueueFullError):
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    async def classify(self, prompt: str) -> float:
+        """One-token completion; P(YES) from the returned top logprobs when the server provides them"""
+        data = await self._post(self._with_work({
+            "model": self.model,
+            "prompt": prompt,
+            "max_tokens": 1,
+            "temperature": 0.0,
+            "logprobs": 20,
+        }))
+        choice = data["choices"][0]
+        top = ((choice.get("logprobs") or {}).get("top_logprobs") or [None])[0]
+        if top:
+            yes = sum(math.exp(lp) for token, lp in top.items() if token.strip().upper() == "YES")
+            no = sum(math.exp(lp) for token, lp in top.items() if token.strip().upper() == "NO")
+            if yes + no > 0:
+                return yes / (yes + no)
+        return 1.0 if "YES" in choice.get("text", "").upper() else 0.0
+
+    async def transcribe(self, audio: bytes, filename: str, language: Optional[str] = None) -> Dict[str, Any]:
+        """Whisper-style verbose transcription via /v1/audio/transcriptions"""
+        data = {"response_format": "verbose_json"}
+        if language:
+            data["language"] = language
+        data = {k: str(v) for k, v in self._with_work(data).items()}
+        self.requests += 1
+        try:
+            response = await self._get_client().post(
+                "/v1/audio/transcriptions", data=data, files={"file": (filename, audio)}
+            )
+            if response.status_code in (400, 413):
+                # Rejected by the host's audio ingestion: the client's fault, not a server error
+                raise AudioIngestError(response.json().get("detail", "Invalid audio"))
+            self._raise_for_status(response)
+        except (httpx.HTTPError, QueueFullError):
+            self.errors += 1
+            raise
+        return response.json()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "base_url": self.uds or self.base_url,
+            "requests": self.requests,
+            "errors": self.errors,
+            "completion_tokens": self.completion_tokens,
+            "in_flight": self.in_flight,
+        }
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,76 @@
+"""
+Single-Forward-Pass YES/NO Classifier
+Scores assessment prompts from the next-token logits of the loaded model instead of sampling a reply
+"""
+
+import logging
+from typing import List
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+YES_VARIANTS = ["YES", "Yes", "yes"]
+NO_VARIANTS = ["NO", "No", "no"]
+
+
+def _first_token_ids(tokenizer, variants: List[str]) -> List[int]:
+    ids = set()
+    for variant in variants:
+        encoded = tokenizer.encode(variant, add_special_tokens=False)
+        if encoded:
+            ids.add(encoded[0])
+    return sorted(ids)
+
+
+class YesNoClassifier:
+    """
+    Computes P(YES) for prompts that end with the assistant generation header.
+
+    One batched forward pass gives the next-token logits; the YES and NO spellings are
+    pooled with logsumexp and compared. `temperature` is a temperature-scaling calibration
+    knob: values above 1 soften overconfident scores, below 1 sharpen them.
+    """
+
+    def __init__(self, model, tokenizer, temperature: float = 1.0):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.temperature = temperature if temperature > 0 else 1.0
+        self.yes_ids = _first_token_ids(tokenizer, YES_VARIANTS)
+        self.no_ids = _first_token_ids(tokenizer, NO_VARIANTS)
+        if set(self.yes_ids) & set(self.no_ids):
+            raise ValueError("YES and NO variants share a first token; cannot classify from one step")
+
+    @torch.inference_mode()
+    def classify(self, prompts: List[str]) -> List[float]:
+        """Return P(YES) for each already-templated prompt"""
+        encoded = self.tokenizer(prompts, return_tensors="pt", padding=True, add_special_tokens=False)
+        input_ids = encoded.input_ids.to(self.model.device)
+        attention_mask = encoded.attention_mask.to(self.model.device)
+        # Left padding: positions must count real tokens only
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+
+        # Only the last position's logits are needed: run the decoder stack and project just
+        # that hidden state, instead of materialising batch x length x vocab logits
+        base, head = self.model.base_model, self.model.get_output_embeddings()
+        if base is self.model or head is None:
+            logits = self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                use_cache=False,
+            ).logits[:, -1, :]
+        else:
+            hidden = base(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                use_cache=False,
+            ).last_hidden_state[:, -1, :]
+            logits = head(hidden)
+        logits = logits.float()
+
+        yes = torch.logsumexp(logits[:, self.yes_ids], dim=-1)
+        no = torch.logsumexp(logits[:, self.no_ids], dim=-1)
+        probabilities = torch.sigmoid((yes - no) / self.temperature)
+        return probabilities.tolist()
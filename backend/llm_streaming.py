@@ -0,0 +1,58 @@
+"""
+Token Streaming Helpers
+Bridges the HF TextStreamer callbacks (generate thread) to asyncio consumers and formats SSE events
+"""
+
+import asyncio
+import json
+from typing import Any, Dict
+
+from transformers import TextStreamer
+
+_STREAM_END = object()
+
+# Keep proxies from buffering the event stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+class AsyncTextStreamer(TextStreamer):
+    """
+    TextIteratorStreamer-style streamer that can be consumed with `async for`.
+
+    `generate` calls `on_finalized_text` from the executor thread; chunks are handed to
+    the event loop with call_soon_threadsafe so the handler never blocks a worker thread.
+    """
+
+    def __init__(self, tokenizer, loop: asyncio.AbstractEventLoop, skip_prompt: bool = True, **decode_kwargs):
+        decode_kwargs.setdefault("skip_special_tokens", True)
+        super().__init__(tokenizer, skip_prompt=skip_prompt, **decode_kwargs)
+        self._loop = loop
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._closed = False
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if text:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, text)
+        if stream_end:
+            self.close()
+
+    def close(self):
+        """Signal end of stream (safe to call more than once, from any thread)"""
+        if self._closed:
+            return
+        self._closed = True
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, _STREAM_END)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        chunk = await self._queue.get()
+        if chunk is _STREAM_END:
+            raise StopAsyncIteration
+        return chunk
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
@@ -0,0 +1,291 @@
+"""
+Model Host
+Single process that owns Llama 3 and Whisper and serves them to the web workers over a Unix socket
+
+Run it next to a multi-worker web tier:
+
+    uvicorn model_host:app --uds /tmp/polybot-model-host.sock
+    LLM_BACKEND=host uvicorn server:app --host 0.0.0.0 --port 8000 --workers 4
+
+Every worker batches into the same InferenceScheduler here, so N workers share one copy of
+each model in VRAM. The API is the OpenAI completions / transcriptions shape (plus the
+scheduler's max_sentences), which OpenAICompatibleBackend already speaks.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional, Union
+
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+from admission import PRIORITY_INTERACTIVE, QueueFullError, WorkContext, current_work
+from audio_ingest import AudioIngestError, decode_audio, read_upload
+from inference_scheduler import InferenceScheduler
+from llm_backend import LocalHFBackend
+from llm_streaming import SSE_HEADERS
+from model_loader import attach_accelerators, load_draft_model, load_text_generation, prepare_for_batching
+from request_cancellation import CancelOnDisconnectMiddleware
+from stt_backends import load_stt_backend
+from stt_batcher import STTBatcher
+from model_registry import ModelRegistry
+from warmup import warm_up_whisper
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = os.getenv("MODEL_NAME", "TheBloke/Llama-3-8B-Instruct-GPTQ")
+TRANSFORMERS_CACHE = os.getenv("TRANSFORMERS_CACHE", "/app/model_cache")
+HUGGINGFACE_TOKEN = os.getenv("HUGGINGFACE_TOKEN")
+WHISPER_MODEL_NAME = os.getenv("WHISPER_MODEL_NAME", "turbo")
+# Speech-to-text backend: "openai-whisper" (PyTorch) or "faster-whisper" (CTranslate2). STT_DEVICE
+# "cpu" keeps Whisper off the GPU Llama runs on; STT_COMPUTE_TYPE "auto" is int8 on CPU, float16 on CUDA
+STT_BACKEND = os.getenv("STT_BACKEND", "openai-whisper").lower()
+STT_DEVICE = os.getenv("STT_DEVICE", "auto").lower()
+STT_COMPUTE_TYPE = os.getenv("STT_COMPUTE_TYPE", "auto").lower()
+STT_CPU_THREADS = int(os.getenv("STT_CPU_THREADS", "0")) or None
+MODEL_IDLE_SECONDS = float(os.getenv("MODEL_IDLE_SECONDS", "0"))
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
+GPU_MIN_FREE_MB = float(os.getenv("GPU_MIN_FREE_MB", "0"))
+USE_GPTQ = os.getenv("USE_GPTQ", "true").lower() == "true"
+USE_TORCH_COMPILE = os.getenv("USE_TORCH_COMPILE", "false").lower() == "true"
+INFERENCE_PROFILE = os.getenv("INFERENCE_PROFILE", "auto").lower()
+CPU_MODEL_NAME = os.getenv("CPU_MODEL_NAME", "meta-llama/Meta-Llama-3-8B-Instruct")
+CPU_INT8 = os.getenv("CPU_INT8", "true").lower() == "true"
+CPU_THREADS = int(os.getenv("CPU_THREADS", "0")) or None
+LLM_MAX_BATCH_SIZE = int(os.getenv("LLM_MAX_BATCH_SIZE", "8"))
+LLM_BATCH_WAIT_MS = float(os.getenv("LLM_BATCH_WAIT_MS", "10"))
+PREFIX_CACHE_ENABLED = os.getenv("PREFIX_CACHE_ENABLED", "true").lower() == "true"
+PREFIX_CACHE_MAX_MB = int(os.getenv("PREFIX_CACHE_MAX_MB", "1024"))
+PREFIX_CACHE_MAX_ENTRIES = int(os.getenv("PREFIX_CACHE_MAX_ENTRIES", "64"))
+DRAFT_MODEL_NAME = os.getenv("DRAFT_MODEL_NAME", "")
+DRAFT_NUM_TOKENS = int(os.getenv("DRAFT_NUM_TOKENS", "0")) or None
+GOAL_CLASSIFIER_TEMPERATURE = float(os.getenv("GOAL_CLASSIFIER_TEMPERATURE", "1.0"))
+WARMUP_WHISPER = os.getenv("WARMUP_WHISPER", "true").lower() == "true"
+LLM_MAX_QUEUE_DEPTH = int(os.getenv("LLM_MAX_QUEUE_DEPTH", "64"))
+WHISPER_MAX_QUEUE_DEPTH = int(os.getenv("WHISPER_MAX_QUEUE_DEPTH", "16"))
+# Utterances arriving within STT_BATCH_WAIT_MS of each other are transcribed as one padded batch
+STT_MAX_BATCH_SIZE = int(os.getenv("STT_MAX_BATCH_SIZE", "8"))
+STT_BATCH_WAIT_MS = float(os.getenv("STT_BATCH_WAIT_MS", "20"))
+MAX_AUDIO_UPLOAD_MB = float(os.getenv("MAX_AUDIO_UPLOAD_MB", "25"))
+MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", "120"))
+ADMISSION_AGING_SECONDS = float(os.getenv("ADMISSION_AGING_SECONDS", "10"))
+
+app = FastAPI(title="Polybot Model Host")
+# A web worker closing its connection (its own client left) cancels the generation here
+app.add_middleware(CancelOnDisconnectMiddleware, path_prefixes=["/v1/"])
+
+tokenizer = None
+text_generator = None
+is_loading = True
+
+scheduler = InferenceScheduler(
+    lambda: text_generator,
+    max_batch_size=LLM_MAX_BATCH_SIZE,
+    batch_wait_ms=LLM_BATCH_WAIT_MS,
+    max_queue_depth=LLM_MAX_QUEUE_DEPTH,
+    aging_seconds=ADMISSION_AGING_SECONDS,
+)
+backend = LocalHFBackend(scheduler, lambda: text_generator)
+model_registry = ModelRegistry(
+    memory_budget_bytes=int(MODEL_MEMORY_BUDGET_MB * 2**20),
+    idle_seconds=MODEL_IDLE_SECONDS,
+    min_free_gpu_bytes=int(GPU_MIN_FREE_MB * 2**20),
+)
+model_registry.register("whisper", lambda: load_stt_backend(
+    STT_BACKEND, WHISPER_MODEL_NAME, device=STT_DEVICE, compute_type=STT_COMPUTE_TYPE, cpu_threads=STT_CPU_THREADS,
+))
+stt_batcher = STTBatcher(
+    lambda: get_whisper_model(),
+    max_batch_size=STT_MAX_BATCH_SIZE,
+    batch_wait_ms=STT_BATCH_WAIT_MS,
+    max_queue_depth=WHISPER_MAX_QUEUE_DEPTH,
+    aging_seconds=ADMISSION_AGING_SECONDS,
+)
+
+
+class CompletionRequest(BaseModel):
+    """OpenAI /v1/completions body, with the extensions OpenAICompatibleBackend sends"""
+    model: Optional[str] = None
+    prompt: str
+    max_tokens: int = 64
+    temperature: Optional[float] = None
+    top_k: Optional[int] = None
+    top_p: Optional[float] = None
+    stop: Optional[Union[str, List[str]]] = None
+    stream: bool = False
+    logprobs: Optional[int] = None
+    json_schema: Optional[Dict[str, Any]] = None
+    guided_json: Optional[Dict[str, Any]] = None
+    max_sentences: Optional[int] = None
+    # Admission class and fairness key of the web request this completion serves
+    priority: Optional[int] = None
+    user: Optional[str] = None
+
+
+def to_generate_kwargs(request: CompletionRequest) -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = {"max_new_tokens": request.max_tokens}
+    if request.temperature is not None:
+        if request.temperature <= 0:
+            kwargs["do_sample"] = False
+        else:
+            kwargs["temperature"] = request.temperature
+    if request.top_k is not None:
+        kwargs["top_k"] = request.top_k
+    if request.top_p is not None:
+        kwargs["top_p"] = request.top_p
+    if request.stop:
+        kwargs["stop_sequences"] = [request.stop] if isinstance(request.stop, str) else list(request.stop)
+    schema = request.json_schema or request.guided_json
+    if schema is not None:
+        kwargs["json_schema"] = schema
+    if request.max_sentences:
+        kwargs["max_sentences"] = request.max_sentences
+    return kwargs
+
+
+def completion_body(text: str, logprobs: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    choice: Dict[str, Any] = {"index": 0, "text": text, "finish_reason": "stop"}
+    if logprobs is not None:
+        choice["logprobs"] = {"tokens": [text], "top_logprobs": [logprobs]}
+    return {
+        "object": "text_completion",
+        "created": int(time.time()),
+        "model": MODEL_NAME,
+        "choices": [choice],
+        "usage": {"completion_tokens": len(tokenizer.encode(text, add_special_tokens=False)) if tokenizer else 0},
+    }
+
+
+async def load_models_bg():
+    global tokenizer, text_generator, is_loading
+    os.environ['TRANSFORMERS_CACHE'] = TRANSFORMERS_CACHE
+    logger.info(f"⏳ Model host loading {MODEL_NAME}...")
+    try:
+        loop = asyncio.get_event_loop()
+        tok, mod, pipe = await loop.run_in_executor(
+            None, lambda: load_text_generation(
+                MODEL_NAME, HUGGINGFACE_TOKEN, use_gptq=USE_GPTQ, use_torch_compile=USE_TORCH_COMPILE,
+                profile=INFERENCE_PROFILE, cpu_model_name=CPU_MODEL_NAME, cpu_quantize_int8=CPU_INT8, cpu_threads=CPU_THREADS,
+            )
+        )
+        prepare_for_batching(tok, pipe)
+        draft = None
+        if DRAFT_MODEL_NAME:
+            try:
+                draft = await loop.run_in_executor(None, lambda: load_draft_model(DRAFT_MODEL_NAME, mod, tok, HUGGINGFACE_TOKEN))
+            except Exception as e:
+                logger.warning(f"⚠️ Draft model '{DRAFT_MODEL_NAME}' unavailable ({e}); decoding without speculation")
+        attach_accelerators(
+            scheduler,
+            mod,
+            tok,
+            prefix_cache_max_mb=PREFIX_CACHE_MAX_MB if PREFIX_CACHE_ENABLED else None,
+            prefix_cache_max_entries=PREFIX_CACHE_MAX_ENTRIES,
+            classifier_temperature=GOAL_CLASSIFIER_TEMPERATURE,
+            draft_model=draft,
+            draft_num_tokens=DRAFT_NUM_TOKENS,
+        )
+        tokenizer, text_generator = tok, pipe
+        model_registry.track("llm", pipe)
+        if draft is not None:
+            model_registry.track("draft", draft)
+        logger.info(f"✅ Model host ready ({MODEL_NAME}).")
+    except Exception as e:
+        logger.error(f"❌ Model host failed to load {MODEL_NAME}: {e}")
+    is_loading = False
+
+
+async def get_whisper_model():
+    return await model_registry.get("whisper")
+
+
+async def warm_up_whisper_bg():
+    # The web workers warm the LLM through /v1/completions; Whisper is only reachable here
+    try:
+        model = await get_whisper_model()
+        await asyncio.get_event_loop().run_in_executor(None, lambda: warm_up_whisper(model))
+        logger.info("✅ Model host Whisper warm-up done.")
+    except Exception as e:
+        logger.error(f"❌ Model host Whisper warm-up failed: {e}")
+
+
+@app.on_event("startup")
+async def startup_event():
+    asyncio.create_task(load_models_bg())
+    if WARMUP_WHISPER:
+        asyncio.create_task(warm_up_whisper_bg())
+    if MODEL_IDLE_SECONDS or MODEL_MEMORY_BUDGET_MB or GPU_MIN_FREE_MB:
+        asyncio.create_task(model_registry.run_evictor())
+
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    return JSONResponse({"detail": exc.detail}, status_code=503, headers={"Retry-After": exc.retry_after_header})
+
+
+@app.exception_handler(AudioIngestError)
+async def audio_ingest_handler(request: Request, exc: AudioIngestError):
+    return JSONResponse({"detail": exc.detail}, status_code=exc.status_code)
+
+
+@app.get("/health")
+def health_check():
+    whisper = model_registry.loaded("whisper")
+    return {
+        "status": "loading" if is_loading else ("healthy" if backend.ready else "error"),
+        "scheduler": backend.stats(),
+        "stt_batcher": stt_batcher.stats(),
+        "stt": whisper.stats() if whisper is not None else {"backend": STT_BACKEND, "loaded": False},
+        "models": model_registry.stats(),
+    }
+
+
+@app.post("/v1/completions")
+async def completions(request: CompletionRequest):
+    if not backend.ready:
+        raise HTTPException(status_code=503, detail="Model is still loading" if is_loading else "Model failed to load")
+    current_work.set(WorkContext(PRIORITY_INTERACTIVE if request.priority is None else request.priority, request.user))
+
+    if request.logprobs and request.max_tokens == 1:
+        # YES/NO classification: one forward pass, reported as top logprobs of the first token
+        p_yes = min(max(await backend.classify(request.prompt), 1e-9), 1 - 1e-9)
+        return completion_body("YES" if p_yes >= 0.5 else "NO", {"YES": math.log(p_yes), "NO": math.log(1 - p_yes)})
+
+    generate_kwargs = to_generate_kwargs(request)
+    if not request.stream:
+        return completion_body(await backend.generate(request.prompt, **generate_kwargs))
+    # Shed before the 200 goes out; inside the stream it could only end the body early
+    delay = backend.retry_after(current_work.get().priority)
+    if delay is not None:
+        raise QueueFullError(delay)
+
+    async def event_stream():
+        async for chunk in backend.stream(request.prompt, **generate_kwargs):
+            yield f"data: {json.dumps({'choices': [{'index': 0, 'text': chunk}]}, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.post("/v1/audio/transcriptions")
+async def transcriptions(
+    file: UploadFile = File(...),
+    language: Optional[str] = Form(None),
+    response_format: str = Form("verbose_json"),
+    priority: Optional[int] = Form(None),
+    user: Optional[str] = Form(None),
+):
+    current_work.set(WorkContext(PRIORITY_INTERACTIVE if priority is None else priority, user))
+    contents = await read_upload(file, int(MAX_AUDIO_UPLOAD_MB * 1024 * 1024))
+    audio = await asyncio.get_event_loop().run_in_executor(None, lambda: decode_audio(contents, max_seconds=MAX_AUDIO_SECONDS))
+    async with model_registry.use("whisper"):
+        result = await stt_batcher.transcribe(audio, language=language)
+    if response_format == "text":
+        return {"text": result.get("text", "")}
+    return jsonable_encoder(result)
@@ -0,0 +1,303 @@
+"""
+Model Loading
+Builds the Llama 3 text-generation pipeline and the Whisper model; shared by the web server
+(in-process mode) and the standalone model host
+"""
+
+import logging
+import os
+from typing import Any, Optional, Tuple
+
+import torch
+import whisper
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer, pipeline
+
+from conversation_encoder import ConversationEncoder
+from llm_classifier import YesNoClassifier
+from prefix_cache import PrefixKVCache
+from speculative import SpeculativeDecoder
+
+logger = logging.getLogger(__name__)
+
+
+def load_tokenizer(model_name: str, hf_token: Optional[str] = None):
+    """Tokenizer only, for processes that format prompts but do not generate"""
+    auth_kwargs = {"token": hf_token} if hf_token else {}
+    return AutoTokenizer.from_pretrained(model_name, **auth_kwargs)
+
+
+def resolve_inference_profile(profile: str = "auto") -> str:
+    """'gpu' or 'cpu'; 'auto' picks the GPU profile whenever CUDA is available"""
+    profile = (profile or "auto").lower()
+    if profile not in ("auto", "gpu", "cpu"):
+        raise ValueError(f"Unknown INFERENCE_PROFILE '{profile}' (expected auto, gpu or cpu)")
+    if profile == "auto":
+        return "gpu" if torch.cuda.is_available() else "cpu"
+    return profile
+
+
+def configure_cpu_threads(num_threads: Optional[int] = None) -> int:
+    """
+    One intra-op thread per CPU this process may run on (respecting container cpusets)
+    and a single inter-op thread, since generate() is one sequential chain of matmuls
+    """
+    if not num_threads:
+        try:
+            num_threads = len(os.sched_getaffinity(0))
+        except AttributeError:
+            num_threads = os.cpu_count() or 1
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only settable before the first parallel op
+        pass
+    return num_threads
+
+
+def load_cpu_text_generation(
+    model_name: str,
+    hf_token: Optional[str] = None,
+    quantize_int8: bool = True,
+    num_threads: Optional[int] = None,
+) -> Tuple[Any, Any, Any]:
+    """
+    CPU profile: float32 weights with every nn.Linear dynamically quantized to int8
+    (weights stored int8, activations quantized per call), about 4x smaller and 2-3x faster
+    than the float32 fallback. Needs a non-GPTQ checkpoint. Blocking: run it in an executor.
+    """
+    threads = configure_cpu_threads(num_threads)
+    auth_kwargs = {"token": hf_token} if hf_token else {}
+    logger.info(f"📦 Loading {model_name} for CPU inference ({threads} threads)...")
+    tok = AutoTokenizer.from_pretrained(model_name, **auth_kwargs)
+    mod = AutoModelForCausalLM.from_pretrained(
+        model_name,
+        dtype=torch.float32,
+        low_cpu_mem_usage=True,
+        **auth_kwargs
+    )
+    mod.eval()
+    if quantize_int8:
+        mod = torch.ao.quantization.quantize_dynamic(mod, {torch.nn.Linear}, dtype=torch.qint8)
+        logger.info("✅ Applied dynamic int8 quantization to linear layers")
+    pipe = pipeline("text-generation", model=mod, tokenizer=tok, device=-1)
+    return tok, mod, pipe
+
+
+def load_text_generation(
+    model_name: str,
+    hf_token: Optional[str] = None,
+    use_gptq: bool = True,
+    use_torch_compile: bool = False,
+    profile: str = "auto",
+    cpu_model_name: Optional[str] = None,
+    cpu_quantize_int8: bool = True,
+    cpu_threads: Optional[int] = None,
+) -> Tuple[Any, Any, Any]:
+    """
+    Load (tokenizer, model, pipeline). Blocking: run it in an executor.
+    Tries the pre-quantized GPTQ weights on CUDA first, then standard loading. The CPU
+    profile loads cpu_model_name (GPTQ kernels are CUDA-only) with int8 linear layers.
+    """
+    if resolve_inference_profile(profile) == "cpu":
+        return load_cpu_text_generation(
+            cpu_model_name or model_name, hf_token, quantize_int8=cpu_quantize_int8, num_threads=cpu_threads
+        )
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float32 
+    
+    # Check if accelerate is available for device_map
+    try:
+        import accelerate
+        HAS_ACCELERATE = True
+        logger.info("✅ accelerate library available")
+    except ImportError:
+        HAS_ACCELERATE = False
+        logger.error("❌ accelerate library not found! It's required for model loading. Please install it: pip install accelerate")
+
+    auth_kwargs = {"token": hf_token} if hf_token else {} 
+    
+    # Try GPTQ first (pre-quantized models)
+    # When auto-gptq is installed, transformers' AutoModelForCausalLM can auto-detect GPTQ models
+    if use_gptq and torch.cuda.is_available():
+        try:
+            # Check if auto-gptq is available
+            import auto_gptq
+            logger.info("📦 Loading pre-quantized GPTQ model (auto-detected)...")
+            
+            # Load tokenizer first
+            tok = AutoTokenizer.from_pretrained(model_name, **auth_kwargs)
+            
+            # Use standard transformers API - it will auto-detect GPTQ when auto-gptq is installed
+            # This is the recommended way for pre-quantized models from TheBloke
+            model_kwargs = {
+                "trust_remote_code": False,
+                "low_cpu_mem_usage": True,
+                **auth_kwargs
+            }
+            
+            if HAS_ACCELERATE:
+                model_kwargs["device_map"] = "auto"
+            
+            # AutoModelForCausalLM will automatically use AutoGPTQForCausalLM 
+            # when it detects GPTQ format and auto-gptq is installed
+            mod = AutoModelForCausalLM.from_pretrained(
+                model_name,
+                **model_kwargs
+            )
+            
+            # If device_map wasn't used, manually move to device
+            if not HAS_ACCELERATE:
+                mod = mod.to(device)
+            
+            logger.info("✅ Successfully loaded GPTQ quantized model (~5.5GB VRAM)")
+            
+            # Create pipeline
+            pipe = pipeline("text-generation", model=mod, tokenizer=tok)
+            return tok, mod, pipe
+            
+        except ImportError as import_err:
+            logger.warning(f"⚠️ AutoGPTQ not available: {import_err}. Install auto-gptq for GPTQ support. Falling back to standard model.")
+        except Exception as gptq_error:
+            logger.warning(f"⚠️ GPTQ loading failed: {gptq_error}")
+            logger.info("🔄 Falling back to standard model loading...")
+    
+    # Fallback: Standard model loading (for non-GPTQ models or if GPTQ fails)
+    logger.info("📦 Loading standard model (non-quantized)...")
+    tok = AutoTokenizer.from_pretrained(model_name, **auth_kwargs)
+    
+    # Prepare model loading kwargs
+    model_kwargs = {
+        "dtype": dtype,  # Use dtype instead of deprecated torch_dtype
+        **auth_kwargs
+    }
+    
+    if HAS_ACCELERATE:
+        model_kwargs["device_map"] = "auto"
+    else:
+        # Without accelerate, we need to load on CPU first, then move to device
+        # This avoids the accelerate requirement that newer transformers enforces
+        logger.warning("⚠️ Loading model without device_map (accelerate not available)")
+        # Don't pass device parameter - load on CPU, then move manually
+        mod = AutoModelForCausalLM.from_pretrained(
+            model_name, 
+            torch_dtype=dtype,  # Use torch_dtype for older compatibility
+            **auth_kwargs
+        )
+        # Move to device after loading
+        mod = mod.to(device)
+        mod.eval()
+        pipe = pipeline("text-generation", model=mod, tokenizer=tok)
+        return tok, mod, pipe
+    
+    # With accelerate, use device_map
+    mod = AutoModelForCausalLM.from_pretrained(
+        model_name, 
+        **model_kwargs
+    )
+    
+    mod.eval()
+    
+    # Apply torch.compile() for faster inference (PyTorch 2.0+)
+    if use_torch_compile and hasattr(torch, 'compile'):
+        try:
+            logger.info("⚡ Compiling model with torch.compile() for faster inference...")
+            mod = torch.compile(mod, mode="reduce-overhead", fullgraph=False)
+            logger.info("✅ Model compiled successfully")
+        except Exception as e:
+            logger.warning(f"⚠️ torch.compile() failed: {e}. Continuing without compilation.")
+    
+    pipe = pipeline("text-generation", model=mod, tokenizer=tok) 
+    return tok, mod, pipe
+
+
+def draft_vocab_mismatch(draft_tokenizer, draft_vocab_size: int, tokenizer, vocab_size: int) -> Optional[str]:
+    """
+    Why a draft model cannot propose tokens for the main model, or None if it can. The
+    embedding sizes must match and every regular token must have the same id; special and
+    added tokens (reserved slots, chat markers) may differ between members of a family
+    """
+    if draft_vocab_size != vocab_size:
+        return f"vocab_size {draft_vocab_size} != {vocab_size}"
+    draft_vocab = draft_tokenizer.get_vocab()
+    added = set(tokenizer.get_added_vocab())
+    mismatched = [t for t, i in tokenizer.get_vocab().items() if t not in added and draft_vocab.get(t) != i]
+    if mismatched:
+        return f"{len(mismatched)} regular tokens have different ids (e.g. {mismatched[0]!r})"
+    return None
+
+
+def load_draft_model(draft_model_name: str, model, tokenizer, hf_token: Optional[str] = None):
+    """
+    Small model from the same family for speculative decoding, on the main model's device.
+    It must share the main model's token ids (e.g. Llama 3.2 1B for Llama 3 8B); see
+    draft_vocab_mismatch. Blocking: run it in an executor
+    """
+    auth_kwargs = {"token": hf_token} if hf_token else {}
+    draft_tokenizer = AutoTokenizer.from_pretrained(draft_model_name, **auth_kwargs)
+    draft_config = AutoConfig.from_pretrained(draft_model_name, **auth_kwargs)
+    reason = draft_vocab_mismatch(draft_tokenizer, draft_config.vocab_size, tokenizer, model.config.vocab_size)
+    if reason is not None:
+        raise ValueError(f"{draft_model_name} does not share the main model's vocabulary: {reason}")
+    dtype = getattr(model, "dtype", None)
+    if dtype is None or not dtype.is_floating_point:
+        dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float32
+    draft = AutoModelForCausalLM.from_pretrained(draft_model_name, dtype=dtype, low_cpu_mem_usage=True, **auth_kwargs)
+    draft = draft.to(model.device)
+    draft.eval()
+    logger.info(f"✅ Loaded draft model '{draft_model_name}' for speculative decoding")
+    return draft
+
+
+def prepare_for_batching(tokenizer, pipe) -> Optional[int]:
+    """
+    Use Llama 3's end-of-turn token as eos and give the tokenizer a pad token with left
+    padding, which batched generation of a decoder-only model needs. Returns the eot id
+    """
+    eot_id = None
+    if "<|eot_id|>" in tokenizer.vocab:
+        eot_id = tokenizer.convert_tokens_to_ids("<|eot_id|>")
+        pipe.tokenizer.eos_token_id = eot_id
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    return eot_id
+
+
+def attach_accelerators(
+    scheduler,
+    model,
+    tokenizer,
+    prefix_cache_max_mb: Optional[int] = None,
+    prefix_cache_max_entries: int = 64,
+    classifier_temperature: float = 1.0,
+    draft_model=None,
+    draft_num_tokens: Optional[int] = None,
+):
+    """
+    Give the scheduler an incremental conversation encoder, a prefix KV-cache (unless
+    prefix_cache_max_mb is None), the YES/NO classifier and, with a draft model, a
+    speculative decoder
+    """
+    scheduler.encoder = ConversationEncoder(tokenizer)
+    if prefix_cache_max_mb is not None:
+        scheduler.prefix_cache = PrefixKVCache(
+            model,
+            tokenizer,
+            max_bytes=prefix_cache_max_mb * 1024 * 1024,
+            max_entries=prefix_cache_max_entries,
+        )
+        logger.info(f"✅ Prefix KV-cache enabled ({prefix_cache_max_mb} MB budget)")
+    if draft_model is not None:
+        scheduler.speculative = SpeculativeDecoder(model, draft_model, num_assistant_tokens=draft_num_tokens)
+    try:
+        scheduler.classifier = YesNoClassifier(model, tokenizer, temperature=classifier_temperature)
+    except Exception as e:
+        logger.warning(f"⚠️ YES/NO classifier unavailable ({e}); goal assessment falls back to generation")
+
+
+def load_whisper(model_name: str, device: Optional[str] = None):
+    """Load an openai-whisper model, on the GPU when there is one unless `device` says otherwise. Blocking: run it in an executor"""
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    return whisper.load_model(model_name, device=device)
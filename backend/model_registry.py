@@ -0,0 +1,245 @@
+"""
+Model Registry
+Tracks every loaded model's memory footprint, keeps on-demand models (Whisper) resident
+while requests use them, and evicts them on idle timeout or memory pressure, so memory is
+only reclaimed when a model is actually dropped
+"""
+
+import asyncio
+import gc
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_footprint(model: Any) -> int:
+    """Bytes of parameters and buffers; pipelines and STT backends are unwrapped through .model"""
+    module = model
+    while not isinstance(module, torch.nn.Module) and getattr(module, "model", None) is not None:
+        module = module.model
+    if not isinstance(module, torch.nn.Module):
+        return 0
+    return sum(t.numel() * t.element_size() for t in itertools.chain(module.parameters(), module.buffers()))
+
+
+def model_device(model: Any) -> str:
+    """"cuda" or "cpu" for a module, pipeline or STT backend"""
+    device = getattr(model, "device", None)
+    if device is None and isinstance(model, torch.nn.Module):
+        device = next(itertools.chain(model.parameters(), model.buffers()), torch.empty(0)).device
+    if device is not None:
+        return torch.device(device).type
+    module = getattr(model, "model", None)
+    return model_device(module) if module is not None else "cpu"
+
+
+def _process_rss() -> int:
+    """Resident set size of this process in bytes (Linux /proc; 0 where unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _memory_in_use() -> Dict[str, int]:
+    """Device-wide GPU bytes in use and this process's RSS, to diff around a load"""
+    usage = {"cpu": _process_rss()}
+    if torch.cuda.is_available():
+        free, total = torch.cuda.mem_get_info()
+        usage["cuda"] = total - free
+    return usage
+
+
+@dataclass
+class ModelEntry:
+    name: str
+    loader: Optional[Callable[[], Any]]
+    # Pinned models (the LLM tiers) are tracked but never evicted
+    pinned: bool = False
+    model: Any = None
+    footprint: int = 0
+    device: str = "cpu"
+    in_use: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+    loads: int = 0
+    evictions: int = 0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class ModelRegistry:
+    """
+    Loaded models and their footprint.
+
+    `register(name, loader)` declares an on-demand model: `get(name)` loads it in an executor
+    on first use (and again after an eviction). Callers hold `use(name)` for as long as a
+    request needs the model; an entry in use is never evicted. Unpinned, unused models are
+    evicted, least recently used first:
+
+    - after `idle_seconds` without use (checked by `run_evictor`; 0 keeps them resident);
+    - before a load would take the tracked total over `memory_budget_bytes`;
+    - while free GPU memory is below `min_free_gpu_bytes` (GPU-resident models only).
+
+    Only an eviction pays for gc.collect() and torch.cuda.empty_cache().
+    """
+
+    def __init__(self, memory_budget_bytes: int = 0, idle_seconds: float = 0.0, min_free_gpu_bytes: int = 0):
+        self.memory_budget = memory_budget_bytes
+        self.idle_seconds = idle_seconds
+        self.min_free_gpu = min_free_gpu_bytes
+        self._entries: Dict[str, ModelEntry] = {}
+
+    def register(self, name: str, loader: Callable[[], Any], pinned: bool = False):
+        """Declare an on-demand model; `loader` is blocking and runs in an executor"""
+        self._entries[name] = ModelEntry(name=name, loader=loader, pinned=pinned)
+
+    def track(self, name: str, model: Any, pinned: bool = True):
+        """Record a model loaded elsewhere (e.g. the LLM pipeline) so its footprint is accounted for"""
+        entry = self._entries.setdefault(name, ModelEntry(name=name, loader=None, pinned=pinned))
+        self._set_model(entry, model, estimate_footprint(model))
+
+    def loaded(self, name: str) -> Any:
+        """The model if it is resident, without loading it"""
+        entry = self._entries.get(name)
+        return entry.model if entry is not None else None
+
+    async def get(self, name: str) -> Any:
+        """The model, loaded first if it is not resident"""
+        entry = self._entries[name]
+        entry.last_used = time.monotonic()
+        if entry.model is not None:
+            return entry.model
+        async with entry.lock:
+            if entry.model is None:
+                if entry.loader is None:
+                    raise RuntimeError(f"Model '{name}' is not loaded")
+                self._relieve_pressure(incoming=entry.footprint)
+                loop = asyncio.get_event_loop()
+                before = _memory_in_use()
+                started = time.monotonic()
+                model = await loop.run_in_executor(None, entry.loader)
+                footprint = estimate_footprint(model)
+                if not footprint:
+                    # Not a torch model (e.g. CTranslate2, which has its own allocator): measure
+                    # the GPU's used memory or the process RSS before and after the load
+                    device = model_device(model)
+                    footprint = max(0, _memory_in_use().get(device, 0) - before.get(device, 0))
+                self._set_model(entry, model, footprint)
+                entry.loads += 1
+                logger.info(
+                    f"[ModelRegistry] Loaded '{name}' on {entry.device} ({footprint / 2**20:.0f} MB) "
+                    f"in {time.monotonic() - started:.1f}s"
+                )
+        return entry.model
+
+    @asynccontextmanager
+    async def use(self, name: str) -> AsyncIterator[None]:
+        """Keep `name` resident for the duration of the block (does not load it)"""
+        entry = self._entries[name]
+        entry.in_use += 1
+        try:
+            yield
+        finally:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+
+    def evict(self, name: str) -> bool:
+        """Drop an unpinned, unused model now; False if it is pinned, in use or not loaded"""
+        entry = self._entries.get(name)
+        if entry is None or not self._evictable(entry):
+            return False
+        self._drop(entry, "requested")
+        self._free_memory()
+        return True
+
+    def evict_idle(self, now: Optional[float] = None) -> List[str]:
+        """Drop every evictable model unused for idle_seconds; returns their names"""
+        if not self.idle_seconds:
+            return []
+        now = time.monotonic() if now is None else now
+        evicted = [
+            entry.name for entry in self._entries.values()
+            if self._evictable(entry) and now - entry.last_used >= self.idle_seconds
+        ]
+        for name in evicted:
+            self._drop(self._entries[name], f"idle {now - self._entries[name].last_used:.0f}s")
+        if evicted:
+            self._free_memory()
+        return evicted
+
+    async def run_evictor(self, interval: float = 30.0):
+        """Background task: idle and memory-pressure eviction every `interval` seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.evict_idle()
+                self._relieve_pressure()
+            except Exception as e:
+                logger.warning(f"[ModelRegistry] Eviction pass failed: {e}")
+
+    def resident_bytes(self) -> int:
+        return sum(entry.footprint for entry in self._entries.values() if entry.model is not None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "resident_mb": round(self.resident_bytes() / 2**20, 1),
+            "budget_mb": round(self.memory_budget / 2**20, 1) if self.memory_budget else None,
+            "idle_seconds": self.idle_seconds or None,
+            "models": {
+                entry.name: {
+                    "loaded": entry.model is not None,
+                    "device": entry.device,
+                    "footprint_mb": round(entry.footprint / 2**20, 1),
+                    "pinned": entry.pinned,
+                    "in_use": entry.in_use,
+                    "idle_seconds": round(time.monotonic() - entry.last_used, 1),
+                    "loads": entry.loads,
+                    "evictions": entry.evictions,
+                }
+                for entry in self._entries.values()
+            },
+        }
+
+    def _set_model(self, entry: ModelEntry, model: Any, footprint: int):
+        entry.model = model
+        entry.footprint = footprint
+        entry.device = model_device(model)
+        entry.last_used = time.monotonic()
+
+    def _evictable(self, entry: ModelEntry) -> bool:
+        return entry.model is not None and not entry.pinned and entry.in_use == 0 and entry.loader is not None
+
+    def _drop(self, entry: ModelEntry, reason: str):
+        entry.model = None
+        entry.evictions += 1
+        logger.info(f"[ModelRegistry] Evicted '{entry.name}' ({entry.footprint / 2**20:.0f} MB, {reason})")
+
+    def _free_memory(self):
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def _relieve_pressure(self, incoming: int = 0):
+        """Evict least recently used models until the budget fits `incoming` and the GPU has its headroom"""
+        candidates = sorted((e for e in self._entries.values() if self._evictable(e)), key=lambda e: e.last_used)
+        evicted = False
+        if self.memory_budget:
+            while candidates and self.resident_bytes() + incoming > self.memory_budget:
+                self._drop(candidates.pop(0), "over memory budget")
+                evicted = True
+        if self.min_free_gpu and torch.cuda.is_available():
+            gpu = [e for e in candidates if e.device == "cuda"]
+            while gpu and torch.cuda.mem_get_info()[0] < self.min_free_gpu:
+                self._drop(gpu.pop(0), "low free GPU memory")
+                # Hand the blocks back so mem_get_info sees them
+                self._free_memory()
+        if evicted:
+            self._free_memory()
@@ -0,0 +1,130 @@
+"""
+Model Router
+Maps each LLM call site to a model tier (a small model for YES/NO, correction and translation
+work, the large one for conversation) and spills work over to the small tier while the
+large one is saturated
+"""
+
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TIER_LARGE = "large"
+TIER_SMALL = "small"
+
+# Call sites
+TASK_CONVERSATION = "conversation"  # NPC and tutor replies
+TASK_ASSESSMENT = "assessment"      # tutor/voice goal YES/NO
+TASK_CORRECTION = "correction"      # NO_ERROR vs CORRECTED: ...
+TASK_TRANSLATION = "translation"    # practice_translate
+TASK_GRAMMAR = "grammar"            # boss grammar_check
+TASK_GOAL_CHECK = "goal_check"      # practice check_goal_achievement
+TASK_SUMMARY = "summary"            # rolling history summaries
+TASK_REPORT = "report"              # post-game grammar/vocabulary review
+
+DEFAULT_ROUTES = {
+    TASK_CONVERSATION: TIER_LARGE,
+    TASK_ASSESSMENT: TIER_SMALL,
+    TASK_CORRECTION: TIER_SMALL,
+    TASK_TRANSLATION: TIER_SMALL,
+    TASK_GRAMMAR: TIER_SMALL,
+    TASK_GOAL_CHECK: TIER_SMALL,
+    TASK_SUMMARY: TIER_SMALL,
+    TASK_REPORT: TIER_LARGE,
+}
+
+
+def parse_routes(spec: str, base: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """'correction=large,translation=small' on top of `base` (DEFAULT_ROUTES)"""
+    routes = dict(DEFAULT_ROUTES if base is None else base)
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        task, _, tier = item.partition("=")
+        if not tier.strip():
+            raise ValueError(f"Invalid model route '{item.strip()}' (expected task=tier)")
+        routes[task.strip()] = tier.strip()
+    return routes
+
+
+class ModelRouter:
+    """
+    select(task) resolves a call site to (tier, LLMBackend) at call time:
+
+    - the task's configured tier, or `default_tier` when that tier is missing or not
+      loaded yet (so a small model that failed to load costs nothing but the capacity);
+    - when the chosen tier is `spill_from` and its backlog has reached `spillover_depth`
+      queued requests, the `spill_to` tier takes the call instead, provided it is ready
+      and less backed up itself.
+
+    Prompts are templated once for all tiers, so the tiers must share a chat template
+    (e.g. Llama 3.1 8B and Llama 3.2 1B/3B Instruct).
+    """
+
+    def __init__(
+        self,
+        tiers: Dict[str, Any],
+        routes: Optional[Dict[str, str]] = None,
+        default_tier: str = TIER_LARGE,
+        spillover_depth: int = 8,
+        spill_from: str = TIER_LARGE,
+        spill_to: str = TIER_SMALL,
+    ):
+        if default_tier not in tiers:
+            raise ValueError(f"Default tier '{default_tier}' has no backend")
+        self.tiers = tiers
+        self.routes = dict(DEFAULT_ROUTES if routes is None else routes)
+        self.default_tier = default_tier
+        self.spillover_depth = spillover_depth
+        self.spill_from = spill_from
+        self.spill_to = spill_to
+
+        self.routed: Dict[str, int] = {}
+        self.fallbacks = 0
+        self.spilled = 0
+
+    def _available(self, tier: str) -> bool:
+        backend = self.tiers.get(tier)
+        return backend is not None and backend.ready
+
+    def select(self, task: str) -> Tuple[str, Any]:
+        tier = self.routes.get(task, self.default_tier)
+        if tier != self.default_tier and not self._available(tier):
+            self.fallbacks += 1
+            tier = self.default_tier
+
+        if self.spillover_depth and tier == self.spill_from and self._available(self.spill_to):
+            backlog = self.tiers[tier].backlog()
+            if backlog >= self.spillover_depth and self.tiers[self.spill_to].backlog() < backlog:
+                self.spilled += 1
+                tier = self.spill_to
+
+        key = f"{task}:{tier}"
+        self.routed[key] = self.routed.get(key, 0) + 1
+        return tier, self.tiers[tier]
+
+    def backend(self, task: str):
+        """The LLMBackend that should serve this call"""
+        return self.select(task)[1]
+
+    def retry_after(self, priority: int) -> Optional[float]:
+        """None while the default tier or any other loaded tier would still admit this class"""
+        delays = []
+        for tier in self.tiers:
+            if tier != self.default_tier and not self._available(tier):
+                continue
+            delay = self.tiers[tier].retry_after(priority)
+            if delay is None:
+                return None
+            delays.append(delay)
+        return min(delays) if delays else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "routes": dict(self.routes),
+            "tiers": {tier: {"ready": backend.ready, "backlog": backend.backlog()} for tier, backend in self.tiers.items()},
+            "routed": dict(self.routed),
+            "fallbacks": self.fallbacks,
+            "spilled": self.spilled,
+        }
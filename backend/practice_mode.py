@@ -5,14 +5,49 @@ Handles conversation state, goal checking, and post-game feedback
 
 import json
 import re
-import asyncio
 import logging
 from typing import List, Dict, Optional, Any
 from dataclasses import dataclass, field
+from json_constraint import max_output_length
 from scenario_templates import ScenarioTemplate
 
 logger = logging.getLogger(__name__)
 
+# Language names for prompts; unknown codes are passed through as-is
+LANG_NAMES = {
+    'en': 'English',
+    'fr': 'French',
+    'es': 'Spanish',
+    'it': 'Italian',
+    'pt': 'Portuguese',
+    'tw': 'Twi',
+    'de': 'German'
+}
+
+# Output shape of the goal check; generation is constrained to it and ends at the closing brace
+GOAL_CHECK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "thought": {"type": "string", "maxLength": 240},
+        "scene_status": {"enum": ["ACTIVE", "COMPLETE"]},
+        "reply": {"type": "string", "maxLength": 160},
+    },
+}
+# Enough for the longest object the schema allows, so the JSON is never cut off
+GOAL_CHECK_MAX_TOKENS = max_output_length(GOAL_CHECK_SCHEMA) + 1
+
+# Fused practice turn: the goal decision and the character's next line from one generation.
+# scene_status comes first so the reply is written knowing whether the scene is ending
+PRACTICE_TURN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "scene_status": {"enum": ["ACTIVE", "COMPLETE"]},
+        "reply": {"type": "string", "maxLength": 160},
+    },
+}
+# A cut-off object would cost a fallback to the two-call path; decoding still ends at the brace
+PRACTICE_TURN_MAX_TOKENS = max_output_length(PRACTICE_TURN_SCHEMA) + 1
+
 
 @dataclass
 class GameState:
@@ -50,18 +85,20 @@ async def check_goal_achievement(
     conversation_history: List[Dict[str, str]],
     winning_condition: str,
     target_lang: str,
-    text_generator,
+    llm_backend,
     generate_chat_input_func
 ) -> Dict[str, str]:
     """
     Goal Check Classifier using "Hidden Thought" Method
-    Requests structured JSON output from Llama 3 containing internal state and external speech
+    Requests structured JSON output from Llama 3 containing internal state and external speech.
+    Decoding is constrained to GOAL_CHECK_SCHEMA, so the parsing fallbacks below only matter
+    when the output is cut off by max_new_tokens
     
     Args:
         conversation_history: List of conversation messages
         winning_condition: Description of the goal that ends the interaction
         target_lang: Target language code
-        text_generator: Llama 3 text generation function
+        llm_backend: LLMBackend used for Llama 3 generation
         generate_chat_input_func: Function to format chat input for Llama 3
         
     Returns:
@@ -70,6 +107,7 @@ async def check_goal_achievement(
     # Build the goal check prompt requesting JSON output
     # Use more context (last 12 messages or full conversation if shorter)
     context_messages = conversation_history[-12:] if len(conversation_history) > 12 else conversation_history
+    target_lang_name = LANG_NAMES.get(target_lang.lower(), target_lang)
     
     goal_check_prompt = f"""You are analyzing a conversation to determine if a learning goal has been achieved.
 
@@ -95,7 +133,7 @@ Conversation History:
 Your task: Determine if the winning condition has been met. Respond in JSON format with three fields:
 1. "thought": Your internal analysis of whether ALL conditions are met (in English)
 2. "scene_status": Either "ACTIVE" (goal not met, continue conversation) or "COMPLETE" (goal achieved - ALL conditions met)
-3. "reply": If COMPLETE, provide a natural closing line in {target_lang}. If ACTIVE, provide the next character response in {target_lang}.
+3. "reply": If COMPLETE, provide a natural closing line in {target_lang_name}. If ACTIVE, provide the next character response in {target_lang_name}.
 
 IMPORTANT: Respond ONLY with valid JSON. No additional text before or after.
 
@@ -120,13 +158,9 @@ Now analyze the conversation and respond:"""
         prompt_input = generate_chat_input_func(goal_check_prompt, [])
         
         # Generate response
-        loop = asyncio.get_event_loop()
-        output = await loop.run_in_executor(
-            None,
-            lambda: text_generator(prompt_input, max_new_tokens=150, temperature=0.3, return_full_text=False)
-        )
+        output = await llm_backend.generate(prompt_input, max_new_tokens=GOAL_CHECK_MAX_TOKENS, temperature=0.3, json_schema=GOAL_CHECK_SCHEMA)
         
-        raw_response = output[0]['generated_text'].strip()
+        raw_response = output.strip()
         
         # Log raw response for debugging
         logger.info(f"[Goal Check] Raw LLM response: {raw_response[:200]}")
@@ -221,6 +255,61 @@ Now analyze the conversation and respond:"""
         }
 
 
+async def generate_reply_with_goal_check(
+    system_prompt: str,
+    messages: List[Dict[str, str]],
+    winning_condition: str,
+    target_lang: str,
+    llm_backend,
+    generate_chat_input_func,
+    summary: Optional[str] = None,
+) -> Optional[Dict[str, str]]:
+    """
+    Fused practice turn: one generation constrained to PRACTICE_TURN_SCHEMA yields both the
+    scene status and the character's reply, instead of a reply followed by
+    check_goal_achievement re-reading the conversation (two prefills, two decodes).
+
+    Args:
+        system_prompt: Stage Manager prompt of the scenario
+        messages: Conversation so far, newest user turn last (already fitted to the budget)
+        winning_condition: Description of the goal that ends the interaction
+        target_lang: Target language code
+        llm_backend: LLMBackend used for Llama 3 generation
+        generate_chat_input_func: Function to format chat input for Llama 3
+        summary: Rolling summary of turns trimmed from `messages`, if any
+
+    Returns:
+        Same shape as check_goal_achievement ("thought" is empty), or None when the output
+        is unusable and the caller should fall back to the two-call path
+    """
+    target_lang_name = LANG_NAMES.get(target_lang.lower(), target_lang)
+    fused_prompt = f"""{system_prompt}
+
+Scene goal: {winning_condition}
+Before you answer, decide whether the goal has now been fully achieved in this conversation.
+Respond ONLY with JSON: {{"scene_status": "ACTIVE" or "COMPLETE", "reply": "<your next line, in {target_lang_name}>"}}
+If COMPLETE, the reply is a natural closing line. If ACTIVE, it is your next line as the character."""
+    prompt_input = generate_chat_input_func(fused_prompt, messages, summary)
+
+    output = await llm_backend.generate(prompt_input, max_new_tokens=PRACTICE_TURN_MAX_TOKENS, temperature=0.5, json_schema=PRACTICE_TURN_SCHEMA)
+    try:
+        result = json.loads(output.strip())
+    except json.JSONDecodeError as e:
+        # Cut off by max_new_tokens, or a backend that ignores json_schema
+        logger.warning(f"[Practice Turn] Unusable fused output ({e}); falling back to reply + goal check")
+        return None
+    if not isinstance(result, dict):
+        return None
+
+    scene_status = str(result.get("scene_status", "")).upper()
+    reply = str(result.get("reply", "")).strip()
+    if scene_status not in ("ACTIVE", "COMPLETE") or not reply:
+        logger.warning(f"[Practice Turn] Incomplete fused output: {output[:200]}")
+        return None
+    logger.info(f"[Practice Turn] Fused result - scene_status: {scene_status}")
+    return {"thought": "", "scene_status": scene_status, "reply": reply}
+
+
 def generate_pronunciation_feedback(user_transcripts: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
     Generate pronunciation feedback from user transcripts
@@ -292,7 +381,7 @@ async def generate_grammar_vocabulary_review(
     conversation_transcript: str,
     target_lang: str,
     native_lang: str,
-    text_generator,
+    llm_backend,
     generate_chat_input_func
 ) -> Dict[str, Any]:
     """
@@ -302,22 +391,13 @@ async def generate_grammar_vocabulary_review(
         conversation_transcript: Full conversation text
         target_lang: Target language code
         native_lang: Native language code for explanations
-        text_generator: Llama 3 text generation function
+        llm_backend: LLMBackend used for Llama 3 generation
         generate_chat_input_func: Function to format chat input for Llama 3
         
     Returns:
         Dictionary with grammar errors, suggestions, and vocabulary recommendations
     """
-    lang_names = {
-        'en': 'English',
-        'fr': 'French', 
-        'es': 'Spanish',
-        'it': 'Italian',
-        'pt': 'Portuguese',
-        'tw': 'Twi',
-        'de': 'German'
-    }
-    target_lang_name = lang_names.get(target_lang.lower(), target_lang)
+    target_lang_name = LANG_NAMES.get(target_lang.lower(), target_lang)
     
     review_prompt = f"""You are an expert language tutor reviewing a student's conversation transcript.
 
@@ -351,13 +431,9 @@ Now review the transcript:"""
     
     try:
         prompt_input = generate_chat_input_func(review_prompt, [])
-        loop = asyncio.get_event_loop()
-        output = await loop.run_in_executor(
-            None,
-            lambda: text_generator(prompt_input, max_new_tokens=300, temperature=0.3, return_full_text=False)
-        )
+        output = await llm_backend.generate(prompt_input, max_new_tokens=300, temperature=0.3)
         
-        raw_response = output[0]['generated_text'].strip()
+        raw_response = output.strip()
         
         # Parse the structured response
         grammar_errors = []
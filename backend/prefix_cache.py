@@ -0,0 +1,156 @@
+"""
+Prefix KV-Cache for Llama 3 prompts
+Keeps computed past_key_values for shared system-prompt prefixes and earlier conversation turns
+so the next request only prefills the tokens it adds
+"""
+
+import copy
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _CacheEntry:
+    token_ids: Tuple[int, ...]
+    past_key_values: Any
+    nbytes: int
+
+
+class PrefixKVCache:
+    """
+    LRU store of KV caches keyed by the exact prompt token ids they were computed for.
+
+    Two kinds of entries are recorded after every generation:
+    - the system block (everything up to the first end-of-turn token), which is shared by
+      every request with the same Stage Manager / tutor system prompt, i.e. per
+      (scenario, target_lang, native_lang) or per language pair for the tutor prompts
+    - the full prompt, which is a prefix of the same conversation's next turn
+
+    A lookup returns a private copy of the longest cached prefix, so generate can extend it
+    without touching the stored entry. Memory is bounded by `max_bytes` and `max_entries`.
+    """
+
+    def __init__(self, model, tokenizer, max_bytes: int, max_entries: int = 64, min_prefix_tokens: int = 16):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.min_prefix_tokens = min_prefix_tokens
+
+        self._entries: "OrderedDict[Tuple[int, ...], _CacheEntry]" = OrderedDict()
+        self._total_bytes = 0
+        self._bytes_per_token = self._estimate_bytes_per_token(model)
+
+        boundary_tokens = [t for t in ("<|eot_id|>", tokenizer.eos_token) if t]
+        self._boundary_ids = {tokenizer.convert_tokens_to_ids(t) for t in boundary_tokens}
+
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    @staticmethod
+    def _estimate_bytes_per_token(model) -> int:
+        """K and V for every layer: 2 * layers * kv_heads * head_dim * dtype size"""
+        config = model.config
+        num_heads = config.num_attention_heads
+        kv_heads = getattr(config, "num_key_value_heads", None) or num_heads
+        head_dim = getattr(config, "head_dim", None) or config.hidden_size // num_heads
+        dtype = getattr(model, "dtype", torch.float16)
+        if not dtype.is_floating_point:
+            dtype = torch.float16
+        itemsize = torch.tensor([], dtype=dtype).element_size()
+        return 2 * config.num_hidden_layers * kv_heads * head_dim * itemsize
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "megabytes": round(self._total_bytes / (1024 * 1024), 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "reused_tokens": self.reused_tokens,
+        }
+
+    def clear(self):
+        self._entries.clear()
+        self._total_bytes = 0
+
+    def _longest_prefix(self, ids: Tuple[int, ...]) -> Optional[_CacheEntry]:
+        best = None
+        for key, entry in self._entries.items():
+            if len(key) <= len(ids) and ids[:len(key)] == key:
+                if best is None or len(key) > len(best.token_ids):
+                    best = entry
+        if best is not None:
+            self._entries.move_to_end(best.token_ids)
+        return best
+
+    def _store(self, ids: Tuple[int, ...], past_key_values):
+        if len(ids) < self.min_prefix_tokens or ids in self._entries:
+            return
+        nbytes = len(ids) * self._bytes_per_token
+        if nbytes > self.max_bytes:
+            return
+        self._entries[ids] = _CacheEntry(token_ids=ids, past_key_values=past_key_values, nbytes=nbytes)
+        self._total_bytes += nbytes
+        while self._entries and (self._total_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            _, evicted = self._entries.popitem(last=False)
+            self._total_bytes -= evicted.nbytes
+
+    def _remember(self, ids: Tuple[int, ...], past_key_values):
+        """Record the system block and the full prompt from a finished generation's cache"""
+        if past_key_values is None or not hasattr(past_key_values, "crop"):
+            return
+        boundary = next((i + 1 for i, t in enumerate(ids) if t in self._boundary_ids), None)
+        if boundary is not None and boundary < len(ids) and ids[:boundary] not in self._entries:
+            system_cache = copy.deepcopy(past_key_values)
+            system_cache.crop(boundary)
+            self._store(ids[:boundary], system_cache)
+        past_key_values.crop(len(ids))
+        self._store(ids, past_key_values)
+
+    @torch.inference_mode()
+    def generate(self, prompt: str, input_ids: Optional[List[int]] = None, **generate_kwargs) -> str:
+        """
+        Generate for a single already-templated prompt, reusing the longest cached prefix.
+        Pass input_ids when the prompt has already been tokenized
+        """
+        if input_ids is None:
+            input_ids = self.tokenizer(prompt, return_tensors="pt", add_special_tokens=False).input_ids
+        else:
+            input_ids = torch.tensor([input_ids], dtype=torch.long)
+        ids = tuple(input_ids[0].tolist())
+
+        entry = self._longest_prefix(ids)
+        if entry is not None:
+            # generate needs at least one uncached token to produce logits from
+            reuse = min(len(entry.token_ids), len(ids) - 1)
+            past_key_values = copy.deepcopy(entry.past_key_values)
+            if reuse < len(entry.token_ids):
+                past_key_values.crop(reuse)
+            generate_kwargs["past_key_values"] = past_key_values
+            self.hits += 1
+            self.reused_tokens += reuse
+        else:
+            self.misses += 1
+
+        input_ids = input_ids.to(self.model.device)
+        generate_kwargs.setdefault("pad_token_id", self.tokenizer.pad_token_id)
+        output = self.model.generate(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            return_dict_in_generate=True,
+            **generate_kwargs,
+        )
+
+        try:
+            self._remember(ids, output.past_key_values)
+        except Exception as e:
+            logger.warning(f"[PrefixCache] Could not store KV cache: {e}")
+
+        return self.tokenizer.decode(output.sequences[0, len(ids):], skip_special_tokens=True)
@@ -0,0 +1,78 @@
+"""
+Request Cancellation
+ASGI middleware that cancels a handler as soon as its HTTP client disconnects, so queued and
+running generations for a closed tab or a retried request stop instead of running to completion
+"""
+
+import asyncio
+import logging
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CancelOnDisconnectMiddleware:
+    """
+    Once the request body has been read, the only message the server can still deliver is
+    http.disconnect, so the middleware waits for it itself. If it arrives before the response
+    is complete, the handler task is cancelled: awaiting handlers raise CancelledError, their
+    scheduler futures are cancelled, and the InferenceScheduler drops or stops those rows.
+
+    Handlers that call request.is_disconnected() (or a StreamingResponse waiting for the
+    disconnect) still see it, relayed through the wrapped receive channel. Only paths
+    starting with one of `path_prefixes` are watched (all paths when None).
+    """
+
+    def __init__(self, app, path_prefixes: Optional[Iterable[str]] = None):
+        self.app = app
+        self.path_prefixes = tuple(path_prefixes) if path_prefixes is not None else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (
+            self.path_prefixes is not None and not scope["path"].startswith(self.path_prefixes)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        body_read = asyncio.Event()
+        disconnected = asyncio.Event()
+        response_complete = False
+
+        async def wrapped_receive():
+            if body_read.is_set():
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False):
+                body_read.set()
+            elif message["type"] == "http.disconnect":
+                disconnected.set()
+            return message
+
+        async def wrapped_send(message):
+            nonlocal response_complete
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        handler = asyncio.ensure_future(self.app(scope, wrapped_receive, wrapped_send))
+
+        async def watch():
+            await body_read.wait()
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    break
+            disconnected.set()
+            if not response_complete and not handler.done():
+                logger.info(f"[Cancel] Client disconnected from {scope['path']}; cancelling handler")
+                handler.cancel()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not disconnected.is_set():
+                raise
+        finally:
+            watcher.cancel()
@@ -0,0 +1,182 @@
+"""
+LLM Response Cache
+Two-tier cache (in-process LRU + MongoDB with TTL) for low-temperature generations whose
+prompts repeat across learners, e.g. translations and grammar checks of curriculum phrases
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """NFC-normalize and collapse whitespace so trivially different prompts share an entry"""
+    return " ".join(unicodedata.normalize("NFC", prompt).split())
+
+
+def make_cache_key(prompt: str, model_name: str, generate_kwargs: Dict[str, Any]) -> str:
+    payload = json.dumps(
+        {"prompt": normalize_prompt(prompt), "model": model_name, "params": generate_kwargs},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    get_or_generate() answers from memory, then MongoDB, and only then calls the model.
+
+    The MongoDB tier is optional and best effort: `get_collection` is resolved on every
+    call (the database connects after startup) and any error there is logged and treated
+    as a miss. Concurrent misses for the same key share one generation.
+    """
+
+    def __init__(
+        self,
+        get_collection: Callable[[], Any],
+        max_entries: int = 4096,
+        ttl_seconds: float = 7 * 24 * 3600,
+    ):
+        self._get_collection = get_collection
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        # key -> (text, expires_at), least recently used first
+        self._memory: OrderedDict = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.db_errors = 0
+
+    async def ensure_indexes(self):
+        """TTL index so MongoDB drops expired entries on its own"""
+        collection = self._get_collection()
+        if collection is not None:
+            await collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.db_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.db_hits) / lookups, 3) if lookups else 0.0,
+            "db_errors": self.db_errors,
+        }
+
+    def _memory_get(self, key: str) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.time():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_set(self, key: str, value: str, expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self._memory_get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+
+        collection = self._get_collection()
+        if collection is not None:
+            try:
+                doc = await collection.find_one({"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}})
+            except Exception as e:
+                self.db_errors += 1
+                logger.debug(f"[ResponseCache] MongoDB lookup failed: {e}")
+                doc = None
+            if doc is not None:
+                expires_at = doc["expires_at"]
+                if expires_at.tzinfo is None:
+                    expires_at = expires_at.replace(tzinfo=timezone.utc)
+                self._memory_set(key, doc["value"], expires_at.timestamp())
+                self.db_hits += 1
+                return doc["value"]
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str):
+        expires_at = time.time() + self.ttl_seconds
+        self._memory_set(key, value, expires_at)
+
+        collection = self._get_collection()
+        if collection is None:
+            return
+        now = datetime.now(timezone.utc)
+        try:
+            await collection.update_one(
+                {"_id": key},
+                {"$set": {"value": value, "created_at": now, "expires_at": now + timedelta(seconds=self.ttl_seconds)}},
+                upsert=True,
+            )
+        except Exception as e:
+            self.db_errors += 1
+            logger.debug(f"[ResponseCache] MongoDB write failed: {e}")
+
+    async def get_or_generate(
+        self,
+        prompt: str,
+        model_name: str,
+        generate_kwargs: Dict[str, Any],
+        generate: Callable[[], Awaitable[str]],
+    ) -> str:
+        key = make_cache_key(prompt, model_name, generate_kwargs)
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+
+        pending = self._inflight.get(key)
+        while pending is not None:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # Re-raise our own cancellation; if the generating caller was cancelled
+                # (its client disconnected), take over the generation instead
+                if asyncio.current_task().cancelling() or not pending.cancelled():
+                    raise
+            pending = self._inflight.get(key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await generate()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so a failure nobody else waited for is not logged as unhandled
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+        future.set_result(value)
+        # Empty outputs are failures in every caller; don't pin them
+        if value.strip():
+            await self.set(key, value)
+        return value
@@ -3,8 +3,40 @@ Scenario Templates for Scenario-Based Practice Mode
 Defines scenario data structures and Stage Manager Pattern prompts
 """
 
+import re
+import unicodedata
 from typing import Dict, List, Optional
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+
+
+def _fold(text: str) -> str:
+    """Lowercase without accents, so 'Caffè' matches 'caffe'"""
+    return "".join(c for c in unicodedata.normalize("NFKD", text.lower()) if not unicodedata.combining(c))
+
+
+@dataclass
+class CompletionSlot:
+    """
+    Something that must have come up in the conversation before the scenario can be complete.
+    `patterns` are regexes over accent-folded lowercase text; `speaker` limits the search to
+    "user" or "assistant" turns (None: either). A slot that misses a real mention blocks
+    completion, so cover the common phrasings; but a pattern that matches everyday words
+    (e.g. "ok", "ecco") is satisfied on almost every turn and stops gating the goal check.
+    """
+    name: str
+    patterns: List[str]
+    speaker: Optional[str] = None
+    _regex: Optional["re.Pattern"] = field(default=None, init=False, repr=False)
+
+    def matches(self, conversation_history: List[Dict[str, str]]) -> bool:
+        if self._regex is None:
+            self._regex = re.compile("|".join(f"(?:{p})" for p in self.patterns))
+        for msg in conversation_history:
+            if self.speaker is not None and msg.get("role") != self.speaker:
+                continue
+            if self._regex.search(_fold(msg.get("content", ""))):
+                return True
+        return False
 
 
 @dataclass
@@ -19,6 +51,8 @@ class ScenarioTemplate:
     vocabulary_primer: List[str]
     estimated_duration: str = "5-10 minutes"
     difficulty: str = "Beginner"
+    # Cheap checks run before the LLM goal check: it is skipped while any slot is still missing
+    completion_preconditions: List[CompletionSlot] = field(default_factory=list)
 
 
 # Scenario database
@@ -69,7 +103,28 @@ You're about to step into a bustling Italian café and order like a local! Your
 Ready to order? Let's go! 🚀""",
         vocabulary_primer=["cappuccino", "cornetto", "al banco", "al tavolo", "quanto costa", "ecco a lei"],
         estimated_duration="5-10 minutes",
-        difficulty="Beginner"
+        difficulty="Beginner",
+        completion_preconditions=[
+            CompletionSlot("order", [
+                r"cappuccin", r"caffe", r"espresso", r"cornett", r"brioche", r"croissant", r"latte", r"macchiat",
+                r"\b(un|il|del) te\b", r"\btea\b", r"coffee", r"cafe", r"kaffee", r"cafezinho", r"succo", r"acqua",
+                r"vorrei", r"prendo", r"\bper me\b", r"i'?d like", r"i will have", r"i'?ll have", r"can i (get|have)",
+                r"je voudrais", r"je prends", r"quiero", r"quisiera", r"ich mochte", r"ich nehme", r"queria", r"gostaria",
+            ], speaker="user"),
+            CompletionSlot("seating", [
+                r"banco", r"tavol", r"\bbar\b", r"table", r"comptoir", r"\bmesa\b", r"barra", r"\btisch", r"theke", r"balcao",
+            ]),
+            CompletionSlot("price", [
+                r"\beuro", r"€", r"\beur\b", r"\$", r"£", r"dollar", r"\bpound", r"totale", r"\btotal", r"costa\b",
+                r"prezzo", r"price", r"precio", r"\bprix\b", r"\bpreis", r"\bpreco", r"\d+[.,]\d\d",
+            ], speaker="assistant"),
+            CompletionSlot("acknowledgement", [
+                r"grazie", r"thank", r"merci", r"gracias", r"danke", r"obrigad", r"arrivederci", r"\bciao\b", r"\bbye\b",
+                r"goodbye", r"au revoir", r"adios", r"tschuss", r"auf wiedersehen", r"hasta luego", r"\btchau\b", r"a presto",
+                r"buona giornata", r"buona serata", r"have a (nice|good|great) day", r"bonne journee",
+                r"schonen tag",
+            ], speaker="user"),
+        ],
     )
 }
 
@@ -87,6 +142,21 @@ def get_scenario_template(scenario_id: str) -> Optional[ScenarioTemplate]:
     return SCENARIOS.get(scenario_id)
 
 
+def missing_preconditions(scenario: ScenarioTemplate, conversation_history: List[Dict[str, str]]) -> List[str]:
+    """
+    Names of the completion slots not yet seen in the conversation; while any are missing
+    the winning condition cannot be met and the LLM goal check can be skipped
+    
+    Args:
+        scenario: ScenarioTemplate object
+        conversation_history: List of {"role", "content"} messages
+        
+    Returns:
+        Missing slot names (empty when completion is possible)
+    """
+    return [slot.name for slot in scenario.completion_preconditions if not slot.matches(conversation_history)]
+
+
 def get_all_scenarios() -> List[ScenarioTemplate]:
     """
     Get all available scenarios
@@ -6,12 +6,10 @@ import random
 import re
 import traceback
 import io
-import gc
-import tempfile
 import json
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, status, Depends, Request, UploadFile, File, Form, Body
-from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, status, Depends, Request, UploadFile, File, Form, Body, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
@@ -24,10 +22,6 @@ from authlib.integrations.starlette_client import OAuth, OAuthError
 from starlette.middleware.sessions import SessionMiddleware 
 from urllib.parse import urlencode
 
-# HuggingFace Transformers
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
-import torch
-import whisper
 
 try:
     import azure.cognitiveservices.speech as speechsdk
@@ -37,9 +31,31 @@ except ImportError:
     logger.warning("Azure Speech SDK not available. Install with: pip install azure-cognitiveservices-speech")
 
 # Practice Mode imports
-from scenario_templates import get_scenario_template, get_all_scenarios, build_stage_manager_prompt
-from practice_mode import GameState, check_goal_achievement, generate_pronunciation_feedback, generate_grammar_vocabulary_review
+from scenario_templates import get_scenario_template, get_all_scenarios, build_stage_manager_prompt, missing_preconditions
+from practice_mode import GOAL_CHECK_MAX_TOKENS, GOAL_CHECK_SCHEMA, PRACTICE_TURN_MAX_TOKENS, PRACTICE_TURN_SCHEMA, GameState, check_goal_achievement, generate_reply_with_goal_check, generate_pronunciation_feedback, generate_grammar_vocabulary_review
 from practice_cache import get_cached_system_prompt, get_template_response
+from inference_scheduler import InferenceScheduler
+from llm_streaming import sse_event, SSE_HEADERS
+from conversation_encoder import ConversationEncoder
+from model_loader import load_text_generation, load_tokenizer, load_draft_model, prepare_for_batching, attach_accelerators, resolve_inference_profile
+from llm_backend import LocalHFBackend, OpenAICompatibleBackend
+from model_router import (
+    TASK_ASSESSMENT, TASK_CONVERSATION, TASK_CORRECTION, TASK_GOAL_CHECK, TASK_GRAMMAR, TASK_REPORT,
+    TASK_SUMMARY, TASK_TRANSLATION, TIER_LARGE, TIER_SMALL, ModelRouter, parse_routes,
+)
+from response_cache import ResponseCache
+from history_manager import HistoryManager
+from request_cancellation import CancelOnDisconnectMiddleware
+from admission import (
+    PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, PRIORITY_REPORT, PRIORITY_TRANSLATE, PRIORITY_VOICE,
+    AdmissionMiddleware, QueueFullError, WorkContext, current_work,
+)
+from warmup import Readiness, WarmupShape, warm_up_llm, warm_up_whisper
+from audio_ingest import PCM_ENCODINGS, AudioIngestError, decode_audio, encode_wav, pcm_to_float, read_upload, resample
+from streaming_stt import EnergyVAD, StreamingTranscriber
+from stt_backends import load_stt_backend
+from stt_batcher import STTBatcher
+from model_registry import ModelRegistry
 
 # Character voice mapping for gendered TTS
 from character_voices import get_voice_for_character, extract_character_name
@@ -51,20 +67,120 @@ os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 model = None
 tokenizer = None
 text_generator = None 
+small_text_generator = None
+conversation_encoder = None
 db_client: Optional[AsyncIOMotorClient] = None
 db = None
 is_loading = True
-whisper_model = None
 
 # Default to pre-quantized GPTQ model (4-bit, ~5.5GB VRAM)
 # Override with MODEL_NAME env var if needed (e.g., for non-GPTQ models)
 MODEL_NAME = os.getenv("MODEL_NAME", "TheBloke/Llama-3-8B-Instruct-GPTQ") 
+# Model actually loaded in-process (CPU_MODEL_NAME under the CPU profile); set at startup
+loaded_model_name = MODEL_NAME
+# Hardware profile: auto | gpu | cpu. GPTQ needs CUDA, so the CPU profile loads CPU_MODEL_NAME
+# with its linear layers dynamically quantized to int8
+INFERENCE_PROFILE = os.getenv("INFERENCE_PROFILE", "auto").lower()
+CPU_MODEL_NAME = os.getenv("CPU_MODEL_NAME", "meta-llama/Meta-Llama-3-8B-Instruct")
+CPU_INT8 = os.getenv("CPU_INT8", "true").lower() == "true"
+CPU_THREADS = int(os.getenv("CPU_THREADS", "0")) or None
 TRANSFORMERS_CACHE = os.getenv("TRANSFORMERS_CACHE", "/app/model_cache")
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://mongodb:27017")
 DB_NAME = os.getenv("DB_NAME", "polybot_database")
 HUGGINGFACE_TOKEN = os.getenv("HUGGINGFACE_TOKEN")
 WHISPER_MODEL_NAME = os.getenv("WHISPER_MODEL_NAME", "turbo")
+# Speech-to-text backend: "openai-whisper" (PyTorch) or "faster-whisper" (CTranslate2). STT_DEVICE
+# "cpu" keeps Whisper off the GPU Llama runs on; STT_COMPUTE_TYPE "auto" is int8 on CPU, float16 on CUDA
+STT_BACKEND = os.getenv("STT_BACKEND", "openai-whisper").lower()
+STT_DEVICE = os.getenv("STT_DEVICE", "auto").lower()
+STT_COMPUTE_TYPE = os.getenv("STT_COMPUTE_TYPE", "auto").lower()
+STT_CPU_THREADS = int(os.getenv("STT_CPU_THREADS", "0")) or None
 UNLOAD_VOICE_MODELS = os.getenv("UNLOAD_VOICE_MODELS", "false").lower() == "true"
+# Model registry: Whisper is evicted after MODEL_IDLE_SECONDS unused (0 keeps it resident; UNLOAD_VOICE_MODELS
+# defaults it to 300), before a load would exceed MODEL_MEMORY_BUDGET_MB, or while free GPU memory is under GPU_MIN_FREE_MB
+MODEL_IDLE_SECONDS = float(os.getenv("MODEL_IDLE_SECONDS", "300" if UNLOAD_VOICE_MODELS else "0"))
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
+GPU_MIN_FREE_MB = float(os.getenv("GPU_MIN_FREE_MB", "0"))
+# Voice uploads: rejected while streaming past this size, or after decoding past this length
+MAX_AUDIO_UPLOAD_MB = float(os.getenv("MAX_AUDIO_UPLOAD_MB", "25"))
+MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", "120"))
+# Streaming STT (WebSocket): silence that ends an utterance, and how often partials are decoded
+STREAM_STT_END_SILENCE_MS = int(os.getenv("STREAM_STT_END_SILENCE_MS", "500"))
+STREAM_STT_PARTIAL_SECONDS = float(os.getenv("STREAM_STT_PARTIAL_SECONDS", "1.0"))
+# Text generation backend: "local" (model in this process), "openai" (OpenAI-compatible server)
+# or "host" (the model_host process on a Unix socket, shared by every uvicorn worker)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "local").lower()
+MODEL_HOST_SOCKET = os.getenv("MODEL_HOST_SOCKET", "/tmp/polybot-model-host.sock")
+LLM_SERVER_URL = os.getenv("LLM_SERVER_URL", "http://localhost:8001")
+LLM_SERVER_MODEL = os.getenv("LLM_SERVER_MODEL", MODEL_NAME)
+LLM_SERVER_API_KEY = os.getenv("LLM_SERVER_API_KEY")
+LLM_SERVER_TIMEOUT = float(os.getenv("LLM_SERVER_TIMEOUT", "60"))
+LLM_SERVER_MAX_CONNECTIONS = int(os.getenv("LLM_SERVER_MAX_CONNECTIONS", "32"))
+# Batching for the shared text-generation pipeline
+LLM_MAX_BATCH_SIZE = int(os.getenv("LLM_MAX_BATCH_SIZE", "8"))
+LLM_BATCH_WAIT_MS = float(os.getenv("LLM_BATCH_WAIT_MS", "10"))
+# Reuse of system-prompt / earlier-turn KV caches across requests
+PREFIX_CACHE_ENABLED = os.getenv("PREFIX_CACHE_ENABLED", "true").lower() == "true"
+PREFIX_CACHE_MAX_MB = int(os.getenv("PREFIX_CACHE_MAX_MB", "1024"))
+PREFIX_CACHE_MAX_ENTRIES = int(os.getenv("PREFIX_CACHE_MAX_ENTRIES", "64"))
+# Speculative decoding: a small same-family model drafts tokens for single-sequence steps (off when unset)
+DRAFT_MODEL_NAME = os.getenv("DRAFT_MODEL_NAME", "")
+DRAFT_NUM_TOKENS = int(os.getenv("DRAFT_NUM_TOKENS", "0")) or None
+# Small model tier for assessment, correction, translation, grammar and goal checks: loaded
+# in-process (SMALL_MODEL_NAME, local backend) or an OpenAI-compatible server (SMALL_LLM_SERVER_URL).
+# It must share the large model's chat template. Without one, every call site uses the large model
+SMALL_MODEL_NAME = os.getenv("SMALL_MODEL_NAME", "")
+SMALL_LLM_SERVER_URL = os.getenv("SMALL_LLM_SERVER_URL", "")
+SMALL_LLM_SERVER_MODEL = os.getenv("SMALL_LLM_SERVER_MODEL", SMALL_MODEL_NAME)
+# Per-call-site tier overrides, e.g. "correction=large,conversation=large"
+MODEL_ROUTES = parse_routes(os.getenv("MODEL_ROUTES", ""))
+# Large-tier calls spill over to the small tier once this many requests are waiting (0 = never)
+MODEL_SPILLOVER_DEPTH = int(os.getenv("MODEL_SPILLOVER_DEPTH", "8"))
+# Goal assessment: P(YES) from one forward pass, thresholded; temperature calibrates the score
+GOAL_YES_THRESHOLD = float(os.getenv("GOAL_YES_THRESHOLD", "0.5"))
+GOAL_CLASSIFIER_TEMPERATURE = float(os.getenv("GOAL_CLASSIFIER_TEMPERATURE", "1.0"))
+# Character replies stop after this many sentences instead of running to max_new_tokens
+NPC_MAX_SENTENCES = int(os.getenv("NPC_MAX_SENTENCES", "2"))
+# A correction is complete once the model starts a second block or echoes the format delimiter
+CORRECTION_STOP_SEQUENCES = ["\nCORRECTED:", "\n---"]
+# Cache for repeatable low-temperature generations (translate, correction, grammar check)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "4096"))
+RESPONSE_CACHE_TTL_HOURS = float(os.getenv("RESPONSE_CACHE_TTL_HOURS", "168"))
+# Prompt token budget (system prompt + history) per endpoint; older turns collapse into a rolling summary
+HISTORY_TOKEN_BUDGETS = {
+    "tutor": int(os.getenv("TUTOR_HISTORY_TOKENS", "1024")),
+    "voice_chat": int(os.getenv("VOICE_CHAT_HISTORY_TOKENS", "1024")),
+    "practice": int(os.getenv("PRACTICE_HISTORY_TOKENS", "1536")),
+}
+HISTORY_MIN_RECENT_MESSAGES = int(os.getenv("HISTORY_MIN_RECENT_MESSAGES", "4"))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "120"))
+# Practice turns: character reply and goal check from one JSON-constrained generation
+# (the separate reply + check_goal_achievement calls remain the fallback)
+PRACTICE_FUSED_TURN = os.getenv("PRACTICE_FUSED_TURN", "true").lower() == "true"
+# Run each endpoint's generation shape (and a silent Whisper decode) before reporting ready
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_WHISPER = os.getenv("WARMUP_WHISPER", "true").lower() == "true"
+CANCEL_ON_DISCONNECT_PATHS = ["/tutor", "/boss", "/voice", "/api/v1/voice", "/api/practice"]
+# Admission control: queue bounds for LLM and Whisper work, and each endpoint's priority class
+LLM_MAX_QUEUE_DEPTH = int(os.getenv("LLM_MAX_QUEUE_DEPTH", "64"))
+WHISPER_MAX_QUEUE_DEPTH = int(os.getenv("WHISPER_MAX_QUEUE_DEPTH", "16"))
+# Utterances arriving within STT_BATCH_WAIT_MS of each other are transcribed as one padded batch
+STT_MAX_BATCH_SIZE = int(os.getenv("STT_MAX_BATCH_SIZE", "8"))
+STT_BATCH_WAIT_MS = float(os.getenv("STT_BATCH_WAIT_MS", "20"))
+ADMISSION_AGING_SECONDS = float(os.getenv("ADMISSION_AGING_SECONDS", "10"))
+ENDPOINT_PRIORITIES = {
+    "/tutor": PRIORITY_INTERACTIVE,
+    "/boss": PRIORITY_INTERACTIVE,
+    "/api/practice/initiate": PRIORITY_INTERACTIVE,
+    "/api/practice/text-chat": PRIORITY_INTERACTIVE,
+    "/api/v1/voice/chat": PRIORITY_VOICE,
+    "/api/v1/voice/transcribe": PRIORITY_VOICE,
+    "/voice/analyze": PRIORITY_VOICE,
+    "/api/practice/voice-chat": PRIORITY_VOICE,
+    "/api/practice/translate": PRIORITY_TRANSLATE,
+    "/api/practice/post-game-report": PRIORITY_REPORT,
+}
 # Azure Speech Service configuration
 AZURE_SPEECH_KEY = os.getenv("AZURE_SPEECH_KEY")
 AZURE_SPEECH_REGION = os.getenv("AZURE_SPEECH_REGION")
@@ -81,6 +197,76 @@ FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
 GOOGLE_REDIRECT_URI = "http://localhost:8000/api/google/auth"
 LLAMA_STOP_TOKENS = []
 
+# All Llama generation goes through this queue so concurrent learners share forward passes
+llm_scheduler = InferenceScheduler(
+    lambda: text_generator,
+    max_batch_size=LLM_MAX_BATCH_SIZE,
+    batch_wait_ms=LLM_BATCH_WAIT_MS,
+    max_queue_depth=LLM_MAX_QUEUE_DEPTH,
+    aging_seconds=ADMISSION_AGING_SECONDS,
+)
+model_registry = ModelRegistry(
+    memory_budget_bytes=int(MODEL_MEMORY_BUDGET_MB * 2**20),
+    idle_seconds=MODEL_IDLE_SECONDS,
+    min_free_gpu_bytes=int(GPU_MIN_FREE_MB * 2**20),
+)
+model_registry.register("whisper", lambda: load_stt_backend(
+    STT_BACKEND, WHISPER_MODEL_NAME, device=STT_DEVICE, compute_type=STT_COMPUTE_TYPE, cpu_threads=STT_CPU_THREADS,
+))
+# Whisper decodes are batched across learners, served by priority and per-user turns
+stt_batcher = STTBatcher(
+    lambda: get_whisper_model(),
+    max_batch_size=STT_MAX_BATCH_SIZE,
+    batch_wait_ms=STT_BATCH_WAIT_MS,
+    max_queue_depth=WHISPER_MAX_QUEUE_DEPTH,
+    aging_seconds=ADMISSION_AGING_SECONDS,
+)
+if LLM_BACKEND == "host":
+    llm_backend = OpenAICompatibleBackend(
+        "http://model-host",
+        MODEL_NAME,
+        uds=MODEL_HOST_SOCKET,
+        timeout=LLM_SERVER_TIMEOUT,
+        max_connections=LLM_SERVER_MAX_CONNECTIONS,
+        extended_params=True,
+    )
+elif LLM_BACKEND == "openai":
+    llm_backend = OpenAICompatibleBackend(
+        LLM_SERVER_URL,
+        LLM_SERVER_MODEL,
+        api_key=LLM_SERVER_API_KEY,
+        timeout=LLM_SERVER_TIMEOUT,
+        max_connections=LLM_SERVER_MAX_CONNECTIONS,
+    )
+else:
+    llm_backend = LocalHFBackend(llm_scheduler, lambda: text_generator)
+small_llm_scheduler = None
+model_tiers = {TIER_LARGE: llm_backend}
+if SMALL_LLM_SERVER_URL:
+    model_tiers[TIER_SMALL] = OpenAICompatibleBackend(
+        SMALL_LLM_SERVER_URL,
+        SMALL_LLM_SERVER_MODEL,
+        api_key=LLM_SERVER_API_KEY,
+        timeout=LLM_SERVER_TIMEOUT,
+        max_connections=LLM_SERVER_MAX_CONNECTIONS,
+    )
+elif SMALL_MODEL_NAME and LLM_BACKEND == "local":
+    small_llm_scheduler = InferenceScheduler(
+        lambda: small_text_generator,
+        max_batch_size=LLM_MAX_BATCH_SIZE,
+        batch_wait_ms=LLM_BATCH_WAIT_MS,
+        max_queue_depth=LLM_MAX_QUEUE_DEPTH,
+        aging_seconds=ADMISSION_AGING_SECONDS,
+    )
+    model_tiers[TIER_SMALL] = LocalHFBackend(small_llm_scheduler, lambda: small_text_generator)
+# Every call site asks the router which tier serves it
+model_router = ModelRouter(model_tiers, MODEL_ROUTES, spillover_depth=MODEL_SPILLOVER_DEPTH)
+response_cache = ResponseCache(
+    lambda: db.llm_response_cache if db is not None else None,
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    ttl_seconds=RESPONSE_CACHE_TTL_HOURS * 3600,
+)
+
 class EndpointFilter(logging.Filter):
     def filter(self, record: logging.LogRecord) -> bool:
         return record.getMessage().find("GET /health") == -1
@@ -243,6 +429,11 @@ class PostGameReportRequest(BaseModel):
 
 app = FastAPI(title="Polybot Backend")
 
+# Model-backed endpoints stop their queued/running generations when the client goes away
+app.add_middleware(CancelOnDisconnectMiddleware, path_prefixes=CANCEL_ON_DISCONNECT_PATHS)
+# Outside the cancellation middleware so the handler task inherits the request's WorkContext
+app.add_middleware(AdmissionMiddleware, routes=ENDPOINT_PRIORITIES, retry_after=lambda priority: admission_retry_after(priority))
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -253,6 +444,14 @@ app.add_middleware(
 
 app.add_middleware(SessionMiddleware, secret_key=SESSION_SECRET_KEY)
 
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    return JSONResponse({"detail": exc.detail}, status_code=503, headers={"Retry-After": exc.retry_after_header})
+
+@app.exception_handler(AudioIngestError)
+async def audio_ingest_handler(request: Request, exc: AudioIngestError):
+    return JSONResponse({"detail": exc.detail}, status_code=exc.status_code)
+
 # Mount static files for audio
 static_dir = Path(__file__).parent / "static"
 static_dir.mkdir(exist_ok=True)
@@ -569,68 +768,114 @@ def generate_conversation_exercise(lesson_id, target_lang, native_lang):
         "explanation": "Great conversation!"
     }
 
-def generate_chat_input(system_content: str, conversation_history: List[dict] = None) -> str:
+def generate_chat_input(system_content: str, conversation_history: List[dict] = None, summary: Optional[str] = None) -> str:
     global tokenizer
     messages = [{"role": "system", "content": system_content}]
+    if summary:
+        # Its own block after the system prompt, so the shared system block stays reusable
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
     if conversation_history:
         for msg in conversation_history:
             role = 'user' if msg.get('role') == 'user' else 'assistant'
             messages.append({"role": role, "content": msg['content']}) 
+    if conversation_encoder is not None:
+        # Reuses the rendered blocks of the system prompt and earlier turns
+        return conversation_encoder.render(messages)
     formatted_input = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
     return formatted_input
 
 
-# --- VOICE MODELS (WHISPER + Edge-TTS) ---
+async def timed_call(name: str, coro, timings: dict):
+    """Await coro and record its wall time in milliseconds under timings[name]"""
+    started = time.monotonic()
+    try:
+        return await coro
+    finally:
+        timings[name] = round((time.monotonic() - started) * 1000)
+
+def reraise_client_errors(results):
+    """Re-raise a QueueFullError/AudioIngestError caught by gather(return_exceptions=True), so it keeps its 503/4xx handler"""
+    for result in results:
+        if isinstance(result, (QueueFullError, AudioIngestError)):
+            raise result
+
+def tier_model_name(tier: str) -> str:
+    if tier == TIER_SMALL:
+        return SMALL_LLM_SERVER_MODEL if SMALL_LLM_SERVER_URL else SMALL_MODEL_NAME
+    return LLM_SERVER_MODEL if LLM_BACKEND == "openai" else loaded_model_name
+
+async def cached_generate(task: str, prompt: str, **generate_kwargs) -> str:
+    """Generation for `task` on its routed tier, behind the response cache; only for low-temperature, repeatable prompts"""
+    tier, backend = model_router.select(task)
+    if not RESPONSE_CACHE_ENABLED:
+        return await backend.generate(prompt, **generate_kwargs)
+    return await response_cache.get_or_generate(
+        prompt, tier_model_name(tier), generate_kwargs, lambda: backend.generate(prompt, **generate_kwargs)
+    )
 
-async def get_whisper_model():
-    global whisper_model
-    if whisper_model is not None:
-        return whisper_model
+def admission_retry_after(priority: int) -> Optional[float]:
+    """Back-off for a new request of this class, from the LLM tiers and (for voice) the Whisper line"""
+    delays = [model_router.retry_after(priority)]
+    if priority == PRIORITY_VOICE and LLM_BACKEND != "host":
+        delays.append(stt_batcher.retry_after(priority))
+    delays = [d for d in delays if d is not None]
+    return max(delays) if delays else None
+
+def count_prompt_tokens(text: str) -> int:
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+async def summarize_history(previous: Optional[str], messages: List[dict]) -> str:
+    """Fold older turns into the rolling conversation summary (runs in the background)"""
+    current_work.set(WorkContext(PRIORITY_BACKGROUND, current_work.get().user))
+    transcript = "\n".join(f"{'Student' if m['role'] == 'user' else 'Tutor'}: {m['content']}" for m in messages)
+    if previous:
+        transcript = f"Summary so far: {previous}\n\nNew turns:\n{transcript}"
+    system_prompt = (
+        "You summarize language-practice conversations. In at most three short sentences of English, "
+        "keep what the student said about themselves, which phrases they already practised and any "
+        "mistakes they repeated. Output only the summary."
+    )
+    prompt_input = generate_chat_input(system_prompt, [{"role": "user", "content": transcript}])
+    return await model_router.backend(TASK_SUMMARY).generate(prompt_input, max_new_tokens=HISTORY_SUMMARY_TOKENS, do_sample=False)
 
-    loop = asyncio.get_event_loop()
+readiness = Readiness(["db", "llm", "whisper", "tts"])
 
-    def _load():
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        model = whisper.load_model(WHISPER_MODEL_NAME, device=device)
-        return model
+history_manager = HistoryManager(
+    count_prompt_tokens,
+    summarize_history,
+    HISTORY_TOKEN_BUDGETS,
+    min_recent=HISTORY_MIN_RECENT_MESSAGES,
+    summary_tokens=HISTORY_SUMMARY_TOKENS,
+)
 
-    whisper_model = await loop.run_in_executor(None, _load)
-    return whisper_model
 
+# --- VOICE MODELS (WHISPER + Edge-TTS) ---
 
-def release_whisper_model():
-    global whisper_model
-    if UNLOAD_VOICE_MODELS:
-        whisper_model = None
-    if torch.cuda.is_available():
-        torch.cuda.empty_cache()
-    gc.collect()
+async def get_whisper_model():
+    """The STT backend, loaded on first use and again after the registry evicts it"""
+    return await model_registry.get("whisper")
 
 
 async def transcribe_audio_file(upload_file: UploadFile, language: Optional[str] = None):
     """Run Whisper on an uploaded audio file and return transcription."""
-    model = await get_whisper_model()
-    contents = await upload_file.read()
+    contents = await read_upload(upload_file, int(MAX_AUDIO_UPLOAD_MB * 1024 * 1024))
+    if LLM_BACKEND == "host":
+        # Whisper lives in the model host alongside Llama
+        return await llm_backend.transcribe(contents, upload_file.filename or "audio.wav", language=language)
 
-    suffix = os.path.splitext(upload_file.filename or "")[-1] or ".wav"
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        tmp.write(contents)
-        tmp_path = tmp.name
+    # Decoded in memory to 16 kHz float32: no temp file, no ffmpeg process per request
+    audio = await asyncio.get_event_loop().run_in_executor(None, lambda: decode_audio(contents, max_seconds=MAX_AUDIO_SECONDS))
+    return await transcribe_samples(audio, language=language)
 
-    loop = asyncio.get_event_loop()
 
-    def _run():
-        result = model.transcribe(tmp_path, language=language if language else None)
-        return result
+async def transcribe_samples(audio, language: Optional[str] = None, **options):
+    """Run Whisper on 16 kHz float32 samples; `options` go to model.transcribe (in-process only)"""
+    if LLM_BACKEND == "host":
+        return await llm_backend.transcribe(encode_wav(audio), "audio.wav", language=language)
 
-    try:
-        result = await loop.run_in_executor(None, _run)
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
-        release_whisper_model()
+    # Held while queued too, so the model is not evicted under a waiting request
+    async with model_registry.use("whisper"):
+        result = await stt_batcher.transcribe(audio, language=language, **options)
 
     return result
 
@@ -753,138 +998,176 @@ async def synthesize_tts(text: str, lang_code: str = "en", character_name: str =
         logger.error(f"[TTS] Azure synthesis failed: {str(e)}")
         raise RuntimeError(f"TTS synthesis failed: {str(e)}")
 
+def build_warmup_shapes() -> List[WarmupShape]:
+    """One request per endpoint shape, with the same sampling and stopping options the handlers use"""
+    student = [{"role": "user", "content": "Ciao! Mi chiamo Luca."}]
+    tutor_prompt = generate_chat_input("You are Polybot, a friendly language tutor. The target language is Italian.", student)
+    shapes = [
+        WarmupShape("conversation", tutor_prompt, {"max_new_tokens": 60, "do_sample": True, "top_k": 50, "temperature": 0.7}),
+        WarmupShape("conversation_stream", tutor_prompt, {"max_new_tokens": 60, "do_sample": True, "top_k": 50, "temperature": 0.7}, kind="stream"),
+        WarmupShape(
+            "correction",
+            generate_chat_input("You are a highly analytical grammar checker. Target Language: Italian", student),
+            {"max_new_tokens": 100, "temperature": 0.1, "stop_sequences": CORRECTION_STOP_SEQUENCES},
+        ),
+        WarmupShape(
+            "assessment",
+            generate_chat_input("Goal: The student must state their name. Output ONLY 'YES' or 'NO'.", student),
+            kind="classify",
+        ),
+        WarmupShape(
+            "npc_reply",
+            generate_chat_input("You are Marco, a barista in Rome. Reply in Italian.", student),
+            {"max_new_tokens": 35, "do_sample": True, "top_k": 25, "temperature": 0.5, "max_sentences": NPC_MAX_SENTENCES},
+        ),
+        WarmupShape(
+            "goal_check",
+            generate_chat_input("You are the Stage Manager. Output JSON only.", student),
+            {"max_new_tokens": GOAL_CHECK_MAX_TOKENS, "temperature": 0.3, "json_schema": GOAL_CHECK_SCHEMA},
+        ),
+    ]
+    if PRACTICE_FUSED_TURN:
+        shapes.append(WarmupShape(
+            "practice_turn",
+            generate_chat_input("You are Marco, a barista in Rome. Respond ONLY with JSON.", student),
+            {"max_new_tokens": PRACTICE_TURN_MAX_TOKENS, "temperature": 0.5, "json_schema": PRACTICE_TURN_SCHEMA},
+        ))
+    return shapes
+
+async def warm_up_voice():
+    """Load Whisper and decode a silent clip so the first voice request skips the cold start"""
+    if AZURE_SPEECH_AVAILABLE and AZURE_SPEECH_KEY and AZURE_SPEECH_REGION:
+        readiness.set("tts", "ready")
+    else:
+        readiness.set("tts", "disabled", "Azure Speech not configured")
+
+    if LLM_BACKEND == "host":
+        readiness.set("whisper", "remote", "served by the model host")
+        return
+    if not WARMUP_WHISPER or UNLOAD_VOICE_MODELS:
+        readiness.set("whisper", "lazy", "loaded on first use")
+        return
+    readiness.set("whisper", "loading")
+    try:
+        model = await get_whisper_model()
+        readiness.set("whisper", "warming")
+        started = time.monotonic()
+        await asyncio.get_event_loop().run_in_executor(None, lambda: warm_up_whisper(model))
+        readiness.set("whisper", "ready")
+        logger.info(f"✅ Whisper warm-up done in {time.monotonic() - started:.1f}s.")
+    except Exception as e:
+        readiness.set("whisper", "failed", str(e))
+        logger.error(f"❌ Whisper warm-up failed: {e}")
+
+async def warm_up_generation():
+    if not llm_backend.ready:
+        readiness.set("llm", "failed", "model not loaded")
+        return
+    if not WARMUP_ENABLED:
+        readiness.set("llm", "ready")
+        return
+    readiness.set("llm", "warming")
+    timings = await warm_up_llm(llm_backend, build_warmup_shapes())
+    small = model_tiers.get(TIER_SMALL)
+    if small is not None and small.ready:
+        timings["small"] = await warm_up_llm(small, build_warmup_shapes())
+    readiness.set("llm", "ready")
+    logger.info(f"✅ LLM warm-up done: {timings}")
+
 async def load_resources_bg():
-    global model, tokenizer, text_generator, db_client, db, is_loading, LLAMA_STOP_TOKENS
+    global model, tokenizer, text_generator, small_text_generator, conversation_encoder, db_client, db, is_loading, loaded_model_name, LLAMA_STOP_TOKENS
     logger.info("🚀 Background Task: Starting resource loading...")
+    readiness.set("db", "loading")
     try:
         db_client = AsyncIOMotorClient(MONGO_URL, serverSelectionTimeoutMS=30000)
         db = db_client[DB_NAME]
         await db_client.admin.command('ping')
         logger.info("✅ MongoDB connection successful.")
-    except Exception as e: logger.error(f"❌ FATAL ERROR connecting to MongoDB: {e}")
+        if RESPONSE_CACHE_ENABLED:
+            await response_cache.ensure_indexes()
+        readiness.set("db", "ready")
+    except Exception as e:
+        readiness.set("db", "failed", str(e))
+        logger.error(f"❌ FATAL ERROR connecting to MongoDB: {e}")
 
-    logger.info(f"⏳ Loading AI model ({MODEL_NAME})...")
     os.environ['TRANSFORMERS_CACHE'] = TRANSFORMERS_CACHE
+    readiness.set("llm", "loading")
+    if LLM_BACKEND in ("openai", "host"):
+        # Generation happens in another process; only the chat template is needed here
+        try:
+            tokenizer = await asyncio.get_event_loop().run_in_executor(None, lambda: load_tokenizer(MODEL_NAME, HUGGINGFACE_TOKEN))
+            conversation_encoder = ConversationEncoder(tokenizer)
+            target = MODEL_HOST_SOCKET if LLM_BACKEND == "host" else LLM_SERVER_URL
+            logger.info(f"✅ Using {LLM_BACKEND} LLM backend at {target} (tokenizer only).")
+        except Exception as e: logger.error(f"❌ FATAL ERROR loading tokenizer: {e}")
+        if tokenizer is not None:
+            await warm_up_generation()
+        else:
+            readiness.set("llm", "failed", "tokenizer not loaded")
+        is_loading = False
+        logger.info("🎉 Resource loading complete.")
+        return
+
+    profile = resolve_inference_profile(INFERENCE_PROFILE)
+    loaded_model_name = CPU_MODEL_NAME if profile == "cpu" else MODEL_NAME
+    logger.info(f"⏳ Loading AI model ({loaded_model_name}, {profile} profile)...")
     
     # Optimization flags
     USE_GPTQ = os.getenv("USE_GPTQ", "true").lower() == "true"  # Default to GPTQ for pre-quantized models
     USE_TORCH_COMPILE = os.getenv("USE_TORCH_COMPILE", "false").lower() == "true"
-    
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float32 
-    
-    # Check if accelerate is available for device_map
-    try:
-        import accelerate
-        HAS_ACCELERATE = True
-        logger.info("✅ accelerate library available")
-    except ImportError:
-        HAS_ACCELERATE = False
-        logger.error("❌ accelerate library not found! It's required for model loading. Please install it: pip install accelerate")
 
     try:
         loop = asyncio.get_event_loop() 
-        def load_hf():
-            auth_kwargs = {"token": HUGGINGFACE_TOKEN} if HUGGINGFACE_TOKEN else {} 
-            
-            # Try GPTQ first (pre-quantized models)
-            # When auto-gptq is installed, transformers' AutoModelForCausalLM can auto-detect GPTQ models
-            if USE_GPTQ and torch.cuda.is_available():
-                try:
-                    # Check if auto-gptq is available
-                    import auto_gptq
-                    logger.info("📦 Loading pre-quantized GPTQ model (auto-detected)...")
-                    
-                    # Load tokenizer first
-                    tok = AutoTokenizer.from_pretrained(MODEL_NAME, **auth_kwargs)
-                    
-                    # Use standard transformers API - it will auto-detect GPTQ when auto-gptq is installed
-                    # This is the recommended way for pre-quantized models from TheBloke
-                    model_kwargs = {
-                        "trust_remote_code": False,
-                        "low_cpu_mem_usage": True,
-                        **auth_kwargs
-                    }
-                    
-                    if HAS_ACCELERATE:
-                        model_kwargs["device_map"] = "auto"
-                    
-                    # AutoModelForCausalLM will automatically use AutoGPTQForCausalLM 
-                    # when it detects GPTQ format and auto-gptq is installed
-                    mod = AutoModelForCausalLM.from_pretrained(
-                        MODEL_NAME,
-                        **model_kwargs
-                    )
-                    
-                    # If device_map wasn't used, manually move to device
-                    if not HAS_ACCELERATE:
-                        mod = mod.to(device)
-                    
-                    logger.info("✅ Successfully loaded GPTQ quantized model (~5.5GB VRAM)")
-                    
-                    # Create pipeline
-                    pipe = pipeline("text-generation", model=mod, tokenizer=tok)
-                    return tok, mod, pipe
-                    
-                except ImportError as import_err:
-                    logger.warning(f"⚠️ AutoGPTQ not available: {import_err}. Install auto-gptq for GPTQ support. Falling back to standard model.")
-                except Exception as gptq_error:
-                    logger.warning(f"⚠️ GPTQ loading failed: {gptq_error}")
-                    logger.info("🔄 Falling back to standard model loading...")
-            
-            # Fallback: Standard model loading (for non-GPTQ models or if GPTQ fails)
-            logger.info("📦 Loading standard model (non-quantized)...")
-            tok = AutoTokenizer.from_pretrained(MODEL_NAME, **auth_kwargs)
-            
-            # Prepare model loading kwargs
-            model_kwargs = {
-                "dtype": dtype,  # Use dtype instead of deprecated torch_dtype
-                **auth_kwargs
-            }
-            
-            if HAS_ACCELERATE:
-                model_kwargs["device_map"] = "auto"
-            else:
-                # Without accelerate, we need to load on CPU first, then move to device
-                # This avoids the accelerate requirement that newer transformers enforces
-                logger.warning("⚠️ Loading model without device_map (accelerate not available)")
-                # Don't pass device parameter - load on CPU, then move manually
-                mod = AutoModelForCausalLM.from_pretrained(
-                    MODEL_NAME, 
-                    torch_dtype=dtype,  # Use torch_dtype for older compatibility
-                    **auth_kwargs
-                )
-                # Move to device after loading
-                mod = mod.to(device)
-                mod.eval()
-                pipe = pipeline("text-generation", model=mod, tokenizer=tok)
-                return tok, mod, pipe
-            
-            # With accelerate, use device_map
-            mod = AutoModelForCausalLM.from_pretrained(
-                MODEL_NAME, 
-                **model_kwargs
+        tokenizer, model, text_generator = await loop.run_in_executor(
+            None, lambda: load_text_generation(
+                MODEL_NAME, HUGGINGFACE_TOKEN, use_gptq=USE_GPTQ, use_torch_compile=USE_TORCH_COMPILE,
+                profile=profile, cpu_model_name=CPU_MODEL_NAME, cpu_quantize_int8=CPU_INT8, cpu_threads=CPU_THREADS,
             )
-            
-            mod.eval()
-            
-            # Apply torch.compile() for faster inference (PyTorch 2.0+)
-            if USE_TORCH_COMPILE and hasattr(torch, 'compile'):
-                try:
-                    logger.info("⚡ Compiling model with torch.compile() for faster inference...")
-                    mod = torch.compile(mod, mode="reduce-overhead", fullgraph=False)
-                    logger.info("✅ Model compiled successfully")
-                except Exception as e:
-                    logger.warning(f"⚠️ torch.compile() failed: {e}. Continuing without compilation.")
-            
-            pipe = pipeline("text-generation", model=mod, tokenizer=tok) 
-            return tok, mod, pipe
-        tokenizer, model, text_generator = await loop.run_in_executor(None, load_hf)
-        if "<|eot_id|>" in tokenizer.vocab:
-             LLAMA_STOP_TOKENS.append(tokenizer.convert_tokens_to_ids("<|eot_id|>"))
-             text_generator.tokenizer.eos_token_id = tokenizer.convert_tokens_to_ids("<|eot_id|>")
-        logger.info(f"✅ Successfully loaded model '{MODEL_NAME}'.")
+        )
+        eot_id = prepare_for_batching(tokenizer, text_generator)
+        if eot_id is not None:
+            LLAMA_STOP_TOKENS.append(eot_id)
+        draft = None
+        if DRAFT_MODEL_NAME:
+            try:
+                draft = await loop.run_in_executor(None, lambda: load_draft_model(DRAFT_MODEL_NAME, model, tokenizer, HUGGINGFACE_TOKEN))
+            except Exception as e:
+                logger.warning(f"⚠️ Draft model '{DRAFT_MODEL_NAME}' unavailable ({e}); decoding without speculation")
+        attach_accelerators(
+            llm_scheduler,
+            model,
+            tokenizer,
+            prefix_cache_max_mb=PREFIX_CACHE_MAX_MB if PREFIX_CACHE_ENABLED else None,
+            prefix_cache_max_entries=PREFIX_CACHE_MAX_ENTRIES,
+            classifier_temperature=GOAL_CLASSIFIER_TEMPERATURE,
+            draft_model=draft,
+            draft_num_tokens=DRAFT_NUM_TOKENS,
+        )
+        conversation_encoder = llm_scheduler.encoder
+        model_registry.track("llm", text_generator)
+        if draft is not None:
+            model_registry.track("draft", draft)
+        logger.info(f"✅ Successfully loaded model '{loaded_model_name}'.")
     except Exception as e: logger.error(f"❌ FATAL ERROR loading AI model: {e}")
+
+    if small_llm_scheduler is not None:
+        # Until (unless) it loads, the router keeps every call site on the large model
+        logger.info(f"⏳ Loading small model tier ({SMALL_MODEL_NAME})...")
+        try:
+            small_tokenizer, small_model, small_pipe = await loop.run_in_executor(
+                None, lambda: load_text_generation(
+                    SMALL_MODEL_NAME, HUGGINGFACE_TOKEN, use_gptq=USE_GPTQ, use_torch_compile=USE_TORCH_COMPILE,
+                    profile=profile, cpu_model_name=SMALL_MODEL_NAME, cpu_quantize_int8=CPU_INT8, cpu_threads=CPU_THREADS,
+                )
+            )
+            prepare_for_batching(small_tokenizer, small_pipe)
+            attach_accelerators(small_llm_scheduler, small_model, small_tokenizer, classifier_temperature=GOAL_CLASSIFIER_TEMPERATURE)
+            small_text_generator = small_pipe
+            model_registry.track("llm_small", small_pipe)
+            logger.info(f"✅ Small model tier '{SMALL_MODEL_NAME}' loaded.")
+        except Exception as e: logger.warning(f"⚠️ Small model '{SMALL_MODEL_NAME}' unavailable ({e}); all call sites use '{loaded_model_name}'")
+    # Handlers keep answering "warming up" until the first-request compile/kernel costs are paid
+    await warm_up_generation()
     is_loading = False
     logger.info("🎉 Resource loading complete.")
 
@@ -892,13 +1175,92 @@ async def load_resources_bg():
 async def startup_event():
     logging.getLogger("uvicorn.access").addFilter(EndpointFilter())
     asyncio.create_task(load_resources_bg())
+    asyncio.create_task(warm_up_voice())
+    if MODEL_IDLE_SECONDS or MODEL_MEMORY_BUDGET_MB or GPU_MIN_FREE_MB:
+        asyncio.create_task(model_registry.run_evictor())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for backend in model_tiers.values():
+        await backend.close()
 
 @app.get("/health")
 def health_check(): return {"status": "loading" if is_loading else "healthy"}
 
+@app.get("/ready")
+def readiness_check():
+    """Per-component startup state (db, llm, whisper, tts); 503 until every component has settled"""
+    snapshot = readiness.snapshot()
+    return JSONResponse(snapshot, status_code=200 if snapshot["ready"] else 503)
+
+@app.get("/metrics/llm")
+def llm_metrics():
+    """Generation backend and response cache counters"""
+    whisper = model_registry.loaded("whisper")
+    return {
+        "backend": llm_backend.stats(),
+        "tiers": {tier: backend.stats() for tier, backend in model_tiers.items() if tier != TIER_LARGE},
+        "router": model_router.stats(),
+        "response_cache": response_cache.stats(),
+        "history": history_manager.stats(),
+        "stt_batcher": stt_batcher.stats(),
+        "stt": whisper.stats() if whisper is not None else {"backend": STT_BACKEND, "loaded": False},
+        "models": model_registry.stats(),
+    }
+
 
 # --- VOICE: SPEECH-TO-TEXT (WHISPER) ---
 
+@app.websocket("/api/v1/voice/stream")
+async def voice_stream(websocket: WebSocket, language: Optional[str] = None, sample_rate: int = 16000, encoding: str = "pcm_s16le"):
+    """
+    Streaming speech-to-text.
+    The client sends raw mono PCM as binary messages (`encoding` pcm_s16le or pcm_f32le, at
+    `sample_rate`) and the text message "stop" when it stops recording. The server answers
+    with JSON messages: speech_start, partial (text so far), final (text, language,
+    duration) and error. Voice activity detection closes each utterance after
+    STREAM_STT_END_SILENCE_MS of silence, so the final arrives as the learner stops speaking.
+    """
+    await websocket.accept()
+    if encoding not in PCM_ENCODINGS or not 8000 <= sample_rate <= 192000:
+        await websocket.send_json({"type": "error", "detail": f"Unsupported audio format ({encoding}, {sample_rate} Hz)"})
+        await websocket.close(code=1003)
+        return
+    user = websocket.headers.get("x-user-id") or (websocket.client.host if websocket.client else None)
+    send_lock = asyncio.Lock()
+
+    async def emit(message: dict):
+        async with send_lock:
+            await websocket.send_json(message)
+
+    async def transcribe(audio, partial: bool):
+        # Partials only refresh the text on screen: they are shed before any final
+        current_work.set(WorkContext(PRIORITY_BACKGROUND if partial else PRIORITY_VOICE, user))
+        options = {"temperature": 0.0, "condition_on_previous_text": False} if partial else {}
+        return await transcribe_samples(audio, language=language, **options)
+
+    stream = StreamingTranscriber(
+        transcribe,
+        emit,
+        vad=EnergyVAD(end_ms=STREAM_STT_END_SILENCE_MS),
+        partial_interval=STREAM_STT_PARTIAL_SECONDS,
+        max_utterance_seconds=MAX_AUDIO_SECONDS,
+    )
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes"):
+                await stream.push(resample(pcm_to_float(message["bytes"], encoding), sample_rate))
+            elif (message.get("text") or "").strip().lower() == "stop":
+                await stream.flush()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await stream.close()
+        logger.info(f"[StreamingSTT] Connection closed: {stream.stats()}")
+
 @app.post("/api/v1/voice/transcribe")
 async def voice_transcribe(
     file: UploadFile = File(...),
@@ -910,6 +1272,8 @@ async def voice_transcribe(
     """
     try:
         result = await transcribe_audio_file(file, language=language)
+    except (QueueFullError, AudioIngestError):
+        raise
     except Exception as e:
         logger.error(f"Whisper transcription error: {e}")
         raise HTTPException(status_code=500, detail="Transcription failed")
@@ -997,6 +1361,8 @@ async def voice_analyze(
     try:
         # Pass language explicitly to Whisper for better accuracy
         result = await transcribe_audio_file(file, language=whisper_lang)
+    except (QueueFullError, AudioIngestError):
+        raise
     except Exception as e:
         logger.error(f"Whisper transcription error in analyze: {e}")
         raise HTTPException(status_code=500, detail="Transcription failed")
@@ -1119,12 +1485,14 @@ async def voice_chat(
     - TTS via Edge-TTS
     Returns audio/mpeg (MP3), with transcript and reply text in headers.
     """
-    if is_loading or text_generator is None:
+    if is_loading or not llm_backend.ready:
         raise HTTPException(status_code=503, detail="Model is still loading")
 
     # 1) STT
     try:
         stt_result = await transcribe_audio_file(file, language=target_language)
+    except (QueueFullError, AudioIngestError):
+        raise
     except Exception as e:
         logger.error(f"Voice chat STT error: {e}")
         raise HTTPException(status_code=500, detail="Transcription failed")
@@ -1164,12 +1532,10 @@ async def voice_chat(
     llama_history.append({"role": "user", "content": user_text})
     full_history = llama_history
 
-    loop = asyncio.get_event_loop()
-
     # Grammar correction system (similar to /tutor endpoint)
     correction_system_prompt = f"""
 You are a highly analytical grammar checker.
-Student Input: "{user_text}"
+Student Input: the user's next message.
 Target Language: {target_lang_name}
 Native Language: {n_lang}
 Task: Check the Student Input for grammar or vocabulary errors in {target_lang_name}.
@@ -1182,12 +1548,6 @@ EXPLANATION: [Explanation in Native Lang]
 ---
 """
     correction_prompt_input = generate_chat_input(correction_system_prompt, [{"role": "user", "content": user_text}])
-    try:
-        correction_output = await loop.run_in_executor(None, lambda: text_generator(correction_prompt_input, max_new_tokens=100, temperature=0.1, stop_sequences=["CORRECTED:", "EXPLANATION:"], return_full_text=False))
-        correction_result = correction_output[0]['generated_text'].strip()
-    except Exception as e:
-        logger.error(f"Voice chat correction inference error: {e}")
-        correction_result = "ERROR_INFERENCE"
 
     # Strengthened system prompt with keyword guidance and strict goal constraints
     conversation_system_prompt = f"""
@@ -1199,44 +1559,51 @@ Constraint 2: Keep the conversation focused strictly on achieving "{comm_goal}".
 Constraint 3: If the student hasn't used keywords related to the goal, ask questions to guide them toward it.
 Respond naturally to the student's last message while staying within these constraints.
 """
-    conversation_prompt_input = generate_chat_input(conversation_system_prompt, llama_history)
-
-    def _run_llm():
-        output = text_generator(
-            conversation_prompt_input,
-            max_new_tokens=60,
-            do_sample=True,
-            top_k=50,
-            temperature=0.7,
-            return_full_text=False,
-        )
-        raw = output[0]["generated_text"].strip()
-        return raw
+    fitted = history_manager.fit("voice_chat", conversation_system_prompt, llama_history)
+    conversation_prompt_input = generate_chat_input(conversation_system_prompt, fitted.messages, fitted.summary)
 
-    try:
-        reply_text = await loop.run_in_executor(None, _run_llm)
-    except Exception as e:
-        logger.error(f"Voice chat LLM error: {e}")
+    # Goal achievement check (similar to /tutor endpoint)
+    assessment_system_prompt = f"""
+You are an analysis bot. Your only job is to determine if the student has met the goal.
+Goal: {comm_goal}
+Output ONLY 'YES' or 'NO'.
+"""
+    fitted = history_manager.fit("voice_chat", assessment_system_prompt, full_history)
+    assessment_prompt_input = generate_chat_input(assessment_system_prompt, fitted.messages, fitted.summary)
+
+    # 4) Correction, reply and assessment are independent: run them as one scheduler step
+    timings = {}
+    started = time.monotonic()
+    results = await asyncio.gather(
+        timed_call("correction", cached_generate(TASK_CORRECTION, correction_prompt_input, max_new_tokens=100, temperature=0.1, stop_sequences=CORRECTION_STOP_SEQUENCES), timings),
+        timed_call("conversation", model_router.backend(TASK_CONVERSATION).generate(conversation_prompt_input, max_new_tokens=60, do_sample=True, top_k=50, temperature=0.7), timings),
+        timed_call("assessment", model_router.backend(TASK_ASSESSMENT).classify(assessment_prompt_input), timings),
+        return_exceptions=True,
+    )
+    timings["total"] = round((time.monotonic() - started) * 1000)
+    reraise_client_errors(results)
+    correction_output, output, goal_confidence = results
+
+    if isinstance(correction_output, Exception):
+        logger.error(f"Voice chat correction inference error: {correction_output}")
+        correction_result = "ERROR_INFERENCE"
+    else:
+        correction_result = correction_output.strip()
+
+    if isinstance(output, Exception):
+        logger.error(f"Voice chat LLM error: {output}")
         raise HTTPException(status_code=500, detail="Failed to generate reply")
+    reply_text = output.strip()
 
     if not reply_text:
         reply_text = "..."
 
-    # 4) Check for goal achievement (similar to /tutor endpoint)
     status = "CONTINUE"
-    assessment_system_prompt = f"""
-You are an analysis bot. Your only job is to determine if the student has met the goal.
-Goal: {comm_goal}
-Output ONLY 'YES' or 'NO'.
-"""
-    assessment_prompt_input = generate_chat_input(assessment_system_prompt, full_history)
-    try:
-        check_output = await loop.run_in_executor(None, lambda: text_generator(assessment_prompt_input, max_new_tokens=5, temperature=0.1, return_full_text=False))
-        result = check_output[0]['generated_text'].strip().upper()
-        if "YES" in result:
-            status = "GOAL_ACHIEVED"
-    except Exception as e:
-        logger.error(f"Voice chat goal assessment error: {e}")
+    if isinstance(goal_confidence, Exception):
+        logger.error(f"Voice chat goal assessment error: {goal_confidence}")
+        goal_confidence = 0.0
+    elif goal_confidence >= GOAL_YES_THRESHOLD:
+        status = "GOAL_ACHIEVED"
 
     # 5) TTS using Azure Speech Services
     # For conversation challenges, extract character name for gendered voices
@@ -1258,6 +1625,8 @@ Output ONLY 'YES' or 'NO'.
         "X-Polybot-Target-Lang": t_lang,
         "X-Polybot-Native-Lang": n_lang,
         "X-Polybot-Goal": comm_goal.encode("utf-8", "ignore")[:4096].decode("utf-8", "ignore"),
+        "X-Polybot-Goal-Confidence": f"{goal_confidence:.3f}",
+        "X-Polybot-Timings": json.dumps(timings),
     }
 
     return StreamingResponse(
@@ -1356,6 +1725,32 @@ async def get_profile(email: str):
     user["_id"] = str(user["_id"])
     return user
 
+def build_initiate_prompt(request: InitiateChatRequest, t_lang: str, n_lang: str):
+    """Build the opening-question prompt for a regular lesson. Returns (prompt_input, comm_goal)."""
+    lesson_key = request.lesson_id.lower() + "_comm" if request.lesson_id else "a1.1_comm"
+    comm_goal = get_text(lesson_key, n_lang)
+    
+    target_lang_name = get_full_lang_name(t_lang)
+    
+    system_prompt = f"""
+You are Polybot, a friendly, encouraging, and highly strict language tutor speaking only {target_lang_name} (ISO Code: {t_lang}).
+Your task is to start a conversation to help the student achieve the following communicative goal: "{comm_goal}".
+Constraint 1: You must speak ONLY in {target_lang_name}.
+Constraint 2: Your first response MUST be a friendly blended greeting and question, like 'Ciao! Come ti chiami?' or similar, translated into {target_lang_name}.
+"""
+    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": f"Start the conversation now. Ask your first question in {target_lang_name}."}]
+    return generate_chat_input(system_prompt, messages[1:]), comm_goal
+
+INITIATE_GENERATION = dict(max_new_tokens=40, do_sample=True, top_k=50, temperature=0.8)
+
+def initiate_result(output: Optional[str], comm_goal: str) -> dict:
+    """The /tutor/initiate payload for a generated greeting, or its fallback when generation failed (None)"""
+    if output is None:
+        return {"text": "Ciao!", "communicative_goal": comm_goal}
+    raw = output.strip()
+    if not raw or len(raw) < 2: raw = "Ciao! Come ti chiami?"
+    return {"text": raw, "explanation": "Conversation started.", "sender": "polybot", "communicative_goal": comm_goal}
+
 @app.post("/tutor/initiate")
 async def initiate_chat(request: InitiateChatRequest):
     n_lang = normalize_lang(request.native_language)
@@ -1553,36 +1948,53 @@ async def initiate_chat(request: InitiateChatRequest):
         }
     
     # Only check AI loading for non-boss-fight lessons
-    if is_loading or text_generator is None: 
+    if is_loading or not llm_backend.ready: 
         return {"text": "System is warming up...", "communicative_goal": "Wait for AI"}
     
     # Fallback to regular initiation
-    lesson_key = request.lesson_id.lower() + "_comm" if request.lesson_id else "a1.1_comm"
-    comm_goal = get_text(lesson_key, n_lang)
-    
-    target_lang_name = get_full_lang_name(t_lang)
-    
-    system_prompt = f"""
-You are Polybot, a friendly, encouraging, and highly strict language tutor speaking only {target_lang_name} (ISO Code: {t_lang}).
-Your task is to start a conversation to help the student achieve the following communicative goal: "{comm_goal}".
-Constraint 1: You must speak ONLY in {target_lang_name}.
-Constraint 2: Your first response MUST be a friendly blended greeting and question, like 'Ciao! Come ti chiami?' or similar, translated into {target_lang_name}.
-"""
-    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": f"Start the conversation now. Ask your first question in {target_lang_name}."}]
-    final_prompt = generate_chat_input(system_prompt, messages[1:])
-    loop = asyncio.get_event_loop()
+    final_prompt, comm_goal = build_initiate_prompt(request, t_lang, n_lang)
     try:
-        output = await loop.run_in_executor(None, lambda: text_generator(final_prompt, max_new_tokens=40, do_sample=True, top_k=50, temperature=0.8, return_full_text=False))
-        raw = output[0]['generated_text'].strip()
-        if not raw or len(raw) < 2: raw = f"Ciao! Come ti chiami?"
-        return {"text": raw, "explanation": "Conversation started.", "sender": "polybot", "communicative_goal": comm_goal}
+        output = await model_router.backend(TASK_CONVERSATION).generate(final_prompt, **INITIATE_GENERATION)
     except Exception as e:
         logger.error(f"Initiation error: {e}")
-        return {"text": "Ciao!", "communicative_goal": comm_goal}
+        output = None
+    return initiate_result(output, comm_goal)
 
-@app.post("/tutor")
-async def tutor_mode(request: TutorRequest):
-    if is_loading or text_generator is None: return {"text": "Warming up..."}
+@app.post("/tutor/initiate/stream")
+async def initiate_chat_stream(request: InitiateChatRequest):
+    """
+    Streaming variant of /tutor/initiate (Server-Sent Events).
+    Emits `token` events while the greeting decodes, then a `done` event with the same
+    payload /tutor/initiate returns. Boss fights and warm-up send only the `done` event.
+    """
+    lesson_id = str(request.lesson_id) if request.lesson_id else ""
+    if "boss" in lesson_id.lower() or is_loading or not llm_backend.ready:
+        result = await initiate_chat(request)
+        return StreamingResponse(iter([sse_event("done", result)]), media_type="text/event-stream", headers=SSE_HEADERS)
+    
+    n_lang = normalize_lang(request.native_language)
+    t_lang = normalize_lang(request.target_language)
+    final_prompt, comm_goal = build_initiate_prompt(request, t_lang, n_lang)
+    
+    async def event_stream():
+        reply_stream = model_router.backend(TASK_CONVERSATION).stream(final_prompt, **INITIATE_GENERATION)
+        output = ""
+        try:
+            async for chunk in reply_stream:
+                output += chunk
+                yield sse_event("token", {"text": chunk})
+        except Exception as e:
+            logger.error(f"Initiation stream error: {e}")
+            output = None
+        finally:
+            # Stop decoding right away if the client disconnected mid-stream
+            await reply_stream.aclose()
+        yield sse_event("done", initiate_result(output, comm_goal))
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+def build_tutor_prompts(request: TutorRequest) -> dict:
+    """Build the assessment, correction and conversation prompt inputs for one tutor turn"""
     t_lang = normalize_lang(request.target_language)
     n_lang = normalize_lang(request.native_language)
     target_lang_name = get_full_lang_name(t_lang)
@@ -1595,23 +2007,16 @@ async def tutor_mode(request: TutorRequest):
         if 'text' not in msg: continue 
         llama_history.append({"role": msg['role'], "content": msg['text']})
     full_history = llama_history + [{"role": "user", "content": request.user_message}]
-    loop = asyncio.get_event_loop()
     
     assessment_system_prompt = f"""
 You are an analysis bot. Your only job is to determine if the student has met the goal.
 Goal: The student must successfully state their name in {target_lang_name} (e.g., "Mi chiamo Jeff").
 Output ONLY 'YES' or 'NO'.
 """
-    assessment_prompt_input = generate_chat_input(assessment_system_prompt, full_history)
-    try:
-        check_output = await loop.run_in_executor(None, lambda: text_generator(assessment_prompt_input, max_new_tokens=5, temperature=0.1, return_full_text=False))
-        result = check_output[0]['generated_text'].strip().upper()
-        if "YES" in result: return {"text": "Fantastico! You have introduced yourself perfectly.", "status": "GOAL_ACHIEVED", "xp_reward": 50}
-    except Exception as e: logger.error(f"Assessment error: {e}")
-
+    # Student input travels as the user turn so this system block is shared per language pair
     correction_system_prompt = f"""
 You are a highly analytical grammar checker.
-Student Input: "{request.user_message}"
+Student Input: the user's next message.
 Target Language: {target_lang_name}
 Native Language: {n_lang}
 Task: Check the Student Input for grammar or vocabulary errors in {target_lang_name}.
@@ -1623,27 +2028,120 @@ CORRECTED: [Corrected Sentence in Target Lang]
 EXPLANATION: [Explanation in Native Lang]
 ---
 """
-    correction_prompt_input = generate_chat_input(correction_system_prompt, [{"role": "user", "content": request.user_message}])
-    try:
-        correction_output = await loop.run_in_executor(None, lambda: text_generator(correction_prompt_input, max_new_tokens=100, temperature=0.1, stop_sequences=["CORRECTED:", "EXPLANATION:"], return_full_text=False))
-        correction_result = correction_output[0]['generated_text'].strip()
-    except Exception as e:
-        logger.error(f"Correction inference error: {e}")
-        correction_result = "ERROR_INFERENCE"
-
     conversation_system_prompt = f"""
 You are Polybot, a friendly language tutor. The target language is {target_lang_name}.
 Your role is to guide the student to use the following Target Keywords: {keywords} in {target_lang_name}.
 Constraint: You must speak ONLY in {target_lang_name}. If the student hasn't used a keyword, ask a question to trigger it.
 """
-    conversation_prompt_input = generate_chat_input(conversation_system_prompt, full_history)
-    try:
-        output = await loop.run_in_executor(None, lambda: text_generator(conversation_prompt_input, max_new_tokens=60, do_sample=True, top_k=50, temperature=0.7, return_full_text=False))
-        raw = output[0]['generated_text'].strip()
-        return {"text": raw, "status": "CONTINUE", "correction_data": correction_result if "CORRECTED:" in correction_result or correction_result == "NO_ERROR" else "ERROR_FORMAT"}
-    except Exception as e:
-        logger.error(f"Conversation inference error: {e}")
+    assessment_history = history_manager.fit("tutor", assessment_system_prompt, full_history)
+    conversation_history = history_manager.fit("tutor", conversation_system_prompt, full_history)
+    return {
+        "assessment": generate_chat_input(assessment_system_prompt, assessment_history.messages, assessment_history.summary),
+        "correction": generate_chat_input(correction_system_prompt, [{"role": "user", "content": request.user_message}]),
+        "conversation": generate_chat_input(conversation_system_prompt, conversation_history.messages, conversation_history.summary),
+    }
+
+def format_correction_data(correction_result: str) -> str:
+    return correction_result if "CORRECTED:" in correction_result or correction_result == "NO_ERROR" else "ERROR_FORMAT"
+
+TUTOR_CORRECTION_GENERATION = dict(max_new_tokens=100, temperature=0.1, stop_sequences=CORRECTION_STOP_SEQUENCES)
+TUTOR_CONVERSATION_GENERATION = dict(max_new_tokens=60, do_sample=True, top_k=50, temperature=0.7)
+
+def tutor_result(goal_confidence: float, correction_result: str, output: Optional[str]) -> dict:
+    """The /tutor payload: goal achieved, the reply with its correction, or an error when the reply failed (None)"""
+    if goal_confidence >= GOAL_YES_THRESHOLD:
+        return {"text": "Fantastico! You have introduced yourself perfectly.", "status": "GOAL_ACHIEVED", "xp_reward": 50, "goal_confidence": round(goal_confidence, 3)}
+    if output is None:
         return {"text": "Error generating reply.", "status": "ERROR"}
+    return {"text": output.strip(), "status": "CONTINUE", "correction_data": format_correction_data(correction_result), "goal_confidence": round(goal_confidence, 3)}
+
+@app.post("/tutor")
+async def tutor_mode(request: TutorRequest):
+    if is_loading or not llm_backend.ready: return {"text": "Warming up..."}
+    prompts = build_tutor_prompts(request)
+    
+    # The three generations are independent: submitted together they share scheduler steps
+    timings = {}
+    started = time.monotonic()
+    results = await asyncio.gather(
+        timed_call("assessment", model_router.backend(TASK_ASSESSMENT).classify(prompts["assessment"]), timings),
+        timed_call("correction", cached_generate(TASK_CORRECTION, prompts["correction"], **TUTOR_CORRECTION_GENERATION), timings),
+        timed_call("conversation", model_router.backend(TASK_CONVERSATION).generate(prompts["conversation"], **TUTOR_CONVERSATION_GENERATION), timings),
+        return_exceptions=True,
+    )
+    timings["total"] = round((time.monotonic() - started) * 1000)
+    reraise_client_errors(results)
+    goal_confidence, correction_output, output = results
+    
+    if isinstance(goal_confidence, Exception):
+        logger.error(f"Assessment error: {goal_confidence}")
+        goal_confidence = 0.0
+
+    if isinstance(correction_output, Exception):
+        logger.error(f"Correction inference error: {correction_output}")
+        correction_result = "ERROR_INFERENCE"
+    else:
+        correction_result = correction_output.strip()
+
+    if isinstance(output, Exception):
+        logger.error(f"Conversation inference error: {output}")
+        output = None
+    return {**tutor_result(goal_confidence, correction_result, output), "timings_ms": timings}
+
+@app.post("/tutor/stream")
+async def tutor_mode_stream(request: TutorRequest):
+    """
+    Streaming variant of /tutor (Server-Sent Events).
+    The reply is pushed as `token` events while it decodes; assessment and correction run
+    alongside it and arrive in the trailing `done` event (same fields as /tutor). When the
+    goal is achieved, `done` carries the replacement text and status GOAL_ACHIEVED.
+    """
+    if is_loading or not llm_backend.ready:
+        return StreamingResponse(iter([sse_event("done", {"text": "Warming up..."})]), media_type="text/event-stream", headers=SSE_HEADERS)
+    prompts = build_tutor_prompts(request)
+    
+    async def _assess() -> float:
+        try:
+            return await model_router.backend(TASK_ASSESSMENT).classify(prompts["assessment"])
+        except Exception as e:
+            logger.error(f"Assessment error: {e}")
+            return 0.0
+    
+    async def _correct() -> str:
+        try:
+            correction_output = await cached_generate(TASK_CORRECTION, prompts["correction"], **TUTOR_CORRECTION_GENERATION)
+            return correction_output.strip()
+        except Exception as e:
+            logger.error(f"Correction inference error: {e}")
+            return "ERROR_INFERENCE"
+    
+    async def event_stream():
+        reply_stream = model_router.backend(TASK_CONVERSATION).stream(prompts["conversation"], **TUTOR_CONVERSATION_GENERATION)
+        assessment_task = asyncio.ensure_future(_assess())
+        correction_task = asyncio.ensure_future(_correct())
+        output = ""
+        try:
+            try:
+                async for chunk in reply_stream:
+                    output += chunk
+                    yield sse_event("token", {"text": chunk})
+            except Exception as e:
+                logger.error(f"Conversation stream error: {e}")
+                yield sse_event("done", tutor_result(0.0, "", None))
+                return
+            
+            goal_confidence = await assessment_task
+            # The correction is only shown alongside a CONTINUE reply
+            correction_result = await correction_task if goal_confidence < GOAL_YES_THRESHOLD else ""
+            yield sse_event("done", tutor_result(goal_confidence, correction_result, output))
+        finally:
+            # Also runs when the client disconnects mid-stream: free the GPU slots the side calls hold
+            for task in (assessment_task, correction_task):
+                if not task.done():
+                    task.cancel()
+            await reply_stream.aclose()
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 @app.post("/boss/grammar-check", response_model=GrammarCheckResponse)
 async def grammar_check(request: GrammarCheckRequest):
@@ -1651,7 +2149,7 @@ async def grammar_check(request: GrammarCheckRequest):
     Check spelling, grammar, and sentence construction for boss fight responses.
     Uses AI for intelligent grammar and spelling checking.
     """
-    if is_loading or text_generator is None:
+    if is_loading or not llm_backend.ready:
         return GrammarCheckResponse(
             has_errors=False,
             feedback="Grammar check unavailable - system warming up",
@@ -1703,14 +2201,10 @@ SPELLING_SCORE: [0.0-1.0]
 GRAMMAR_SCORE: [0.0-1.0]
 """
     
-    loop = asyncio.get_event_loop()
     try:
         grammar_prompt_input = generate_chat_input(grammar_system_prompt, [])
-        grammar_output = await loop.run_in_executor(
-            None,
-            lambda: text_generator(grammar_prompt_input, max_new_tokens=150, temperature=0.3, return_full_text=False)
-        )
-        ai_response = grammar_output[0]['generated_text'].strip()
+        grammar_output = await cached_generate(TASK_GRAMMAR, grammar_prompt_input, max_new_tokens=150, temperature=0.3)
+        ai_response = grammar_output.strip()
         
         # Parse AI response
         errors = []
@@ -2062,7 +2556,7 @@ async def practice_initiate(request: PracticeInitiateRequest):
     """
     Initialize a practice scenario with initial character greeting
     """
-    if is_loading or text_generator is None:
+    if is_loading or not llm_backend.ready:
         return {"text": "System is warming up...", "scene_status": "ACTIVE"}
     
     scenario = get_scenario_template(request.scenario_id)
@@ -2088,13 +2582,9 @@ async def practice_initiate(request: PracticeInitiateRequest):
         messages = [{"role": "user", "content": init_message}]
         prompt_input = generate_chat_input(system_prompt, messages)
         
-        loop = asyncio.get_event_loop()
         try:
-            output = await loop.run_in_executor(
-                None,
-                lambda: text_generator(prompt_input, max_new_tokens=30, do_sample=True, top_k=25, temperature=0.5, return_full_text=False)
-            )
-            greeting = output[0]['generated_text'].strip()
+            output = await model_router.backend(TASK_CONVERSATION).generate(prompt_input, max_new_tokens=30, do_sample=True, top_k=25, temperature=0.5, max_sentences=NPC_MAX_SENTENCES)
+            greeting = output.strip()
             if not greeting or len(greeting) < 2:
                 # Fallback greeting based on scenario
                 if request.scenario_id == "coffee_order":
@@ -2112,85 +2602,187 @@ async def practice_initiate(request: PracticeInitiateRequest):
     }
 
 
-@app.post("/api/practice/text-chat")
-async def practice_text_chat(request: PracticeTextChatRequest):
-    """
-    Text-based practice mode conversation
-    Uses GameState to track conversation and Goal Check Classifier
-    """
-    if is_loading or text_generator is None:
-        return {"reply": "System is warming up...", "scene_status": "ACTIVE", "thought": ""}
-    
+def build_practice_history(conversation_history: List[dict], user_message: str) -> List[dict]:
+    """Normalize client-side practice history ('text' or 'content' keys) and append the new user turn"""
+    llama_history = []
+    for msg in conversation_history:
+        if 'text' in msg or 'content' in msg:
+            content = msg.get('text') or msg.get('content', '')
+            role = 'user' if msg.get('role') == 'user' else 'assistant'
+            llama_history.append({"role": role, "content": content})
+    llama_history.append({"role": "user", "content": user_message})
+    return llama_history
+
+
+def get_practice_system_prompt(scenario_id: str, scenario, t_lang: str, n_lang: str) -> str:
+    system_prompt = get_cached_system_prompt(scenario_id, t_lang, n_lang)
+    if not system_prompt:
+        system_prompt = build_stage_manager_prompt(scenario, t_lang, n_lang)
+    return system_prompt
+
+
+def prepare_practice_chat(request: PracticeTextChatRequest):
+    """Scenario, target language, history (with the new user turn) and system prompt of a text-chat turn"""
     scenario = get_scenario_template(request.scenario_id)
     if not scenario:
         raise HTTPException(status_code=404, detail=f"Scenario '{request.scenario_id}' not found")
     
     t_lang = normalize_lang(request.target_language)
     n_lang = normalize_lang(request.native_language)
-    target_lang_name = get_full_lang_name(t_lang)
     
-    # Build conversation history for LLM
-    llama_history = []
-    for msg in request.conversation_history:
-        if 'text' in msg or 'content' in msg:
-            content = msg.get('text') or msg.get('content', '')
-            role = 'user' if msg.get('role') == 'user' else 'assistant'
-            llama_history.append({"role": role, "content": content})
+    # Build conversation history for LLM (includes the current user message)
+    llama_history = build_practice_history(request.conversation_history, request.user_message)
     
-    # Add current user message
-    llama_history.append({"role": "user", "content": request.user_message})
-    
-    # Check for template-based response first (for common interactions)
-    # Simple heuristics: check if user message contains order-related keywords
-    user_lower = request.user_message.lower()
     # Use cached system prompt
-    system_prompt = get_cached_system_prompt(request.scenario_id, t_lang, n_lang)
-    if not system_prompt:
-        system_prompt = build_stage_manager_prompt(scenario, t_lang, n_lang)
+    system_prompt = get_practice_system_prompt(request.scenario_id, scenario, t_lang, n_lang)
+    return scenario, t_lang, llama_history, system_prompt
+
+
+PRACTICE_REPLY_GENERATION = dict(max_new_tokens=35, do_sample=True, top_k=25, temperature=0.5, max_sentences=NPC_MAX_SENTENCES)
+PRACTICE_REPLY_FALLBACK = "Scusa, puoi ripetere?"
+# Goal check result for turns that skip it (first message, or completion not yet possible)
+GOAL_CHECK_SKIPPED = {"scene_status": "ACTIVE", "thought": "", "reply": ""}
+
+
+def practice_turn_result(reply_text: str, goal_check_result: dict) -> dict:
+    """The practice turn payload; a completed scene replaces the reply with the goal check's closing line"""
+    if goal_check_result["scene_status"] == "COMPLETE":
+        final_reply = goal_check_result.get("reply", reply_text)
+    else:
+        final_reply = reply_text
+    return {
+        "reply": final_reply,
+        "scene_status": goal_check_result["scene_status"],
+        "thought": goal_check_result.get("thought", "")
+    }
+
+
+def should_check_goal(scenario, llama_history: List[dict]) -> bool:
+    """
+    Whether this turn needs the LLM goal check: after at least 2 messages (user + AI response)
+    to have enough context, and only once the scenario's completion preconditions are all met
+    """
+    if len(llama_history) < 2:
+        return False
+    missing = missing_preconditions(scenario, llama_history)
+    if missing:
+        logger.info(f"[Goal Check] Skipped for {scenario.scenario_id}: missing {', '.join(missing)}")
+        return False
+    return True
+
+
+async def run_practice_turn(scenario, system_prompt: str, llama_history: List[dict], t_lang: str, label: str) -> dict:
+    """
+    Character reply and goal check for one practice turn ({"reply", "scene_status", "thought"}).
+    Fused into a single generation when enabled; otherwise, or when the fused output is
+    unusable, the reply is generated first and check_goal_achievement runs after it.
+    """
+    fitted = history_manager.fit("practice", system_prompt, llama_history)
+    check_goal = should_check_goal(scenario, llama_history)
     
-    # Generate character response using LLM
-    prompt_input = generate_chat_input(system_prompt, llama_history)
-    loop = asyncio.get_event_loop()
+    if PRACTICE_FUSED_TURN and check_goal:
+        try:
+            fused = await generate_reply_with_goal_check(
+                system_prompt,
+                fitted.messages,
+                scenario.winning_condition,
+                t_lang,
+                model_router.backend(TASK_CONVERSATION),
+                generate_chat_input,
+                summary=fitted.summary,
+            )
+            if fused is not None:
+                return fused
+        except Exception as e:
+            logger.error(f"{label} fused turn error: {e}")
     
+    # Generate character response using LLM
+    prompt_input = generate_chat_input(system_prompt, fitted.messages, fitted.summary)
     try:
-        output = await loop.run_in_executor(
-            None,
-            lambda: text_generator(prompt_input, max_new_tokens=35, do_sample=True, top_k=25, temperature=0.5, return_full_text=False)
-        )
-        reply_text = output[0]['generated_text'].strip()
+        output = await model_router.backend(TASK_CONVERSATION).generate(prompt_input, **PRACTICE_REPLY_GENERATION)
+        reply_text = output.strip()
         if not reply_text:
             reply_text = "..."
     except Exception as e:
-        logger.error(f"Practice text chat LLM error: {e}")
-        reply_text = "Scusa, puoi ripetere?"
+        logger.error(f"{label} LLM error: {e}")
+        reply_text = PRACTICE_REPLY_FALLBACK
     
     # Check goal achievement using Goal Check Classifier
-    # Check after at least 2 messages (user + AI response) to have enough context
-    # Check every message after the initial exchange to catch completion accurately
-    should_check_goal = len(llama_history) >= 2
-    if should_check_goal:
+    if check_goal:
         goal_check_result = await check_goal_achievement(
             llama_history,
             scenario.winning_condition,
             t_lang,
-            text_generator,
+            model_router.backend(TASK_GOAL_CHECK),
             generate_chat_input
         )
     else:
-        # Default to ACTIVE if not checking (first message)
-        goal_check_result = {"scene_status": "ACTIVE", "thought": "", "reply": ""}
+        goal_check_result = GOAL_CHECK_SKIPPED
+    return practice_turn_result(reply_text, goal_check_result)
+
+
+@app.post("/api/practice/text-chat")
+async def practice_text_chat(request: PracticeTextChatRequest):
+    """
+    Text-based practice mode conversation
+    Uses GameState to track conversation and Goal Check Classifier
+    """
+    if is_loading or not llm_backend.ready:
+        return {"reply": "System is warming up...", "scene_status": "ACTIVE", "thought": ""}
     
-    # If goal is complete, use the reply from goal check; otherwise use character response
-    if goal_check_result["scene_status"] == "COMPLETE":
-        final_reply = goal_check_result.get("reply", reply_text)
-    else:
-        final_reply = reply_text
+    scenario, t_lang, llama_history, system_prompt = prepare_practice_chat(request)
     
-    return {
-        "reply": final_reply,
-        "scene_status": goal_check_result["scene_status"],
-        "thought": goal_check_result.get("thought", "")
-    }
+    # Character response and goal check
+    return await run_practice_turn(scenario, system_prompt, llama_history, t_lang, "Practice text chat")
+
+
+@app.post("/api/practice/text-chat/stream")
+async def practice_text_chat_stream(request: PracticeTextChatRequest):
+    """
+    Streaming variant of /api/practice/text-chat (Server-Sent Events).
+    The character reply is pushed as `token` events while it decodes. The goal check only
+    reads the history up to the user's message, so it runs alongside the reply and its
+    result arrives in the trailing `done` event, whose "reply" is the authoritative text.
+    """
+    if is_loading or not llm_backend.ready:
+        return StreamingResponse(iter([sse_event("done", {"reply": "System is warming up...", "scene_status": "ACTIVE", "thought": ""})]), media_type="text/event-stream", headers=SSE_HEADERS)
+    
+    scenario, t_lang, llama_history, system_prompt = prepare_practice_chat(request)
+    fitted = history_manager.fit("practice", system_prompt, llama_history)
+    prompt_input = generate_chat_input(system_prompt, fitted.messages, fitted.summary)
+    
+    async def event_stream():
+        reply_stream = model_router.backend(TASK_CONVERSATION).stream(prompt_input, **PRACTICE_REPLY_GENERATION)
+        goal_check_task = None
+        if should_check_goal(scenario, llama_history):
+            goal_check_task = asyncio.ensure_future(check_goal_achievement(
+                llama_history,
+                scenario.winning_condition,
+                t_lang,
+                model_router.backend(TASK_GOAL_CHECK),
+                generate_chat_input
+            ))
+        
+        try:
+            reply_text = ""
+            try:
+                async for chunk in reply_stream:
+                    reply_text += chunk
+                    yield sse_event("token", {"text": chunk})
+                reply_text = reply_text.strip() or "..."
+            except Exception as e:
+                logger.error(f"Practice text chat stream error: {e}")
+                reply_text = PRACTICE_REPLY_FALLBACK
+            
+            goal_check_result = await goal_check_task if goal_check_task is not None else GOAL_CHECK_SKIPPED
+            yield sse_event("done", practice_turn_result(reply_text, goal_check_result))
+        finally:
+            # Also runs when the client disconnects mid-stream
+            if goal_check_task is not None and not goal_check_task.done():
+                goal_check_task.cancel()
+            await reply_stream.aclose()
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 
 @app.post("/api/practice/voice-chat")
@@ -2205,7 +2797,7 @@ async def practice_voice_chat(
     Voice-based practice mode conversation
     Process: Whisper STT → GameState update → Llama 3 → Goal Check → Edge-TTS
     """
-    if is_loading or text_generator is None:
+    if is_loading or not llm_backend.ready:
         raise HTTPException(status_code=503, detail="Model is still loading")
     
     scenario = get_scenario_template(scenario_id)
@@ -2215,6 +2807,8 @@ async def practice_voice_chat(
     # 1) STT via Whisper
     try:
         stt_result = await transcribe_audio_file(file, language=target_language)
+    except (QueueFullError, AudioIngestError):
+        raise
     except Exception as e:
         logger.error(f"Practice voice chat STT error: {e}")
         raise HTTPException(status_code=500, detail="Transcription failed")
@@ -2237,57 +2831,12 @@ async def practice_voice_chat(
     t_lang = normalize_lang(target_language)
     n_lang = normalize_lang(native_language)
     
-    llama_history = []
-    for msg in history:
-        if 'text' in msg or 'content' in msg:
-            content = msg.get('text') or msg.get('content', '')
-            role = 'user' if msg.get('role') == 'user' else 'assistant'
-            llama_history.append({"role": role, "content": content})
+    llama_history = build_practice_history(history, user_text)
     
-    llama_history.append({"role": "user", "content": user_text})
-    
-    # 4) Generate character response using cached Stage Manager prompt
-    # Use cached system prompt
-    system_prompt = get_cached_system_prompt(scenario_id, t_lang, n_lang)
-    if not system_prompt:
-        system_prompt = build_stage_manager_prompt(scenario, t_lang, n_lang)
-    
-    # Generate character response using LLM
-    prompt_input = generate_chat_input(system_prompt, llama_history)
-    loop = asyncio.get_event_loop()
-    
-    try:
-        output = await loop.run_in_executor(
-            None,
-            lambda: text_generator(prompt_input, max_new_tokens=35, do_sample=True, top_k=25, temperature=0.5, return_full_text=False)
-        )
-        reply_text = output[0]['generated_text'].strip()
-        if not reply_text:
-            reply_text = "..."
-    except Exception as e:
-        logger.error(f"Practice voice chat LLM error: {e}")
-        reply_text = "Scusa, puoi ripetere?"
-    
-    # 5) Check goal achievement
-    # Check after at least 2 messages (user + AI response) to have enough context
-    # Check every message after the initial exchange to catch completion accurately
-    should_check_goal = len(llama_history) >= 2
-    if should_check_goal:
-        goal_check_result = await check_goal_achievement(
-            llama_history,
-            scenario.winning_condition,
-            t_lang,
-            text_generator,
-            generate_chat_input
-        )
-    else:
-        goal_check_result = {"scene_status": "ACTIVE", "thought": "", "reply": ""}
-    
-    # Use goal check reply if complete, otherwise use character response
-    if goal_check_result["scene_status"] == "COMPLETE":
-        final_reply = goal_check_result.get("reply", reply_text)
-    else:
-        final_reply = reply_text
+    # 4) Character response (cached Stage Manager prompt) and 5) goal check
+    system_prompt = get_practice_system_prompt(scenario_id, scenario, t_lang, n_lang)
+    goal_check_result = await run_practice_turn(scenario, system_prompt, llama_history, t_lang, "Practice voice chat")
+    final_reply = goal_check_result["reply"]
     
     # 6) TTS using Azure Speech Services
     # Note: final_reply is from Polybot (AI system), not a curriculum character
@@ -2319,7 +2868,7 @@ async def practice_translate(request: dict = Body(...)):
     """
     Translate a message from target language to native language
     """
-    if is_loading or text_generator is None:
+    if is_loading or not llm_backend.ready:
         raise HTTPException(status_code=503, detail="Model is still loading")
     
     text = request.get("text", "")
@@ -2344,13 +2893,10 @@ Translation:"""
     
     try:
         prompt_input = generate_chat_input(translation_prompt, [])
-        loop = asyncio.get_event_loop()
-        output = await loop.run_in_executor(
-            None,
-            lambda: text_generator(prompt_input, max_new_tokens=100, temperature=0.3, return_full_text=False)
-        )
+        # Only the first line is used, so stop there
+        output = await cached_generate(TASK_TRANSLATION, prompt_input, max_new_tokens=100, temperature=0.3, stop_sequences=["\n"])
         
-        translation = output[0]['generated_text'].strip()
+        translation = output.strip()
         # Clean up any extra text that might have been generated
         translation = translation.split('\n')[0].strip()
         # Remove quotes if present
@@ -2367,7 +2913,7 @@ async def practice_post_game_report(request: PostGameReportRequest):
     """
     Generate Post-Game Report with pronunciation, grammar, and vocabulary feedback
     """
-    if is_loading or text_generator is None:
+    if is_loading or not llm_backend.ready:
         raise HTTPException(status_code=503, detail="Model is still loading")
     
     scenario = get_scenario_template(request.scenario_id)
@@ -2385,7 +2931,7 @@ async def practice_post_game_report(request: PostGameReportRequest):
         request.conversation_transcript,
         t_lang,
         n_lang,
-        text_generator,
+        model_router.backend(TASK_REPORT),
         generate_chat_input
     )
     
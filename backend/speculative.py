@@ -0,0 +1,77 @@
+"""
+Speculative Decoding with a draft model
+Runs single-sequence generations as HF assisted generation: a small model from the same family
+proposes tokens and the main model verifies them in one forward pass
+"""
+
+import logging
+from typing import Any, Dict, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeDecoder:
+    """
+    Wraps model.generate(assistant_model=draft). Verification keeps the target model's
+    output distribution (greedy output is identical; sampled output has the same
+    distribution), so only latency changes.
+
+    Acceptance is measured with forward hooks: every target forward in assisted decoding
+    verifies one round of drafts and yields the accepted drafts plus one token of its own,
+    so accepted = new tokens - target forwards, and drafted = draft forwards.
+    """
+
+    def __init__(self, model, draft_model, num_assistant_tokens: Optional[int] = None):
+        self.model = model
+        self.draft_model = draft_model
+        if num_assistant_tokens:
+            # Fixed draft length instead of HF's adaptive schedule
+            draft_model.generation_config.num_assistant_tokens = num_assistant_tokens
+            draft_model.generation_config.num_assistant_tokens_schedule = "constant"
+
+        self._target_forwards = 0
+        self._draft_forwards = 0
+        model.register_forward_hook(self._count_target)
+        draft_model.register_forward_hook(self._count_draft)
+
+        self.generations = 0
+        self.new_tokens = 0
+        self.drafted_tokens = 0
+        self.accepted_tokens = 0
+        self.target_steps = 0
+
+    def _count_target(self, module, args, output):
+        self._target_forwards += 1
+
+    def _count_draft(self, module, args, output):
+        self._draft_forwards += 1
+
+    def generate(self, input_ids: torch.LongTensor, **generate_kwargs) -> torch.LongTensor:
+        """model.generate for a single row, drafted by the small model"""
+        if input_ids.shape[0] != 1:
+            raise ValueError("Assisted generation supports a single sequence per call")
+        target_before, draft_before = self._target_forwards, self._draft_forwards
+        sequences = self.model.generate(input_ids=input_ids, assistant_model=self.draft_model, **generate_kwargs)
+
+        new_tokens = sequences.shape[1] - input_ids.shape[1]
+        steps = self._target_forwards - target_before
+        drafted = self._draft_forwards - draft_before
+        self.generations += 1
+        self.new_tokens += new_tokens
+        self.target_steps += steps
+        self.drafted_tokens += drafted
+        self.accepted_tokens += max(0, min(drafted, new_tokens - steps))
+        return sequences
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "generations": self.generations,
+            "new_tokens": self.new_tokens,
+            "drafted_tokens": self.drafted_tokens,
+            "accepted_tokens": self.accepted_tokens,
+            "acceptance_rate": round(self.accepted_tokens / self.drafted_tokens, 3) if self.drafted_tokens else 0.0,
+            # Tokens per target forward: 1.0 means no gain over plain decoding
+            "tokens_per_step": round(self.new_tokens / self.target_steps, 2) if self.target_steps else 0.0,
+        }
@@ -0,0 +1,199 @@
+"""
+Stopping Criteria for batched generation
+Per-row stop strings, sentence limits and repetition-loop detection, so no row decodes
+past the point where its output is already usable
+"""
+
+import re
+import threading
+from typing import List, Optional, Sequence
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+# Request kwargs handled here rather than by generate(); they may differ between rows of one batch
+ROW_STOP_PARAMS = ("stop_sequences", "max_sentences")
+
+# A sentence ends at "!"/"?" or a single "." (not a decimal point like "2.50", not an
+# ellipsis) followed by whitespace or the end of the text so far
+_SENTENCE_END = re.compile(r"(?:[!?]+|(?<![\d.])\.(?!\.))[\"'»”)]*(?=\s|$)")
+
+
+def sentence_end(text: str, max_sentences: int) -> int:
+    """Index just past the max_sentences-th complete sentence, or -1 if there are fewer"""
+    for count, match in enumerate(_SENTENCE_END.finditer(text), start=1):
+        if count >= max_sentences:
+            return match.end()
+    return -1
+
+
+def find_stop(text: str, stop_sequences: Optional[Sequence[str]]) -> int:
+    """
+    Index of the earliest stop sequence, or -1. Matches only count after the first
+    non-whitespace character, so a stop sequence can never empty the output
+    """
+    if not stop_sequences:
+        return -1
+    start = len(text) - len(text.lstrip()) + 1
+    return min((i for i in (text.find(s, start) for s in stop_sequences if s) if i != -1), default=-1)
+
+
+def truncate_at_stop(text: str, stop_sequences: Optional[Sequence[str]]) -> str:
+    """Cut text at the first stop sequence (the stop sequence itself is dropped)"""
+    cut = find_stop(text, stop_sequences)
+    return text if cut == -1 else text[:cut]
+
+
+def partial_stop_length(text: str, stop_sequences: Optional[Sequence[str]]) -> int:
+    """Length of the longest tail of text that a stop sequence starts with (0 if none)"""
+    held = 0
+    for stop in stop_sequences or ():
+        for length in range(min(len(stop) - 1, len(text)), held, -1):
+            if text.endswith(stop[:length]):
+                held = length
+                break
+    return held
+
+
+class StopSequenceFilter:
+    """
+    truncate_at_stop for text arriving in chunks. push() returns the part of the text that
+    can be sent: a tail that could still grow into a stop sequence is held back until the
+    next chunk settles it, and nothing is released once a stop sequence has matched. The
+    chunks released plus flush() add up to truncate_at_stop of the whole text.
+    """
+
+    def __init__(self, stop_sequences: Optional[Sequence[str]]):
+        self.stop_sequences = [s for s in stop_sequences or () if s]
+        self.text = ""
+        self.stopped = False
+        self._sent = 0
+
+    def push(self, chunk: str) -> str:
+        if self.stopped:
+            return ""
+        self.text += chunk
+        cut = find_stop(self.text, self.stop_sequences)
+        if cut != -1:
+            self.stopped = True
+        else:
+            cut = len(self.text) - partial_stop_length(self.text, self.stop_sequences)
+        return self._release(cut)
+
+    def flush(self) -> str:
+        """The held-back tail, once the stream has ended without a stop sequence"""
+        return "" if self.stopped else self._release(len(self.text))
+
+    def _release(self, end: int) -> str:
+        if end <= self._sent:
+            return ""
+        released, self._sent = self.text[self._sent:end], end
+        return released
+
+
+class _RowTextCriteria(StoppingCriteria):
+    """Decodes each row's generated tokens so subclasses can test the text"""
+
+    def __init__(self, tokenizer, prompt_length: Optional[int] = None):
+        self.tokenizer = tokenizer
+        self._prompt_length = prompt_length
+
+    def _generated_texts(self, input_ids: torch.LongTensor) -> List[str]:
+        if self._prompt_length is None:
+            # First call happens right after the first new token is appended (one token per
+            # step; assisted generation can append several, so it passes prompt_length)
+            self._prompt_length = input_ids.shape[1] - 1
+        return self.tokenizer.batch_decode(input_ids[:, self._prompt_length:], skip_special_tokens=True)
+
+
+class StopSequenceCriteria(_RowTextCriteria):
+    """Stops a row once its output contains one of that row's stop sequences"""
+
+    def __init__(self, tokenizer, stop_sequences: List[Optional[Sequence[str]]], prompt_length: Optional[int] = None):
+        super().__init__(tokenizer, prompt_length)
+        self.stop_sequences = [list(s or []) for s in stop_sequences]
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        texts = self._generated_texts(input_ids)
+        done = [find_stop(text, stops) != -1 for text, stops in zip(texts, self.stop_sequences)]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class SentenceLimitCriteria(_RowTextCriteria):
+    """Stops a row as soon as it has completed its max_sentences-th sentence"""
+
+    def __init__(self, tokenizer, max_sentences: List[Optional[int]], prompt_length: Optional[int] = None):
+        super().__init__(tokenizer, prompt_length)
+        self.max_sentences = max_sentences
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        texts = self._generated_texts(input_ids)
+        done = [
+            bool(limit) and sentence_end(text.strip(), limit) != -1
+            for text, limit in zip(texts, self.max_sentences)
+        ]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class RepetitionLoopCriteria(StoppingCriteria):
+    """
+    Stops a row caught in a degenerate loop: the same 1..max_period token pattern repeated
+    at least min_repeats times back to back, covering at least min_span tokens
+    """
+
+    def __init__(self, max_period: int = 8, min_repeats: int = 3, min_span: int = 12, prompt_length: Optional[int] = None):
+        self.max_period = max_period
+        self.min_repeats = min_repeats
+        self.min_span = min_span
+        self._prompt_length = prompt_length
+
+    def _is_looping(self, tokens: List[int]) -> bool:
+        for period in range(1, self.max_period + 1):
+            repeats = max(self.min_repeats, -(-self.min_span // period))
+            span = period * repeats
+            if len(tokens) < span:
+                continue
+            tail = tokens[-span:]
+            if all(tail[i] == tail[i % period] for i in range(period, span)):
+                return True
+        return False
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if self._prompt_length is None:
+            self._prompt_length = input_ids.shape[1] - 1
+        generated = input_ids[:, self._prompt_length:].tolist()
+        return torch.tensor([self._is_looping(row) for row in generated], dtype=torch.bool, device=input_ids.device)
+
+
+class CancellationCriteria(StoppingCriteria):
+    """Stops a row once its caller has gone away; the events are set from the event loop thread"""
+
+    def __init__(self, cancel_events: List[threading.Event]):
+        self.cancel_events = cancel_events
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.tensor([e.is_set() for e in self.cancel_events], dtype=torch.bool, device=input_ids.device)
+
+
+def build_stopping_criteria(
+    tokenizer,
+    stop_sequences: List[Optional[Sequence[str]]],
+    max_sentences: List[Optional[int]],
+    detect_loops: bool = True,
+    cancel_events: Optional[List[threading.Event]] = None,
+    prompt_length: Optional[int] = None,
+) -> StoppingCriteriaList:
+    """
+    Criteria for one generate call; the lists hold one entry per batch row. prompt_length
+    is the (padded) input width, when known before the call
+    """
+    criteria = StoppingCriteriaList()
+    if cancel_events:
+        criteria.append(CancellationCriteria(cancel_events))
+    if any(stop_sequences):
+        criteria.append(StopSequenceCriteria(tokenizer, stop_sequences, prompt_length))
+    if any(max_sentences):
+        criteria.append(SentenceLimitCriteria(tokenizer, max_sentences, prompt_length))
+    if detect_loops:
+        criteria.append(RepetitionLoopCriteria(prompt_length=prompt_length))
+    return criteria
@@ -0,0 +1,250 @@
+"""
+Streaming Speech-to-Text
+Energy-based voice activity detection and per-connection utterance tracking for the voice
+WebSocket: partial transcripts while the learner speaks, the final one at end of utterance
+"""
+
+import asyncio
+import logging
+import math
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+
+class EnergyVAD:
+    """
+    Frame-level speech detector on RMS energy (dBFS) against an adaptive noise floor.
+
+    A frame is speech when it is `margin_db` above the floor (and above `min_db`). Speech
+    starts after `start_ms` of consecutive speech frames and ends after `end_ms` of
+    consecutive non-speech frames. The floor follows the energy of non-speech frames, so a
+    noisy room raises the bar instead of keeping the utterance open.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = SAMPLE_RATE,
+        frame_ms: int = 30,
+        min_db: float = -50.0,
+        margin_db: float = 10.0,
+        start_ms: int = 90,
+        end_ms: int = 500,
+    ):
+        self.frame = sample_rate * frame_ms // 1000
+        self.min_db = min_db
+        self.margin_db = margin_db
+        self.start_frames = max(1, math.ceil(start_ms / frame_ms))
+        self.end_frames = max(1, math.ceil(end_ms / frame_ms))
+        self.noise_floor = min_db - margin_db
+
+        self.in_speech = False
+        self._run = 0
+        self._remainder = np.zeros(0, dtype=np.float32)
+
+    @property
+    def end_samples(self) -> int:
+        """Trailing silence the detector needs before reporting the end of speech"""
+        return self.end_frames * self.frame
+
+    def push(self, samples: np.ndarray) -> List[str]:
+        """Feed samples; returns "start" / "end" events in order"""
+        samples = np.concatenate([self._remainder, samples]) if self._remainder.size else samples
+        usable = samples.size - samples.size % self.frame
+        self._remainder = samples[usable:]
+        events = []
+        for frame in samples[:usable].reshape(-1, self.frame):
+            db = 10 * math.log10(float(np.mean(frame * frame)) + 1e-10)
+            speech = db > max(self.min_db, self.noise_floor + self.margin_db)
+            if not speech:
+                self.noise_floor = 0.95 * self.noise_floor + 0.05 * max(db, -90.0)
+            if speech != self.in_speech:
+                self._run += 1
+                if self._run >= (self.end_frames if self.in_speech else self.start_frames):
+                    self.in_speech = speech
+                    self._run = 0
+                    events.append("start" if speech else "end")
+            else:
+                self._run = 0
+        return events
+
+
+class StreamingTranscriber:
+    """
+    One connection's utterances. push() receives 16 kHz float32 chunks and calls
+    `emit(message)` with:
+
+    - {"type": "speech_start"} when the VAD opens an utterance (`pre_roll_seconds` of audio
+      before that point are kept so the first syllable is not clipped);
+    - {"type": "partial", "text"} every `partial_interval` seconds of speech, transcribing the
+      utterance so far in the background (one at a time; skipped while one is running);
+    - {"type": "final", "text", "language", "duration"} once the VAD reports end of speech,
+      the utterance reaches `max_utterance_seconds`, or flush() is called.
+
+    `transcribe(audio, partial)` returns a Whisper-style result dict. A final whose audio was
+    already fully covered by the last partial reuses that partial instead of decoding again,
+    so it is sent the moment the VAD closes the utterance. Finals may decode concurrently but
+    are emitted in utterance order: each one waits for the previous final before sending.
+    """
+
+    def __init__(
+        self,
+        transcribe: Callable[[np.ndarray, bool], Awaitable[Dict[str, Any]]],
+        emit: Callable[[Dict[str, Any]], Awaitable[None]],
+        vad: Optional[EnergyVAD] = None,
+        partial_interval: float = 1.0,
+        max_utterance_seconds: float = 30.0,
+        pre_roll_seconds: float = 0.3,
+    ):
+        self.transcribe = transcribe
+        self.emit = emit
+        self.vad = vad or EnergyVAD()
+        self.partial_samples = int(partial_interval * SAMPLE_RATE)
+        self.max_samples = int(max_utterance_seconds * SAMPLE_RATE)
+
+        self._pre_roll: deque = deque()
+        self._pre_roll_samples = 0
+        self._pre_roll_max = int(pre_roll_seconds * SAMPLE_RATE)
+        self._utterance: List[np.ndarray] = []
+        self._utterance_samples = 0
+        self._utterance_id = 0
+        self._next_partial_at = 0
+
+        self._partial_task: Optional[asyncio.Task] = None
+        self._partial_covers = 0
+        # (utterance id, samples covered, result) of the newest completed partial
+        self._last_partial: Optional[tuple] = None
+        # The newest utterance's final, which the next final is sent after
+        self._last_final: Optional[asyncio.Task] = None
+        self._tasks: set = set()
+
+        self.utterances = 0
+        self.partials = 0
+        self.reused_partials = 0
+
+    @property
+    def in_utterance(self) -> bool:
+        return bool(self._utterance)
+
+    async def push(self, samples: np.ndarray):
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1)
+        events = self.vad.push(samples)
+
+        if not self.in_utterance and "start" not in events:
+            self._keep_pre_roll(samples)
+            return
+        if not self.in_utterance:
+            self._utterance = list(self._pre_roll)
+            self._utterance_samples = self._pre_roll_samples
+            self._pre_roll.clear()
+            self._pre_roll_samples = 0
+            self._utterance_id += 1
+            self._next_partial_at = self._utterance_samples + self.partial_samples
+            await self.emit({"type": "speech_start"})
+
+        self._utterance.append(samples)
+        self._utterance_samples += samples.size
+
+        if "end" in events and not self.vad.in_speech:
+            self._finalize(speech_end=self._utterance_samples - self.vad.end_samples)
+        elif self._utterance_samples >= self.max_samples:
+            self._finalize(speech_end=self._utterance_samples)
+        elif self._utterance_samples >= self._next_partial_at and (self._partial_task is None or self._partial_task.done()):
+            self._next_partial_at = self._utterance_samples + self.partial_samples
+            self._partial_covers = self._utterance_samples
+            self._partial_task = self._spawn(self._partial(self._utterance_id, self._snapshot()))
+
+    async def flush(self):
+        """End the current utterance now (the client stopped recording) and wait for its final"""
+        if self.in_utterance:
+            self._finalize(speech_end=self._utterance_samples)
+        await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"utterances": self.utterances, "partials": self.partials, "reused_partials": self.reused_partials}
+
+    def _keep_pre_roll(self, samples: np.ndarray):
+        self._pre_roll.append(samples)
+        self._pre_roll_samples += samples.size
+        while self._pre_roll and self._pre_roll_samples - self._pre_roll[0].size >= self._pre_roll_max:
+            self._pre_roll_samples -= self._pre_roll.popleft().size
+
+    def _snapshot(self) -> np.ndarray:
+        return np.concatenate(self._utterance) if self._utterance else np.zeros(0, dtype=np.float32)
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _finalize(self, speech_end: int):
+        audio = self._snapshot()
+        self._utterance = []
+        self._utterance_samples = 0
+        self.utterances += 1
+        # A partial still decoding that already covers all the speech will serve as the final
+        pending = None
+        if self._partial_task is not None and not self._partial_task.done() and self._partial_covers >= speech_end:
+            pending = self._partial_task
+        self._last_final = self._spawn(self._final(self._utterance_id, audio, speech_end, pending, self._last_final))
+
+    async def _partial(self, utterance_id: int, audio: np.ndarray):
+        try:
+            result = await self.transcribe(audio, True)
+        except Exception as e:
+            # Partials are best effort (shed first under load); the final still comes
+            logger.debug(f"[StreamingSTT] Partial skipped: {e}")
+            return
+        self._last_partial = (utterance_id, audio.size, result)
+        if utterance_id == self._utterance_id and self.in_utterance:
+            self.partials += 1
+            await self.emit({"type": "partial", "text": result.get("text", "").strip()})
+
+    def _reusable_partial(self, utterance_id: int, speech_end: int) -> Optional[Dict[str, Any]]:
+        last = self._last_partial
+        if last is not None and last[0] == utterance_id and last[1] >= speech_end:
+            return last[2]
+        return None
+
+    async def _final(
+        self,
+        utterance_id: int,
+        audio: np.ndarray,
+        speech_end: int,
+        pending: Optional[asyncio.Task],
+        previous: Optional[asyncio.Task],
+    ):
+        if pending is not None:
+            await asyncio.gather(pending, return_exceptions=True)
+        result = self._reusable_partial(utterance_id, speech_end)
+        message = None
+        if result is not None:
+            self.reused_partials += 1
+        else:
+            try:
+                result = await self.transcribe(audio, False)
+            except Exception as e:
+                logger.error(f"[StreamingSTT] Final transcription failed: {e}")
+                message = {"type": "error", "detail": "Transcription failed"}
+        if message is None:
+            message = {
+                "type": "final",
+                "text": result.get("text", "").strip(),
+                "language": result.get("language"),
+                "duration": round(audio.size / SAMPLE_RATE, 2),
+            }
+        if previous is not None:
+            # A slower earlier utterance (e.g. waiting on its partial) is sent first
+            await asyncio.gather(previous, return_exceptions=True)
+        await self.emit(message)
@@ -0,0 +1,198 @@
+"""
+Speech-to-Text Backends
+One transcribe() interface over openai-whisper (PyTorch) and faster-whisper (CTranslate2,
+int8 on CPU or float16 on GPU), selected with STT_BACKEND
+"""
+
+import logging
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch
+import whisper
+from whisper.audio import N_SAMPLES
+
+from model_loader import load_whisper
+
+logger = logging.getLogger(__name__)
+
+STT_BACKENDS = ("openai-whisper", "faster-whisper")
+
+SAMPLE_RATE = 16000
+# openai-whisper transcribe() defaults: a window failing these is decoded again at a higher temperature,
+# one below NO_SPEECH_THRESHOLD (and the logprob threshold) is treated as silence
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+# transcribe() options that do not change a single-window greedy decode
+BATCHABLE_OPTIONS = {"temperature", "condition_on_previous_text"}
+
+
+class STTBackend:
+    """
+    Interface used by the transcription paths and warm-up.
+
+    transcribe() takes 16 kHz mono float32 samples and returns an openai-whisper style
+    result: {"text", "language", "segments": [{"start", "end", "text", "avg_logprob",
+    "no_speech_prob"}, ...]}. It is blocking: run it in an executor.
+    """
+
+    name = "base"
+    device = "cpu"
+    # Whether transcribe_batch decodes several clips in one pass (otherwise it loops)
+    batched_decoding = False
+
+    def transcribe(self, audio: np.ndarray, language: Optional[str] = None, **options) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def transcribe_batch(self, audios: List[np.ndarray], language: Optional[str] = None, **options) -> List[Dict[str, Any]]:
+        """transcribe() for several clips; backends that can decode them together override this"""
+        return [self.transcribe(audio, language=language, **dict(options)) for audio in audios]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "device": self.device, "batched_decoding": self.batched_decoding}
+
+
+class OpenAIWhisperBackend(STTBackend):
+    """openai-whisper on PyTorch, on the GPU when there is one"""
+
+    name = "openai-whisper"
+    batched_decoding = True
+
+    def __init__(self, model):
+        self.model = model
+        self.device = str(model.device)
+
+    def transcribe(self, audio: np.ndarray, language: Optional[str] = None, **options) -> Dict[str, Any]:
+        return self.model.transcribe(audio, language=language, **options)
+
+    def transcribe_batch(self, audios: List[np.ndarray], language: Optional[str] = None, **options) -> List[Dict[str, Any]]:
+        """
+        Clips that fit in one 30 s window are padded to it and decoded together: one encoder
+        pass and one greedy decode loop for the whole batch (languages are detected per clip
+        when `language` is None). A clip whose batched result trips transcribe()'s
+        compression/logprob thresholds, longer clips, and non-greedy options go through
+        transcribe() on their own, so results match it apart from segment timestamps.
+        """
+        temperature = options.get("temperature", 0.0)
+        greedy = set(options) <= BATCHABLE_OPTIONS and (
+            temperature == 0 or (isinstance(temperature, (tuple, list)) and temperature and temperature[0] == 0)
+        )
+        batched = [i for i, audio in enumerate(audios) if greedy and audio.size <= N_SAMPLES]
+        results: List[Optional[Dict[str, Any]]] = [None] * len(audios)
+
+        if len(batched) > 1:
+            mel = torch.stack([
+                whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(audios[i])), n_mels=self.model.dims.n_mels)
+                for i in batched
+            ]).to(self.model.device)
+            fp16 = self.model.device.type == "cuda"
+            decoded = whisper.decode(
+                self.model, mel, whisper.DecodingOptions(language=language, without_timestamps=True, fp16=fp16)
+            )
+            for i, result in zip(batched, decoded):
+                results[i] = self._as_transcription(result, audios[i].size / SAMPLE_RATE)
+
+        for i, audio in enumerate(audios):
+            if results[i] is None:
+                results[i] = self.transcribe(audio, language=language, **dict(options))
+        return results
+
+    @staticmethod
+    def _as_transcription(result, duration: float) -> Optional[Dict[str, Any]]:
+        """A transcribe()-shaped dict for one window, or None when transcribe() would retry it"""
+        silent = result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD
+        if not silent and (result.compression_ratio > COMPRESSION_RATIO_THRESHOLD or result.avg_logprob < LOGPROB_THRESHOLD):
+            return None
+        segments = [] if silent else [{
+            "id": 0,
+            "start": 0.0,
+            "end": round(duration, 2),
+            "text": result.text,
+            "tokens": result.tokens,
+            "temperature": result.temperature,
+            "avg_logprob": result.avg_logprob,
+            "compression_ratio": result.compression_ratio,
+            "no_speech_prob": result.no_speech_prob,
+        }]
+        return {
+            "text": "" if silent else result.text,
+            "language": result.language,
+            "segments": segments,
+            "duration": duration,
+        }
+
+
+class FasterWhisperBackend(STTBackend):
+    """
+    faster-whisper (CTranslate2). Greedy decoding by default like openai-whisper's
+    transcribe(); pass beam_size= for beam search.
+
+    transcribe_batch() decodes the clips one after another. faster-whisper's
+    BatchedInferencePipeline batches the VAD chunks of one long recording, not separate
+    utterances, so the STT batcher only buys fair ordering and shedding on this backend.
+    """
+
+    name = "faster-whisper"
+
+    def __init__(self, model, device: str, compute_type: str):
+        self.model = model
+        self.device = device
+        self.compute_type = compute_type
+        logger.info("[STT] faster-whisper transcribes batched utterances one at a time (no cross-request batching)")
+
+    def transcribe(self, audio: np.ndarray, language: Optional[str] = None, **options) -> Dict[str, Any]:
+        options.setdefault("beam_size", 1)
+        segments, info = self.model.transcribe(audio, language=language, **options)
+        # segments is a generator: decoding happens while it is consumed
+        segments = [
+            {
+                "id": i,
+                "start": segment.start,
+                "end": segment.end,
+                "text": segment.text,
+                "avg_logprob": segment.avg_logprob,
+                "no_speech_prob": segment.no_speech_prob,
+            }
+            for i, segment in enumerate(segments)
+        ]
+        return {
+            "text": "".join(segment["text"] for segment in segments),
+            "language": info.language,
+            "segments": segments,
+            "duration": info.duration,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "device": self.device, "compute_type": self.compute_type, "batched_decoding": self.batched_decoding}
+
+
+def load_stt_backend(
+    backend: str,
+    model_name: str,
+    device: str = "auto",
+    compute_type: str = "auto",
+    cpu_threads: Optional[int] = None,
+) -> STTBackend:
+    """
+    Load the selected STT backend. Blocking: run it in an executor.
+    device "auto" is CUDA when available; compute_type "auto" is float16 on CUDA and int8
+    on CPU (faster-whisper only; openai-whisper runs in its own default precision).
+    """
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    if backend == "faster-whisper":
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError as e:
+            raise RuntimeError("STT_BACKEND=faster-whisper needs the faster-whisper package: pip install faster-whisper") from e
+        if compute_type == "auto":
+            compute_type = "float16" if device == "cuda" else "int8"
+        model = WhisperModel(model_name, device=device, compute_type=compute_type, cpu_threads=cpu_threads or 0)
+        logger.info(f"✅ faster-whisper '{model_name}' loaded on {device} ({compute_type})")
+        return FasterWhisperBackend(model, device, compute_type)
+
+    if backend != "openai-whisper":
+        raise ValueError(f"Unknown STT backend '{backend}' (expected one of {', '.join(STT_BACKENDS)})")
+    return OpenAIWhisperBackend(load_whisper(model_name, device))
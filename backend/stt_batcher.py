@@ -0,0 +1,101 @@
+"""
+Speech-to-Text Batcher
+Collects utterances from every voice handler into one queue and transcribes them as padded
+batches on the STT backend, instead of one model.transcribe call per request thread
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from admission import PRIORITY_INTERACTIVE
+from batching_queue import BatchingQueue
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TranscriptionRequest:
+    """An utterance waiting for transcription, resolved through its future"""
+    audio: np.ndarray
+    language: Optional[str]
+    options: Dict[str, Any]
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+    priority: int = PRIORITY_INTERACTIVE
+    user: Optional[str] = None
+
+    def batch_key(self) -> Tuple:
+        """Utterances can share a batch when the language and decoding options match"""
+        return (self.language, tuple(sorted((k, repr(v)) for k, v in self.options.items())))
+
+
+class STTBatcher(BatchingQueue):
+    """
+    Batches transcriptions in front of the STT backend.
+
+    Handlers await `transcribe()`. A single worker task drains the queue: it waits up to
+    `batch_wait_ms` for concurrent utterances to arrive, takes the one due next plus every
+    compatible one (same language and options) up to `max_batch_size`, and runs them through
+    `backend.transcribe_batch` in one executor job, so the encoder and decoder see the whole
+    batch at once. Results go back to each waiting handler through its future.
+
+    The queue (batching_queue.BatchingQueue, shared with the LLM scheduler) is served in
+    admission.fair_order and holds at most `max_queue_depth` utterances; lower classes
+    (e.g. streaming partials) are shed first with QueueFullError.
+    """
+
+    def __init__(
+        self,
+        get_backend: Callable[[], Awaitable[Any]],
+        max_batch_size: int = 8,
+        batch_wait_ms: float = 20.0,
+        max_queue_depth: int = 16,
+        aging_seconds: float = 10.0,
+    ):
+        super().__init__(max_batch_size, batch_wait_ms, max_queue_depth, aging_seconds)
+        # Awaited on every step so the model can be loaded lazily on first use
+        self._get_backend = get_backend
+
+        self.total_batches = 0
+        self.total_utterances = 0
+        self.max_observed_batch = 0
+
+    async def transcribe(self, audio: np.ndarray, language: Optional[str] = None, **options) -> Dict[str, Any]:
+        """Queue 16 kHz float32 samples and wait for the Whisper-style result"""
+        request = TranscriptionRequest(
+            audio=np.asarray(audio, dtype=np.float32).reshape(-1),
+            language=language or None,
+            options=options,
+            future=self._new_future(),
+        )
+        self._enqueue(request)
+        return await request.future
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queued(),
+            "running": self._running,
+            "batches": self.total_batches,
+            "utterances": self.total_utterances,
+            "avg_batch_size": round(self.total_utterances / self.total_batches, 2) if self.total_batches else 0.0,
+            "max_batch_size_seen": self.max_observed_batch,
+            "cancelled": self.total_cancelled,
+            "shed": self.total_shed,
+            "avg_step_seconds": round(self._step_seconds, 3),
+        }
+
+    async def _process_batch(self, batch: List[TranscriptionRequest]) -> List[Dict[str, Any]]:
+        backend = await self._get_backend()
+        first = batch[0]
+        results = await self._loop.run_in_executor(
+            None, lambda: backend.transcribe_batch([r.audio for r in batch], language=first.language, **first.options)
+        )
+        self.total_batches += 1
+        self.total_utterances += len(batch)
+        self.max_observed_batch = max(self.max_observed_batch, len(batch))
+        return results
@@ -0,0 +1,300 @@
+import asyncio
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+import torch
+
+from admission import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, QueueFullError, WorkContext, current_work
+from inference_scheduler import InferenceScheduler
+from json_constraint import JSONSchemaConstraint
+from model_loader import prepare_for_batching
+from prefix_cache import PrefixKVCache
+from stopping_criteria import StopSequenceCriteria, StopSequenceFilter, find_stop, sentence_end, truncate_at_stop
+
+# --- FIXTURES ---
+
+CHAT_TEMPLATE = (
+    "{{ bos_token }}{% for m in messages %}<|start_header_id|>{{ m['role'] }}<|end_header_id|>\n\n"
+    "{{ m['content'] }}<|eot_id|>{% endfor %}"
+    "{% if add_generation_prompt %}<|start_header_id|>assistant<|end_header_id|>\n\n{% endif %}"
+)
+
+def build_tiny_llm(seed: int = 0, hidden_size: int = 32):
+    """A few-hundred-token BPE tokenizer with Llama 3 special tokens and a random 2-layer Llama"""
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast, pipeline
+
+    bpe = Tokenizer(models.BPE(unk_token="<unk>"))
+    bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = decoders.ByteLevel()
+    corpus = ['{"thought": "ok", "scene_status": "ACTIVE", "reply": "Ciao! Come stai?"}', "Hello there. Yes no YES NO. Mi chiamo Luca."] * 50
+    bpe.train_from_iterator(corpus, trainers.BpeTrainer(
+        vocab_size=400,
+        special_tokens=["<unk>", "<|begin_of_text|>", "<|eot_id|>", "<|start_header_id|>", "<|end_header_id|>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    ))
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=bpe, bos_token="<|begin_of_text|>", eos_token="<|eot_id|>", unk_token="<unk>")
+    tokenizer.chat_template = CHAT_TEMPLATE
+
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=len(tokenizer), hidden_size=hidden_size, intermediate_size=2 * hidden_size, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=512,
+        bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id,
+    )
+    model = LlamaForCausalLM(config).eval()
+    pipe = pipeline("text-generation", model=model, tokenizer=tokenizer, device=-1)
+    prepare_for_batching(tokenizer, pipe)
+    return tokenizer, model, pipe
+
+@pytest.fixture(scope="module")
+def tiny_llm():
+    return build_tiny_llm()
+
+GOAL_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "status": {"enum": ["YES", "NO"]},
+        "reason": {"type": "string", "maxLength": 12},
+    },
+}
+
+# --- SCHEDULER ---
+
+@pytest.mark.asyncio
+async def test_requests_with_different_sampling_share_one_batch(tiny_llm):
+    """A greedy 3-token request and a sampled 6-token one run as rows of the same generate step."""
+    tokenizer, model, pipe = tiny_llm
+    scheduler = InferenceScheduler(lambda: pipe, max_batch_size=4, batch_wait_ms=50)
+    steps = []
+    generate = model.generate
+
+    def spy(*args, **kwargs):
+        out = generate(*args, **kwargs)
+        steps.append((kwargs.get("input_ids", args[0] if args else None), out))
+        return out
+
+    with patch.object(model, "generate", spy):
+        await asyncio.gather(
+            scheduler.submit("Hello there.", max_new_tokens=3, do_sample=False),
+            scheduler.submit("Mi chiamo Luca.", max_new_tokens=6, do_sample=True, temperature=0.7),
+        )
+    stats = scheduler.stats()
+    assert stats["batches"] == 1 and stats["sequences"] == 2
+    assert len(steps) == 1
+    prompt, out = steps[0]
+    sequences = out if isinstance(out, torch.Tensor) else out.sequences
+    new_tokens = sequences[:, prompt.shape[1]:]
+    # Each row stops at its own max_new_tokens; the shorter row is padded after that
+    assert new_tokens.shape[1] <= 6
+    assert (new_tokens[0, 3:] == tokenizer.pad_token_id).all()
+
+@pytest.mark.asyncio
+async def test_low_priority_submit_is_shed_when_its_share_is_full(tiny_llm):
+    """Background work is refused with QueueFullError while interactive work still gets queued."""
+    _, _, pipe = tiny_llm
+    scheduler = InferenceScheduler(lambda: pipe, max_queue_depth=4, batch_wait_ms=200)
+    current_work.set(WorkContext(PRIORITY_INTERACTIVE, "a"))
+    queued = asyncio.ensure_future(scheduler.submit("Hello there.", max_new_tokens=2))
+    await asyncio.sleep(0)
+    assert scheduler.queued() == 1
+
+    current_work.set(WorkContext(PRIORITY_BACKGROUND, "b"))
+    with pytest.raises(QueueFullError) as shed:
+        await scheduler.submit("Hello there.", max_new_tokens=2)
+    assert shed.value.retry_after > 0
+    assert scheduler.stats()["shed"] == 1
+
+    current_work.set(WorkContext(PRIORITY_INTERACTIVE, "b"))
+    await asyncio.gather(queued, scheduler.submit("Hello there.", max_new_tokens=2))
+
+@pytest.mark.asyncio
+async def test_single_request_is_drafted_when_a_draft_model_is_attached(tiny_llm):
+    """With a draft model attached, a lone greedy request goes through assisted decoding and keeps the target's output."""
+    from speculative import SpeculativeDecoder
+
+    tokenizer, model, pipe = tiny_llm
+    _, draft, _ = build_tiny_llm(seed=1, hidden_size=16)
+    prompt = tokenizer.apply_chat_template([{"role": "user", "content": "Mi chiamo Luca."}], tokenize=False, add_generation_prompt=True)
+
+    plain = await InferenceScheduler(lambda: pipe).submit(prompt, max_new_tokens=8, do_sample=False)
+    scheduler = InferenceScheduler(lambda: pipe)
+    scheduler.speculative = SpeculativeDecoder(model, draft, num_assistant_tokens=3)
+    drafted = await scheduler.submit(prompt, max_new_tokens=8, do_sample=False)
+
+    stats = scheduler.speculative.stats()
+    assert stats["generations"] == 1 and stats["drafted_tokens"] > 0
+    assert drafted == plain
+
+def test_draft_vocab_check_ignores_special_tokens(tiny_llm):
+    """A draft tokenizer with different added tokens passes; a different embedding size or regular token id does not."""
+    from model_loader import draft_vocab_mismatch
+
+    tokenizer, model, _ = tiny_llm
+    draft_tokenizer = build_tiny_llm()[0]
+    draft_tokenizer.add_special_tokens({"additional_special_tokens": ["<|reserved_special_token_0|>"]})
+    size = model.config.vocab_size
+    assert draft_vocab_mismatch(draft_tokenizer, size, tokenizer, size) is None
+    assert "vocab_size" in draft_vocab_mismatch(draft_tokenizer, size + 1, tokenizer, size)
+
+    swapped = MagicMock()
+    vocab = dict(tokenizer.get_vocab())
+    regular = [t for t in vocab if t not in tokenizer.get_added_vocab()]
+    vocab[regular[0]], vocab[regular[1]] = vocab[regular[1]], vocab[regular[0]]
+    swapped.get_vocab.return_value = vocab
+    assert "regular tokens" in draft_vocab_mismatch(swapped, size, tokenizer, size)
+
+# --- STOPPING ---
+
+def test_stop_sequences_truncate_output():
+    """Output is cut before the first stop string, but a stop string can never empty it."""
+    assert truncate_at_stop("Ciao!\nUser: hi", ["\nUser:", "###"]) == "Ciao!"
+    assert truncate_at_stop("###Ciao", ["###"]) == "###Ciao"
+    assert find_stop("no stop here", ["###"]) == -1
+    assert sentence_end("Costa 2.50 euro. Grazie! Altro?", 2) == len("Costa 2.50 euro. Grazie!")
+    assert sentence_end("Solo una frase.", 2) == -1
+
+def test_stop_sequence_filter_holds_back_a_possible_stop():
+    """Chunks that might begin a stop string are held until it matches (and is cut) or is ruled out."""
+    stops = StopSequenceFilter(["\nCORRECTED:"])
+    assert [stops.push(c) for c in ("Bravo!", "\nCORR", "ECT", "ED: x", " more")] == ["Bravo!", "", "", "", ""]
+    assert stops.flush() == ""
+
+    stops = StopSequenceFilter(["\nCORRECTED:"])
+    assert [stops.push(c) for c in ("Bravo!", "\nCO", "me stai?", "\n")] == ["Bravo!", "", "\nCOme stai?", ""]
+    assert stops.flush() == "\n"
+
+@pytest.mark.asyncio
+async def test_stream_stops_at_stop_sequence_like_submit(tiny_llm):
+    """A streamed reply never shows the stop string or anything after it."""
+    _, _, pipe = tiny_llm
+    scheduler = InferenceScheduler(lambda: pipe)
+    full = await scheduler.submit("Hello there.", max_new_tokens=12, do_sample=False)
+    stop = full[len(full) // 2:len(full) // 2 + 2]
+    expected = truncate_at_stop(full, [stop])
+    assert expected != full
+
+    chunks = [c async for c in scheduler.stream("Hello there.", max_new_tokens=12, do_sample=False, stop_sequences=[stop])]
+    assert "".join(chunks) == expected
+    assert await scheduler.submit("Hello there.", max_new_tokens=12, do_sample=False, stop_sequences=[stop]) == expected
+
+def test_stop_sequence_criteria_is_per_row(tiny_llm):
+    """Only the row whose own stop sequence appeared is marked done."""
+    tokenizer, _, _ = tiny_llm
+    prompt = tokenizer("Hello", add_special_tokens=False).input_ids
+    rows = [prompt + tokenizer(text, add_special_tokens=False).input_ids for text in (" YES NO", " YES NO")]
+    input_ids = torch.tensor(rows)
+    criteria = StopSequenceCriteria(tokenizer, [["NO"], ["Luca"]], prompt_length=len(prompt))
+    assert criteria(input_ids, None).tolist() == [True, False]
+
+# --- JSON SCHEMA FSM ---
+
+def test_json_constraint_accepts_the_schema_and_rejects_everything_else(tiny_llm):
+    """The automaton walks a valid object to the end state and refuses bad enums, overlong strings and extra text."""
+    tokenizer, _, _ = tiny_llm
+    constraint = JSONSchemaConstraint(GOAL_SCHEMA, tokenizer)
+    start = constraint.initial_state()
+
+    valid = json.dumps({"status": "YES", "reason": "ordered"})
+    assert constraint.is_done(constraint.advance(start, valid))
+
+    assert constraint.advance(start, '{"status": "MAYBE"') is None
+    assert constraint.advance(start, '{"status": "NO", "reason": "' + "x" * 13) is None
+    assert constraint.advance(start, '{"reason"') is None
+    assert constraint.advance(constraint.advance(start, valid), " ") is None
+
+    # Only tokens that can start the object are allowed first; only end-of-turn once it is closed
+    first = constraint.allowed_mask(start).nonzero().flatten().tolist()
+    assert first and all(constraint.texts[i].startswith("{") for i in first)
+    end = constraint.allowed_mask(constraint.advance(start, valid)).nonzero().flatten().tolist()
+    assert end == [tokenizer.convert_tokens_to_ids("<|eot_id|>")]
+
+# --- YES/NO CLASSIFIER ---
+
+def test_yes_no_classifier_matches_full_forward_pass(tiny_llm):
+    """P(YES) from the last hidden state equals the pooled YES-vs-NO softmax of a full forward pass, per row."""
+    from llm_classifier import YesNoClassifier
+
+    tokenizer, model, _ = tiny_llm
+    classifier = YesNoClassifier(model, tokenizer)
+    prompts = [
+        tokenizer.apply_chat_template([{"role": "user", "content": text}], tokenize=False, add_generation_prompt=True)
+        for text in ("Mi chiamo Luca. YES or NO?", "Hello")
+    ]
+    scores = classifier.classify(prompts)
+
+    for prompt, score in zip(prompts, scores):
+        ids = tokenizer(prompt, return_tensors="pt", add_special_tokens=False).input_ids
+        with torch.no_grad():
+            logits = model(input_ids=ids).logits[0, -1].float()
+        yes = torch.logsumexp(logits[classifier.yes_ids], dim=-1)
+        no = torch.logsumexp(logits[classifier.no_ids], dim=-1)
+        assert score == pytest.approx(torch.sigmoid(yes - no).item(), abs=1e-4)
+
+# --- PREFIX KV-CACHE ---
+
+def _kv_bytes_per_token(model):
+    config = model.config
+    head_dim = config.hidden_size // config.num_attention_heads
+    return 2 * config.num_hidden_layers * config.num_key_value_heads * head_dim * model.dtype.itemsize
+
+def _greedy(model, tokenizer, ids, max_new_tokens=8):
+    input_ids = torch.tensor([ids])
+    with torch.no_grad():
+        out = model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), max_new_tokens=max_new_tokens,
+                             do_sample=False, pad_token_id=tokenizer.pad_token_id)
+    return tokenizer.decode(out[0, len(ids):], skip_special_tokens=True)
+
+def test_prefix_cache_reuses_system_block_and_earlier_turns(tiny_llm):
+    """A shared system block and a conversation's previous prompt are hits, and greedy output matches an uncached generate."""
+    tokenizer, model, _ = tiny_llm
+    cache = PrefixKVCache(model, tokenizer, max_bytes=1 << 30, min_prefix_tokens=4)
+    system = {"role": "system", "content": "You are Luca. Mi chiamo Luca."}
+    first = tokenizer.apply_chat_template([system, {"role": "user", "content": "Hello there."}], add_generation_prompt=True)
+
+    assert cache.generate("", input_ids=first, max_new_tokens=8, do_sample=False) == _greedy(model, tokenizer, first)
+    assert cache.stats()["misses"] == 1 and cache.stats()["entries"] == 2
+
+    other_user = tokenizer.apply_chat_template([system, {"role": "user", "content": "YES or NO?"}], add_generation_prompt=True)
+    assert cache.generate("", input_ids=other_user, max_new_tokens=8, do_sample=False) == _greedy(model, tokenizer, other_user)
+    boundary = first.index(tokenizer.convert_tokens_to_ids("<|eot_id|>")) + 1
+    assert cache.stats()["hits"] == 1 and cache.stats()["reused_tokens"] == boundary
+
+    next_turn = first + tokenizer("Ciao! Come stai?", add_special_tokens=False).input_ids
+    assert cache.generate("", input_ids=next_turn, max_new_tokens=8, do_sample=False) == _greedy(model, tokenizer, next_turn)
+    assert cache.stats()["hits"] == 2 and cache.stats()["reused_tokens"] == boundary + len(first)
+
+def test_prefix_cache_evicts_least_recently_used_entries(tiny_llm):
+    """Past max_entries the least recently used prompt goes first; a lookup refreshes an entry."""
+    tokenizer, model, _ = tiny_llm
+    cache = PrefixKVCache(model, tokenizer, max_bytes=1 << 30, max_entries=2, min_prefix_tokens=2)
+    # No end-of-turn token in these prompts, so each generation stores one entry
+    a, b, c = (tokenizer(text, add_special_tokens=False).input_ids for text in ("Hello there.", "Mi chiamo Luca.", "YES no YES NO."))
+
+    # a is looked up again before c arrives, so b is the one evicted
+    for ids in (a, b, a, c):
+        cache.generate("", input_ids=ids, max_new_tokens=1, do_sample=False)
+    assert cache.stats()["entries"] == 2 and cache.stats()["misses"] == 3
+    cache.generate("", input_ids=a, max_new_tokens=1, do_sample=False)
+    assert cache.stats()["misses"] == 3
+    cache.generate("", input_ids=b, max_new_tokens=1, do_sample=False)
+    assert cache.stats()["misses"] == 4
+
+def test_prefix_cache_stays_within_its_byte_budget(tiny_llm):
+    """Entries are evicted oldest first once their KV bytes exceed max_bytes; one larger than the budget is never stored."""
+    tokenizer, model, _ = tiny_llm
+    a, b = (tokenizer(text, add_special_tokens=False).input_ids for text in ("Hello there.", "Mi chiamo Luca."))
+    per_token = _kv_bytes_per_token(model)
+    cache = PrefixKVCache(model, tokenizer, max_bytes=per_token * max(len(a), len(b)), min_prefix_tokens=2)
+
+    cache.generate("", input_ids=a, max_new_tokens=1, do_sample=False)
+    cache.generate("", input_ids=b, max_new_tokens=1, do_sample=False)
+    assert cache.stats()["entries"] == 1
+    cache.generate("", input_ids=b + b[-1:], max_new_tokens=1, do_sample=False)
+    cache.generate("", input_ids=a + a[-1:], max_new_tokens=1, do_sample=False)
+    assert cache.stats()["hits"] == 1
+
+    cache.clear()
+    cache.generate("", input_ids=a + b + a, max_new_tokens=1, do_sample=False)
+    assert cache.stats()["entries"] == 0
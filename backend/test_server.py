@@ -1,6 +1,20 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import numpy as np
 import pytest
 from httpx import AsyncClient, ASGITransport
+from starlette.testclient import TestClient
 from server import app, LESSON_CONCEPTS, CONTENT_DB
+from server import TutorRequest, run_practice_turn, should_check_goal, transcribe_samples, tutor_mode_stream
+from admission import QueueFullError
+from history_manager import MESSAGE_OVERHEAD_TOKENS, HistoryManager
+from json_constraint import max_output_length
+from model_registry import ModelRegistry
+from practice_mode import PRACTICE_TURN_SCHEMA
+from scenario_templates import get_scenario_template, missing_preconditions
+from streaming_stt import StreamingTranscriber
 from unittest.mock import patch, MagicMock, AsyncMock
 
 # --- FIXTURES ---
@@ -29,7 +43,9 @@ def mock_ai():
          patch("server.tokenizer") as mock_tok: 
         
         # 1. Mock the AI output so the server doesn't crash
-        mock_gen.return_value = [{"generated_text": "Ciao! Come ti chiami?"}]
+        # (a list of prompts is a batch from the scheduler: one result list per prompt)
+        reply = [{"generated_text": "Ciao! Come ti chiami?"}]
+        mock_gen.side_effect = lambda prompts, **kwargs: [reply for _ in prompts] if isinstance(prompts, list) else reply
         
         # 2. Mock the tokenizer to return the raw input prompt
         # (This allows us to inspect what was sent to the AI in our tests)
@@ -212,4 +228,310 @@ async def test_lesson_goal_is_applied(lesson_id, mock_mongo, mock_ai):
                 break
         
         assert found_keyword, \
-            f"FAILED: Lesson {lesson_id} prompt missing keywords. Prompt dump: {all_prompts_sent[:100]}..."
\ No newline at end of file
+            f"FAILED: Lesson {lesson_id} prompt missing keywords. Prompt dump: {all_prompts_sent[:100]}..."
+
+# --- SERVING AND LOAD SHEDDING TESTS ---
+
+@pytest.mark.asyncio
+async def test_ready_reports_components():
+    """Readiness lists every component and is 503 until all of them have settled."""
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response = await ac.get("/ready")
+    data = response.json()
+    assert set(data["components"]) == {"db", "llm", "whisper", "tts"}
+    assert response.status_code == (200 if data["ready"] else 503)
+
+@pytest.mark.asyncio
+async def test_low_priority_work_is_shed_when_queue_is_full():
+    """Reports get 503 + Retry-After at the door when their share of the GPU queue is full."""
+    with patch("server.llm_backend.retry_after", side_effect=lambda priority: 2.0 if priority >= 3 else None):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            response = await ac.post("/api/practice/post-game-report", json={})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "2"
+
+@pytest.mark.asyncio
+async def test_tutor_returns_503_when_a_generation_is_shed(mock_ai):
+    """A QueueFullError from one of the gathered calls becomes 503 + Retry-After, not an error reply."""
+    async def shed(*args, **kwargs):
+        raise QueueFullError(2.0)
+
+    backend = MagicMock(generate=shed, classify=AsyncMock(return_value=0.0))
+    payload = {"user_message": "Ciao", "chat_history": [], "target_language": "it", "native_language": "en", "level": "A1"}
+    with patch("server.is_loading", False), patch("server.model_router.backend", return_value=backend), \
+         patch("server.cached_generate", AsyncMock(return_value="NO_ERROR")):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            response = await ac.post("/tutor", json=payload)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "2"
+
+@pytest.mark.asyncio
+async def test_tutor_stream_disconnect_cancels_side_tasks(mock_ai):
+    """A client leaving mid-stream cancels the assessment and correction calls still running."""
+    pending = []
+
+    async def never(*args, **kwargs):
+        task = asyncio.current_task()
+        pending.append(task)
+        await asyncio.Event().wait()
+
+    async def stream(prompt, **kwargs):
+        while True:
+            yield "Ciao"
+            await asyncio.sleep(0)
+
+    backend = MagicMock(classify=never, stream=stream)
+    request = TutorRequest(user_message="Ciao", chat_history=[], target_language="it", native_language="en", level="A1")
+    with patch("server.is_loading", False), \
+         patch("server.model_router.backend", return_value=backend), patch("server.cached_generate", never):
+        response = await tutor_mode_stream(request)
+        body = response.body_iterator
+        assert "token" in await body.__anext__()
+        await asyncio.sleep(0)
+        await body.aclose()
+        await asyncio.sleep(0)
+    assert len(pending) == 2
+    assert all(task.cancelled() for task in pending)
+
+# --- SPEECH-TO-TEXT TESTS ---
+
+@pytest.mark.asyncio
+async def test_oversized_audio_upload_is_rejected():
+    """Uploads over the size limit get 413 before anything is decoded or transcribed."""
+    with patch("server.MAX_AUDIO_UPLOAD_MB", 0.01):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+            response = await ac.post("/api/v1/voice/transcribe", files={"file": ("clip.webm", b"\0" * 20000)})
+    assert response.status_code == 413
+
+def test_voice_stream_emits_final_at_end_of_speech():
+    """The streaming STT socket closes an utterance on silence and sends its final transcript."""
+    async def fake_transcribe(audio, language=None, **options):
+        return {"text": "ciao", "language": language}
+
+    t = np.arange(16000) / 16000
+    speech = 0.3 * np.sin(2 * np.pi * 300 * t)
+    audio = np.concatenate([np.zeros(8000), speech, np.zeros(16000)])
+    pcm = (audio * 32767).astype("<i2").tobytes()
+    with patch("server.transcribe_samples", fake_transcribe):
+        with TestClient(app).websocket_connect("/api/v1/voice/stream?language=it") as ws:
+            for i in range(0, len(pcm), 3200):
+                ws.send_bytes(pcm[i:i + 3200])
+            messages = [ws.receive_json()]
+            while messages[-1]["type"] != "final":
+                messages.append(ws.receive_json())
+    assert messages[0] == {"type": "speech_start"}
+    assert all(m["type"] == "partial" for m in messages[1:-1])
+    assert messages[-1]["text"] == "ciao"
+
+@pytest.mark.asyncio
+async def test_concurrent_utterances_are_transcribed_in_one_batch():
+    """Voice requests arriving together share one STT batch and each gets its own result back."""
+    batches = []
+    backend = MagicMock()
+    backend.transcribe_batch.side_effect = lambda audios, **kw: batches.append(len(audios)) or [{"text": str(a.size)} for a in audios]
+    with patch("server.get_whisper_model", AsyncMock(return_value=backend)), patch("server.LLM_BACKEND", "local"):
+        results = await asyncio.gather(*[transcribe_samples(np.zeros(n, dtype=np.float32), language="it") for n in (100, 200, 300)])
+    assert batches == [3]
+    assert [r["text"] for r in results] == ["100", "200", "300"]
+
+class ScriptedVAD:
+    """Replays one list of events per push"""
+    end_samples = 1600
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.in_speech = False
+
+    def push(self, samples):
+        events = self.script.pop(0)
+        if events:
+            self.in_speech = events[-1] == "start"
+        return events
+
+@pytest.mark.asyncio
+async def test_streaming_finals_are_sent_in_utterance_order():
+    """A short utterance closing while the previous one waits on its slow partial is still sent second."""
+    release = asyncio.Event()
+
+    async def transcribe(audio, partial):
+        if partial:
+            await release.wait()
+            return {"text": "first"}
+        return {"text": "second"}
+
+    sent = []
+
+    async def emit(message):
+        sent.append(message)
+
+    transcriber = StreamingTranscriber(transcribe, emit, vad=ScriptedVAD([["start"], ["end"], ["start"], ["end"]]),
+                                       partial_interval=0.0, pre_roll_seconds=0.0)
+    # Utterance 1: its partial covers all the speech, so its final waits for that partial
+    await transcriber.push(np.ones(1600, dtype=np.float32))
+    await transcriber.push(np.zeros(1600, dtype=np.float32))
+    # Utterance 2: longer than the partial, decoded right away
+    await transcriber.push(np.ones(3200, dtype=np.float32))
+    await transcriber.push(np.zeros(1600, dtype=np.float32))
+    await asyncio.sleep(0.01)
+    assert [m for m in sent if m["type"] == "final"] == []
+
+    release.set()
+    await transcriber.flush()
+    assert [m["text"] for m in sent if m["type"] == "final"] == ["first", "second"]
+
+# --- MODEL REGISTRY TESTS ---
+
+@pytest.mark.asyncio
+async def test_model_registry_evicts_idle_models_only_when_unused():
+    """A model in use stays resident past its idle timeout; once released it is evicted and reloaded on demand."""
+    registry = ModelRegistry(idle_seconds=60)
+    registry.register("whisper", lambda: object())
+    first = await registry.get("whisper")
+    async with registry.use("whisper"):
+        assert registry.evict_idle(now=time.monotonic() + 120) == []
+    assert registry.evict_idle(now=time.monotonic() + 120) == ["whisper"]
+    assert registry.loaded("whisper") is None
+    assert await registry.get("whisper") is not first
+
+@pytest.mark.asyncio
+async def test_model_registry_measures_models_outside_torch():
+    """A model torch cannot see (e.g. CTranslate2) is sized from memory use around its load and counts against the budget."""
+    def load():
+        # 64 MB of touched pages, held by something that is not a torch module
+        return SimpleNamespace(weights=np.ones(8 * 2**20))
+
+    registry = ModelRegistry(memory_budget_bytes=100 * 2**20)
+    registry.register("whisper", load)
+    registry.register("other", load)
+    await registry.get("whisper")
+    assert registry.stats()["models"]["whisper"]["footprint_mb"] >= 48
+
+    await registry.get("other")
+    registry.evict("other")
+    # Reloading "other" would take the budget past 100 MB, so the idle Whisper goes
+    await registry.get("other")
+    assert registry.loaded("whisper") is None
+
+# --- CONVERSATION HISTORY TESTS ---
+
+def _history(n):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"turn {i}"} for i in range(n)]
+
+async def _summaries_settled(manager):
+    """Let the loop run until no background summary is in flight"""
+    while manager.stats()["pending_summaries"]:
+        await asyncio.sleep(0)
+
+@pytest.mark.asyncio
+async def test_history_keeps_min_recent_turns_when_trimming():
+    """The summary cut is rounded down, so the min_recent newest turns are always kept verbatim."""
+    async def summarize(previous, messages):
+        return "summary"
+
+    # Each message costs 10 tokens; next to the system prompt and a summary exactly 4 turns fit
+    manager = HistoryManager(lambda text: 10 - MESSAGE_OVERHEAD_TOKENS, summarize, {"tutor": 60},
+                             min_recent=4, summary_step=4, summary_tokens=5)
+    messages = _history(10)
+    manager.fit("tutor", "system", messages)
+    await _summaries_settled(manager)
+
+    fitted = manager.fit("tutor", "system", messages)
+    assert fitted.summary == "summary"
+    assert fitted.summarized == 4
+    assert fitted.messages == messages[4:]
+
+@pytest.mark.asyncio
+async def test_history_keeps_turns_no_summary_covers_yet():
+    """Turns between the cached summary's coverage and the new cut stay verbatim until their summary lands."""
+    async def summarize(previous, messages):
+        return f"{previous or ''}+{len(messages)}"
+
+    manager = HistoryManager(lambda text: 10 - MESSAGE_OVERHEAD_TOKENS, summarize, {"tutor": 100},
+                             min_recent=2, summary_step=2, summary_tokens=5)
+    messages = _history(10)
+
+    # First trim: nothing is summarized yet, so nothing is dropped
+    first = manager.fit("tutor", "system", messages)
+    assert first.pending and first.summary is None
+    assert first.messages == messages
+    await _summaries_settled(manager)
+
+    covered = manager.fit("tutor", "system", messages)
+    assert covered.summary is not None and not covered.pending
+    assert covered.messages == messages[covered.summarized:]
+
+    # Two more turns move the cut past what the cached summary covers
+    longer = messages + _history(12)[10:]
+    fitted = manager.fit("tutor", "system", longer)
+    assert fitted.pending
+    assert fitted.summarized == covered.summarized
+    assert fitted.messages == longer[covered.summarized:]
+
+# --- PRACTICE MODE TESTS ---
+
+def test_goal_check_waits_for_scenario_preconditions():
+    """The coffee order skips the LLM goal check until seating, a price and a goodbye have come up."""
+    scenario = get_scenario_template("coffee_order")
+    history = [
+        {"role": "assistant", "content": "Buongiorno! Cosa desidera?"},
+        {"role": "user", "content": "Vorrei un cappuccino e un cornetto."},
+    ]
+    assert not should_check_goal(scenario, history)
+    history += [
+        {"role": "assistant", "content": "Al banco o al tavolo?"},
+        {"role": "user", "content": "Al tavolo, per favore."},
+        {"role": "assistant", "content": "Perfetto, sono 4,50 €."},
+        {"role": "user", "content": "Grazie mille, arrivederci!"},
+    ]
+    assert should_check_goal(scenario, history)
+
+def test_completion_slots_ignore_everyday_words():
+    """Filler like "ok"/"ecco" is not a goodbye, and "te" as a pronoun is not an order of tea."""
+    scenario = get_scenario_template("coffee_order")
+    history = [
+        {"role": "user", "content": "Ok, ecco. Per te va bene?"},
+        {"role": "assistant", "content": "Al banco, sono 2,50 euro."},
+        {"role": "user", "content": "Okay, booking the table."},
+    ]
+    assert missing_preconditions(scenario, history) == ["order", "acknowledgement"]
+    history += [
+        {"role": "user", "content": "Un tè, per favore."},
+        {"role": "user", "content": "Perfetto, buona giornata!"},
+    ]
+    assert missing_preconditions(scenario, history) == []
+
+@pytest.mark.asyncio
+async def test_fused_practice_turn_and_its_fallback(mock_ai):
+    """The fused call has room for the longest reply the schema allows; a cut-off object falls back to reply + goal check."""
+    longest = '{"scene_status": "COMPLETE", "reply": "' + "a" * 160 + '"}'
+    calls = []
+    prompts = []
+
+    async def generate(prompt, **kwargs):
+        calls.append(kwargs)
+        prompts.append(prompt)
+        if kwargs.get("json_schema") is PRACTICE_TURN_SCHEMA:
+            return outputs.pop(0)
+        if "json_schema" in kwargs:
+            return '{"thought": "order placed", "scene_status": "ACTIVE", "reply": "Altro?"}'
+        return "Ciao!"
+
+    scenario = get_scenario_template("coffee_order")
+    history = [{"role": "assistant", "content": "Buongiorno!"}, {"role": "user", "content": "Un caffè, per favore."}]
+    backend = MagicMock(generate=generate)
+    with patch("server.model_router.backend", return_value=backend), patch("server.should_check_goal", return_value=True), \
+         patch("server.PRACTICE_FUSED_TURN", True):
+        outputs = [longest]
+        fused = await run_practice_turn(scenario, "You are Marco.", history, "it", "Test")
+        assert fused == {"thought": "", "scene_status": "COMPLETE", "reply": "a" * 160}
+        # Constrained decoding only allows tokens with visible text, so an object takes at most one
+        # token per character: the budget covers the schema's longest object plus the end token
+        assert len(longest) == max_output_length(PRACTICE_TURN_SCHEMA)
+        assert calls[0]["max_new_tokens"] == max_output_length(PRACTICE_TURN_SCHEMA) + 1
+        assert "your next line, in Italian" in prompts[0]
+
+        calls.clear()
+        outputs = ['{"scene_status": "ACTIVE", "reply": "Cia']
+        fallback = await run_practice_turn(scenario, "You are Marco.", history, "it", "Test")
+    assert len(calls) == 3
+    assert fallback["reply"] == "Ciao!" and fallback["scene_status"] == "ACTIVE"